@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Optional, Dict
 from datetime import datetime
 import json
@@ -12,9 +13,14 @@ from app.schemas.sensitive_word import (
 from app.services.sensitive_word import (
     add_sensitive_word, delete_sensitive_word, get_all_sensitive_words, 
     get_sensitive_records, get_categories, add_category, update_category,
-    delete_category, bulk_import_sensitive_words
+    delete_category, bulk_import_sensitive_words, get_filter_memory_report,
+    check_texts_batch
 )
 from app.models.sensitive_word import SENSITIVE_WORD_CATEGORIES, SENSITIVE_WORD_SUBCATEGORIES
+from app.services.ollama import backend_pool
+from app.services.response_cache import response_cache
+from app.utils.compact_trie import MATCH_MODES
+from app.utils.metrics import metrics
 
 router = APIRouter()
 
@@ -118,6 +124,86 @@ async def list_sensitive_words(
     """
     return await get_all_sensitive_words(category, subcategory, min_severity, max_severity)
 
+@router.get("/sensitive-words/memory-report", response_model=dict)
+async def sensitive_word_memory_report(
+    _: dict = Depends(get_current_admin_user)
+):
+    """获取敏感词过滤器内存占用报告（仅管理员）"""
+    return await get_filter_memory_report()
+
+@router.post("/sensitive-words/check-batch")
+async def check_texts_in_batch(
+    request: Request,
+    mode: str = "first",
+    _: dict = Depends(get_current_admin_user)
+):
+    """批量检查文本（仅管理员），用于词库变更后重新筛查历史消息
+    
+    请求体支持两种格式:
+    - JSON: 字符串数组，或包含 text（及可选 id）字段的对象数组
+    - NDJSON（Content-Type: application/x-ndjson）: 每行一个字符串或对象，结果同样按行返回
+    
+    每条结果为敏感词ID及命中次数，mode 为匹配模式（first / longest / all）
+    """
+    if mode not in MATCH_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"无效的匹配模式，有效模式: {', '.join(MATCH_MODES)}"
+        )
+    
+    body = await request.body()
+    ndjson = "ndjson" in request.headers.get("content-type", "")
+    try:
+        if ndjson:
+            items = [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+        else:
+            items = json.loads(body)
+        ids = [item.get("id") if isinstance(item, dict) else None for item in items]
+        texts = [item["text"] if isinstance(item, dict) else item for item in items]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="请求体应为字符串数组、对象数组或NDJSON"
+        )
+    if not all(isinstance(text, str) for text in texts):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="text 字段必须是字符串"
+        )
+    
+    results = await check_texts_batch(texts, mode)
+    for item_id, result in zip(ids, results):
+        if item_id is not None:
+            result["id"] = item_id
+    
+    if ndjson:
+        return StreamingResponse(
+            (json.dumps(result, ensure_ascii=False) + "\n" for result in results),
+            media_type="application/x-ndjson"
+        )
+    return {"count": len(results), "results": results}
+
+@router.get("/metrics", response_model=dict)
+async def get_metrics(
+    _: dict = Depends(get_current_admin_user)
+):
+    """获取当前worker的运行指标（仅管理员）"""
+    return metrics.snapshot()
+
+@router.get("/ollama-backends", response_model=list)
+async def list_ollama_backends(
+    _: dict = Depends(get_current_admin_user)
+):
+    """获取当前worker所见的Ollama节点状态：是否可用、正在处理的请求数和失败次数（仅管理员）"""
+    return backend_pool.status()
+
+@router.delete("/response-cache", status_code=status.HTTP_204_NO_CONTENT)
+async def clear_response_cache(
+    _: dict = Depends(get_current_admin_user)
+):
+    """清空模型回复缓存（仅管理员；进程内缓存只清空当前worker）"""
+    await response_cache.clear()
+
 @router.get("/sensitive-records", response_model=List[SensitiveRecordResponse])
 async def list_sensitive_records(
     user_id: Optional[str] = None,
@@ -1,7 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import json
+from datetime import datetime
+from typing import Dict, Any, Optional, AsyncIterator
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from app.api.deps import get_current_active_user
+from app.core.config import settings
 from app.schemas.conversation import MessageCreate, ConversationResponse
-from app.services.conversation import create_conversation, get_conversation, add_message, get_user_conversations
+from app.services.ollama import ModelOverloadedError, backend_pool
+from app.services.conversation import create_conversation, get_conversation, get_message_page, add_message, begin_turn, stream_turn, get_user_conversations
 
 router = APIRouter()
 
@@ -11,18 +17,34 @@ async def create_new_conversation(current_user: dict = Depends(get_current_activ
     conversation_id = await create_conversation(str(current_user["_id"]))
     return {"id": conversation_id}
 
-@router.get("/", response_model=list)
-async def list_conversations(current_user: dict = Depends(get_current_active_user)):
-    """获取用户的所有对话"""
-    conversations = await get_user_conversations(str(current_user["_id"]))
-    return conversations
+@router.get("/", response_model=dict)
+async def list_conversations(
+    limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_active_user)
+):
+    """获取用户的对话列表（按最近更新时间分页）
+    
+    可选参数:
+    - limit: 每页的对话数
+    - cursor: 上一页返回的 next_cursor
+    
+    只返回对话摘要（标题、预览、消息数和时间），消息内容请通过单个对话接口获取
+    """
+    try:
+        return await get_user_conversations(str(current_user["_id"]), limit, cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
 
 @router.get("/{conversation_id}", response_model=dict)
 async def get_single_conversation(
     conversation_id: str,
     current_user: dict = Depends(get_current_active_user)
 ):
-    """获取单个对话"""
+    """获取单个对话及最近一页消息，更早的消息通过 /{conversation_id}/messages 分页获取"""
     conversation = await get_conversation(conversation_id, str(current_user["_id"]))
     if not conversation:
         raise HTTPException(
@@ -31,6 +53,50 @@ async def get_single_conversation(
         )
     return conversation
 
+def _json_default(value: Any) -> str:
+    """序列化 json 不支持的类型：时间使用ISO格式，其余（如ObjectId）转为字符串"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=_json_default)
+
+async def stream_message_page(page: Dict[str, Any]) -> AsyncIterator[str]:
+    """将一页消息编码为JSON逐段输出，消息从数据库游标读出后立即写出"""
+    header = {key: value for key, value in page.items() if key != "messages"}
+    yield _dumps(header)[:-1] + ', "messages": ['
+    first = True
+    async for message in page["messages"]:
+        yield ("" if first else ",") + _dumps(message)
+        first = False
+    yield "]}"
+
+@router.get("/{conversation_id}/messages")
+async def list_messages(
+    conversation_id: str,
+    before: Optional[int] = Query(None, ge=0),
+    after: Optional[int] = Query(None, ge=-1),
+    limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_active_user)
+):
+    """分页获取对话消息
+    
+    可选参数:
+    - before: 返回seq小于该值的最近 limit 条消息，取值为上一页的 older_before
+    - after: 返回seq大于该值的 limit 条消息，取值为上一页的 newer_after（-1 表示从第一条消息开始）
+    - limit: 每页的消息数
+    
+    都不指定时返回最新的一页；响应以流的方式输出
+    """
+    page = await get_message_page(conversation_id, str(current_user["_id"]), limit, before, after)
+    if page is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="对话不存在"
+        )
+    return StreamingResponse(stream_message_page(page), media_type="application/json")
+
 @router.post("/{conversation_id}/messages")
 async def send_message(
     conversation_id: str,
@@ -38,15 +104,62 @@ async def send_message(
     current_user: dict = Depends(get_current_active_user)
 ):
     """发送消息并获取回复"""
-    # 检查对话是否存在
-    conversation = await get_conversation(conversation_id, str(current_user["_id"]))
-    if not conversation:
+    # 模型服务已满载时直接拒绝，不保存消息
+    backend_pool.check_admission()
+    
+    # 添加消息并获取回复（同时检查对话是否存在）
+    result = await add_message(conversation_id, str(current_user["_id"]), message.content)
+    if result is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="对话不存在"
         )
     
-    # 添加消息并获取回复
-    result = await add_message(conversation_id, str(current_user["_id"]), message.content)
+    return result
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """将事件编码为Server-Sent Events格式"""
+    data = _dumps(event["data"])
+    return f"event: {event['event']}\ndata: {data}\n\n"
+
+@router.post("/{conversation_id}/messages/stream")
+async def send_message_stream(
+    conversation_id: str,
+    message: MessageCreate,
+    current_user: dict = Depends(get_current_active_user)
+):
+    """
+    发送消息并以Server-Sent Events流式返回回复
+    
+    事件依次为 message（用户消息的检查结果）、若干 token（屏蔽后的回复片段）和 done（最终结果）；
+    模型服务排队超时时以 error 事件结束。
+    done 中 assistant_cut_off 为真时，客户端应将已显示的片段替换为 assistant_response
+    """
+    # 响应开始前判断是否满载，满载时返回429
+    backend_pool.check_admission()
+    
+    # 响应开始前检查对话是否存在（之后无法再返回404），同时检查用户消息并读取历史
+    turn = await begin_turn(conversation_id, str(current_user["_id"]), message.content)
+    if turn is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="对话不存在"
+        )
+    
+    async def event_stream():
+        try:
+            async for event in stream_turn(turn):
+                yield format_sse(event)
+        except ModelOverloadedError as e:
+            # 响应已经开始，排队超时以 error 事件告知客户端
+            yield format_sse({
+                "event": "error",
+                "data": {"status_code": e.status_code, "detail": e.detail, "retry_after": e.retry_after}
+            })
     
-    return result
\ No newline at end of file
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # 禁止代理缓冲，片段生成后立即送达客户端
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -22,5 +22,115 @@ class Settings(BaseSettings):
     # Ollama配置
     OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
     OLLAMA_MODEL: str = os.getenv("OLLAMA_MODEL", "llama2")
+    # 多个Ollama节点（逗号分隔），请求分配给负载最低的可用节点；留空则只使用 OLLAMA_BASE_URL
+    OLLAMA_BASE_URLS: str = os.getenv("OLLAMA_BASE_URLS", "")
+    # 一次生成最多尝试的节点数（出错时换节点重试）
+    OLLAMA_MAX_ATTEMPTS: int = int(os.getenv("OLLAMA_MAX_ATTEMPTS", "2"))
+    # 节点连续失败多少次后被摘除，以及摘除的时长（秒）
+    OLLAMA_MAX_FAILURES: int = int(os.getenv("OLLAMA_MAX_FAILURES", "2"))
+    OLLAMA_EJECT_SECONDS: float = float(os.getenv("OLLAMA_EJECT_SECONDS", "30.0"))
+    # 节点健康检查的间隔和超时（秒），间隔为0时不检查
+    OLLAMA_HEALTH_CHECK_INTERVAL: float = float(os.getenv("OLLAMA_HEALTH_CHECK_INTERVAL", "10.0"))
+    OLLAMA_HEALTH_CHECK_TIMEOUT: float = float(os.getenv("OLLAMA_HEALTH_CHECK_TIMEOUT", "2.0"))
+    # 准入控制：每个节点同时处理的请求数上限、等待队列长度和最长排队时间（秒）
+    # 这些限制按 worker 进程计算：N 个 uvicorn worker 时，每个节点最多同时处理 N × OLLAMA_BACKEND_CONCURRENCY 个请求，
+    # 需要按节点的实际容量除以 worker 数量配置
+    OLLAMA_BACKEND_CONCURRENCY: int = int(os.getenv("OLLAMA_BACKEND_CONCURRENCY", "4"))
+    OLLAMA_QUEUE_SIZE: int = int(os.getenv("OLLAMA_QUEUE_SIZE", "64"))
+    OLLAMA_QUEUE_TIMEOUT: float = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "30.0"))
+    # 请求被拒绝时建议客户端等待的秒数（Retry-After）
+    OLLAMA_RETRY_AFTER: int = int(os.getenv("OLLAMA_RETRY_AFTER", "5"))
+    # 以流式方式调用模型，边生成边检查回复中的敏感词
+    OLLAMA_STREAM: bool = os.getenv("OLLAMA_STREAM", "true").lower() == "true"
+    # 调用方式：chat 使用 /api/chat 发送结构化消息，generate 使用 /api/generate 发送拼接后的提示词
+    OLLAMA_API_MODE: str = os.getenv("OLLAMA_API_MODE", "chat")
+    # 生成结束后模型在节点上常驻的时长（如 30m；-1 表示一直常驻），留空则使用Ollama的默认值
+    OLLAMA_KEEP_ALIVE: str = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+    # 连接池：最大连接数、最大空闲保活连接数及空闲连接保留时间（秒）
+    OLLAMA_MAX_CONNECTIONS: int = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "100"))
+    OLLAMA_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    OLLAMA_KEEPALIVE_EXPIRY: float = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "30.0"))
+    # 超时（秒）：建立连接、等待连接池空闲连接，以及读写超时（流式模式下为两段输出之间的最长间隔）
+    OLLAMA_CONNECT_TIMEOUT: float = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5.0"))
+    OLLAMA_POOL_TIMEOUT: float = float(os.getenv("OLLAMA_POOL_TIMEOUT", "10.0"))
+    OLLAMA_READ_TIMEOUT: float = float(os.getenv("OLLAMA_READ_TIMEOUT", "60.0"))
+    
+    # 上下文窗口：发送给模型的历史消息的token预算（估算值），可按模型分别配置，如 {"llama2": 3000}
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+    CONTEXT_TOKEN_BUDGETS: str = os.getenv("CONTEXT_TOKEN_BUDGETS", "")
+    # 放不下的较早消息的处理方式：truncate（截断最近一条放不下的消息）、summarize（压缩为摘要）或 drop（丢弃）
+    CONTEXT_OVERFLOW: str = os.getenv("CONTEXT_OVERFLOW", "truncate")
+    # 摘要最多占用的token数
+    CONTEXT_SUMMARY_TOKENS: int = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "256"))
+    # 每轮最多读取的历史消息条数
+    CONTEXT_MAX_MESSAGES: int = int(os.getenv("CONTEXT_MAX_MESSAGES", "50"))
+    
+    # 模型回复缓存：相同消息窗口的请求直接返回缓存的回复（不含敏感词的回复才会被缓存）
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+    # 缓存有效期（秒）以及进程内缓存的条目数和总字节数上限
+    RESPONSE_CACHE_TTL: int = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+    # 第二层缓存：mongo 表示保存在 response_cache 集合中由所有worker共享，留空则只使用进程内缓存
+    RESPONSE_CACHE_BACKEND: str = os.getenv("RESPONSE_CACHE_BACKEND", "")
+    
+    # 列表分页：默认每页条数和单页最大条数
+    PAGE_SIZE: int = int(os.getenv("PAGE_SIZE", "20"))
+    MAX_PAGE_SIZE: int = int(os.getenv("MAX_PAGE_SIZE", "100"))
+    
+    # 敏感词过滤配置
+    # 匹配引擎：automaton 为对象Trie上的AC自动机，compact 为数组存储的紧凑自动机（内存占用更低）
+    SENSITIVE_FILTER_ENGINE: str = os.getenv("SENSITIVE_FILTER_ENGINE", "automaton")
+    # 增量修改敏感词后，延迟多少秒合并重建匹配结构
+    SENSITIVE_FILTER_REBUILD_DELAY: float = float(os.getenv("SENSITIVE_FILTER_REBUILD_DELAY", "1.0"))
+    # 多worker词库同步：auto（优先使用change stream，不支持时轮询变更日志）、change_stream、poll 或 off
+    SENSITIVE_WORD_SYNC_MODE: str = os.getenv("SENSITIVE_WORD_SYNC_MODE", "auto")
+    # 轮询变更日志的间隔（秒），即poll模式下各worker词库收敛的最大延迟
+    SENSITIVE_WORD_SYNC_INTERVAL: float = float(os.getenv("SENSITIVE_WORD_SYNC_INTERVAL", "2.0"))
+    # 每次从变更日志读取的最大条数，落后较多的worker分批追赶；也是一次合并应用的change stream事件数上限
+    SENSITIVE_WORD_SYNC_BATCH: int = int(os.getenv("SENSITIVE_WORD_SYNC_BATCH", "500"))
+    # 变更日志的保留时间（秒），过期的日志由TTL索引自动删除；落后超过该时间的worker会完整重新加载词库
+    SENSITIVE_WORD_CHANGES_TTL: int = int(os.getenv("SENSITIVE_WORD_CHANGES_TTL", str(7 * 24 * 3600)))
+    # 预编译词库快照文件路径，留空则不使用快照；由 build_lexicon_snapshot.py 生成
+    # 从快照加载时两种引擎都直接使用映射的紧凑自动机，automaton 引擎在首次增量修改后的后台重建中才构建对象Trie
+    SENSITIVE_FILTER_SNAPSHOT_PATH: str = os.getenv("SENSITIVE_FILTER_SNAPSHOT_PATH", "")
+    # 共享内存目录（建议位于 /dev/shm），设置后 compact 引擎的自动机由所有worker共同映射
+    SENSITIVE_FILTER_SHARED_DIR: str = os.getenv("SENSITIVE_FILTER_SHARED_DIR", "")
+    # 匹配前的文本归一化：全角字符转半角
+    SENSITIVE_NORMALIZE_WIDTH: bool = os.getenv("SENSITIVE_NORMALIZE_WIDTH", "true").lower() == "true"
+    # 使用内置的常用繁体字转简体字映射表
+    SENSITIVE_NORMALIZE_TRADITIONAL: bool = os.getenv("SENSITIVE_NORMALIZE_TRADITIONAL", "true").lower() == "true"
+    # 额外的字符映射表（JSON对象，如 {"氵": "水"}），留空则不使用
+    SENSITIVE_CHAR_MAP_PATH: str = os.getenv("SENSITIVE_CHAR_MAP_PATH", "")
+    # 匹配时跳过的干扰字符，如 "赌 博"、"赌*博" 视为 "赌博"
+    SENSITIVE_NOISE_CHARS: str = os.getenv(
+        "SENSITIVE_NOISE_CHARS", " \t\r\n*-_.,:;!?~`'\"/\\|+=#@&^%$()[]{}<>·，。、；：！？“”‘’（）【】《》…—～"
+    )
+    # 用户消息包含敏感词时的处理方式：refuse（拒绝回答）或 mask（屏蔽敏感词后继续对话）
+    SENSITIVE_WORD_ACTION: str = os.getenv("SENSITIVE_WORD_ACTION", "refuse")
+    # mask 模式下允许屏蔽后继续对话的最高严重程度，更严重的消息仍然拒绝回答
+    SENSITIVE_MASK_MAX_SEVERITY: int = int(os.getenv("SENSITIVE_MASK_MAX_SEVERITY", "3"))
+    # 屏蔽敏感词使用的字符
+    SENSITIVE_MASK_CHAR: str = os.getenv("SENSITIVE_MASK_CHAR", "*")
+    # 模型回复中出现严重程度达到该值的敏感词时立即停止生成，较轻的敏感词在回复中被屏蔽
+    SENSITIVE_STREAM_CUTOFF_SEVERITY: int = int(os.getenv("SENSITIVE_STREAM_CUTOFF_SEVERITY", "4"))
+    # count_text 每个敏感词最多返回的命中位置数
+    SENSITIVE_MAX_POSITIONS: int = int(os.getenv("SENSITIVE_MAX_POSITIONS", "20"))
+    # 消息和敏感词记录中最多保存的（去重后的）敏感词数量
+    SENSITIVE_MAX_STORED_WORDS: int = int(os.getenv("SENSITIVE_MAX_STORED_WORDS", "20"))
+    # 批量检查的进程池大小，1 表示不使用进程池
+    SENSITIVE_BATCH_WORKERS: int = int(os.getenv("SENSITIVE_BATCH_WORKERS", str(os.cpu_count() or 1)))
+    # 批量检查的文本数超过该值时拆分到进程池中并行检查
+    SENSITIVE_BATCH_PARALLEL_THRESHOLD: int = int(os.getenv("SENSITIVE_BATCH_PARALLEL_THRESHOLD", "2000"))
+    # 进程池中每个分片包含的文本数
+    SENSITIVE_BATCH_CHUNK_SIZE: int = int(os.getenv("SENSITIVE_BATCH_CHUNK_SIZE", "1000"))
+    # 批量检查快照的存放目录，留空则使用系统临时目录
+    SENSITIVE_BATCH_DIR: str = os.getenv("SENSITIVE_BATCH_DIR", "")
+    # 消息长度（字符数）达到该值时，敏感词扫描交给线程池执行，不阻塞事件循环
+    SENSITIVE_SCAN_OFFLOAD_THRESHOLD: int = int(os.getenv("SENSITIVE_SCAN_OFFLOAD_THRESHOLD", "8000"))
+    # 扫描线程池大小
+    SENSITIVE_SCAN_WORKERS: int = int(os.getenv("SENSITIVE_SCAN_WORKERS", "2"))
+    # 线程池满时最多排队的扫描数，超出后调用方异步等待
+    SENSITIVE_SCAN_MAX_PENDING: int = int(os.getenv("SENSITIVE_SCAN_MAX_PENDING", "32"))
 
 settings = Settings()
\ No newline at end of file
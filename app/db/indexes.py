@@ -0,0 +1,159 @@
+from typing import List, Dict, Any, Optional
+from bson import ObjectId
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from app.core.config import settings
+from app.db.mongodb import db
+
+# 索引注册表：集合名 -> 该集合应有的索引（_id 索引由MongoDB自动创建）
+# 索引名使用MongoDB的默认命名（字段_方向），与之前单独创建的索引同名，重复创建时不会冲突。
+# 新增查询时在此添加对应的索引，并在 QUERY_SHAPES 中登记查询形状
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # 登录和注册按用户名、邮箱查找
+        IndexModel([("username", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    "conversations": [
+        # 对话列表：按用户筛选，按 (updated_at, _id) 倒序分页
+        IndexModel([("user_id", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "messages": [
+        # 按对话和seq范围读取消息，同时保证seq不重复
+        IndexModel([("conversation_id", ASCENDING), ("seq", ASCENDING)], unique=True),
+    ],
+    "sensitive_records": [
+        # 管理员查询敏感词记录：各筛选条件 + 按时间倒序
+        IndexModel([("timestamp", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("conversation_id", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("sensitive_words_found.category", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("highest_severity", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "sensitive_words": [
+        # 按分类（和子分类）筛选、分类聚合、删除分类
+        IndexModel([("category", ASCENDING), ("subcategory", ASCENDING)]),
+        # 词库同步按归一化后的敏感词查找已删除敏感词的其他写法
+        IndexModel([("normalized_word", ASCENDING)]),
+    ],
+    "sensitive_word_changes": [
+        # 词库同步读取某个版本之后的变更；版本号由 lexicon_meta 原子分配，不会重复
+        IndexModel([("version", ASCENDING)], unique=True),
+        # 过期的变更日志由TTL索引自动删除；日志不连续的worker会退回完整加载
+        IndexModel([("timestamp", ASCENDING)], expireAfterSeconds=settings.SENSITIVE_WORD_CHANGES_TTL),
+    ],
+    "response_cache": [
+        # 过期的缓存回复由TTL索引自动删除
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+# 服务中的查询形状（集合, 查询条件, 排序），用于通过 explain 检查是否有查询缺少索引
+# 条件中的值只用于生成查询计划，不影响结果
+QUERY_SHAPES = [
+    ("users", {"username": ""}, None),
+    ("users", {"email": ""}, None),
+    ("conversations", {"user_id": ObjectId()}, [("updated_at", DESCENDING), ("_id", DESCENDING)]),
+    ("messages", {"conversation_id": ObjectId(), "seq": {"$gte": 0, "$lt": 20}}, [("seq", ASCENDING)]),
+    ("messages", {"conversation_id": ObjectId()}, [("seq", DESCENDING)]),
+    ("sensitive_records", {}, [("timestamp", DESCENDING)]),
+    ("sensitive_records", {"user_id": ObjectId()}, [("timestamp", DESCENDING)]),
+    ("sensitive_records", {"conversation_id": ObjectId()}, [("timestamp", DESCENDING)]),
+    ("sensitive_records", {"sensitive_words_found.category": ""}, [("timestamp", DESCENDING)]),
+    ("sensitive_records", {"highest_severity": {"$gte": 1, "$lte": 5}}, [("timestamp", DESCENDING)]),
+    ("sensitive_words", {"category": ""}, None),
+    ("sensitive_words", {"normalized_word": {"$in": [""]}}, None),
+    ("sensitive_word_changes", {"version": {"$gt": 0, "$lte": 1}}, [("version", ASCENDING)]),
+]
+
+def _database(database):
+    return database if database is not None else db.db
+
+async def ensure_indexes(collections: Optional[List[str]] = None, database=None) -> Dict[str, List[str]]:
+    """
+    创建注册表中的索引（已存在的索引不会重复创建）
+
+    某个集合的索引创建失败（如已有重复的用户名导致唯一索引无法建立）时打印错误并继续处理其他集合
+
+    Args:
+        collections: 只处理这些集合，默认为注册表中的全部集合
+        database: 数据库对象，默认为全局连接
+
+    Returns:
+        Dict: 集合名 -> 成功创建或确认存在的索引名
+    """
+    database = _database(database)
+    ensured = {}
+    for name, models in INDEXES.items():
+        if collections is not None and name not in collections:
+            continue
+        try:
+            ensured[name] = await database[name].create_indexes(models)
+        except OperationFailure as e:
+            print(f"创建 {name} 集合的索引出错: {str(e)}")
+    return ensured
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    """递归收集查询计划中的所有阶段名"""
+    stages = [plan["stage"]] if "stage" in plan else []
+    children = plan.get("inputStages", [])
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            children = children + [plan[key]]
+    for child in children:
+        stages.extend(_plan_stages(child))
+    return stages
+
+async def explain_query_shapes(database=None) -> List[Dict[str, Any]]:
+    """
+    对 QUERY_SHAPES 中的每个查询执行 explain，找出全表扫描（COLLSCAN）或在内存中排序（SORT）的查询
+
+    Returns:
+        List: 有问题的查询形状及其查询计划中的阶段
+    """
+    database = _database(database)
+    problems = []
+    for name, query, sort in QUERY_SHAPES:
+        cursor = database[name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        issues = [stage for stage in ("COLLSCAN", "SORT") if stage in stages]
+        if issues:
+            problems.append({
+                "collection": name,
+                "query": {key: str(value) for key, value in query.items()},
+                "sort": sort,
+                "issues": issues,
+                "stages": stages
+            })
+    return problems
+
+async def index_report(database=None) -> Dict[str, Any]:
+    """
+    对比注册表与数据库中实际存在的索引，并通过 $indexStats 统计各索引自上次重启以来的使用次数
+
+    Returns:
+        Dict: collections 为每个集合的 missing（注册表中有但数据库中没有）、
+        unused（存在但从未被使用）、undeclared（存在但不在注册表中）和各索引的使用次数；
+        slow_queries 为 explain_query_shapes 找出的问题查询
+    """
+    database = _database(database)
+    report = {}
+    for name, models in INDEXES.items():
+        declared = [model.document["name"] for model in models]
+        existing = await database[name].index_information()
+        usage = {}
+        try:
+            async for stats in database[name].aggregate([{"$indexStats": {}}]):
+                usage[stats["name"]] = stats["accesses"]["ops"]
+        except OperationFailure as e:
+            print(f"读取 {name} 集合的索引统计出错: {str(e)}")
+        report[name] = {
+            "missing": [index for index in declared if index not in existing],
+            "unused": [index for index in existing if index != "_id_" and usage.get(index) == 0],
+            "undeclared": [index for index in existing if index != "_id_" and index not in declared],
+            "usage": usage
+        }
+    return {"collections": report, "slow_queries": await explain_query_shapes(database)}
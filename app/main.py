@@ -1,9 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1.router import api_router
 from app.core.config import settings
 from app.db.mongodb import connect_to_mongo, close_mongo_connection
-from app.utils.sensitive_word_filter import sensitive_word_filter
+from app.db.indexes import ensure_indexes
+from app.services.ollama import (
+    ModelOverloadedError, connect_to_ollama, close_ollama_client, start_health_checks, stop_health_checks
+)
+from app.services.lexicon_sync import (
+    backfill_normalized_words, load_lexicon, start_lexicon_sync, stop_lexicon_sync
+)
+from app.utils.scan_dispatcher import scan_dispatcher
+from app.utils.sensitive_word_filter import shutdown_batch_pool
 
 app = FastAPI(
     title=settings.APP_NAME,
@@ -22,15 +31,34 @@ app.add_middleware(
 # 注册API路由
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
+@app.exception_handler(ModelOverloadedError)
+async def model_overloaded_handler(request: Request, exc: ModelOverloadedError):
+    """模型服务繁忙时快速返回429/503，并通过Retry-After告知客户端何时重试"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 @app.on_event("startup")
 async def startup_db_client():
-    """应用启动时连接数据库并加载敏感词"""
+    """应用启动时连接数据库并创建索引、创建Ollama客户端并启动节点健康检查、补写归一化敏感词字段、加载敏感词并启动多worker词库同步"""
     await connect_to_mongo()
-    await sensitive_word_filter.load_sensitive_words()
+    await ensure_indexes()
+    await connect_to_ollama()
+    start_health_checks()
+    await backfill_normalized_words()
+    await load_lexicon()
+    start_lexicon_sync()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    """应用关闭时断开数据库连接"""
+    """应用关闭时停止词库同步和节点健康检查、关闭扫描线程池、批量检查进程池和Ollama客户端并断开数据库连接"""
+    await stop_lexicon_sync()
+    await stop_health_checks()
+    scan_dispatcher.shutdown()
+    shutdown_batch_pool()
+    await close_ollama_client()
     await close_mongo_connection()
 
 @app.get("/")
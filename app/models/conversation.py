@@ -4,8 +4,10 @@ from pydantic import BaseModel, Field
 from bson import ObjectId
 from app.models.user import PyObjectId
 
-# 消息模型
+# 消息模型（messages 集合，以 conversation_id 和 seq 唯一标识）
 class MessageModel(BaseModel):
+    conversation_id: Optional[PyObjectId] = None
+    seq: int = 0  # 消息在对话中的序号，从0开始
     role: str  # "user" 或 "assistant"
     content: str
     timestamp: datetime = Field(default_factory=datetime.now)
@@ -20,7 +22,11 @@ class MessageModel(BaseModel):
 class ConversationModel(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     user_id: PyObjectId
-    messages: List[MessageModel] = []
+    title: str = ""  # 第一条用户消息的第一行，用于对话列表
+    preview: str = ""  # 最后一条消息的摘要，用于对话列表
+    message_count: int = 0  # 已分配的seq数，即下一条消息的seq（包含中途失败、未保存的轮次）
+    saved_message_count: int = 0  # 实际保存的消息数，用于对话列表
+    recent_messages: List[dict] = []  # 最近消息的精简副本（seq、role、content、timestamp），用于构建上下文
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
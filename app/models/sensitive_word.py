@@ -36,6 +36,7 @@ SENSITIVE_WORD_SUBCATEGORIES = {
 class SensitiveWordModel(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     word: str
+    normalized_word: str = Field("", description="按当前归一化配置处理后的敏感词，用于查找同一敏感词的不同写法")
     category: str = Field(..., description="敏感词主分类")
     subcategory: Optional[str] = Field(None, description="敏感词子分类")
     severity: Optional[int] = Field(1, description="严重程度 1-5，5为最严重", ge=1, le=5)
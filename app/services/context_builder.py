@@ -0,0 +1,131 @@
+import json
+import re
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
+from app.core.config import settings
+
+# 每条消息的角色标记、分隔符等固定开销（token）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 截断后剩余预算少于该值时不再保留被截断的消息
+MIN_TRUNCATED_TOKENS = 32
+
+# 摘要中每条较早消息最多保留的字符数
+SUMMARY_SNIPPET_CHARS = 60
+
+# 截断处的标记
+TRUNCATION_MARK = "……"
+
+# 中日韩文字、全角符号等大多单独成为一个token，其余文本约4个字符一个token
+_WIDE_CHARS = re.compile("[⺀-￿]")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数，不依赖具体模型的分词器"""
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+@lru_cache(maxsize=8)
+def _parse_budgets(raw: str) -> Dict[str, int]:
+    try:
+        budgets = json.loads(raw) if raw else {}
+        return {str(model): int(budget) for model, budget in budgets.items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"CONTEXT_TOKEN_BUDGETS 格式无效，使用默认预算: {str(e)}")
+        return {}
+
+def model_budget(model: Optional[str] = None) -> int:
+    """模型的上下文token预算：CONTEXT_TOKEN_BUDGETS 中按模型配置，未配置时为 CONTEXT_TOKEN_BUDGET"""
+    budgets = _parse_budgets(settings.CONTEXT_TOKEN_BUDGETS)
+    return budgets.get(model or settings.OLLAMA_MODEL, settings.CONTEXT_TOKEN_BUDGET)
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """截断文本使其不超过 budget 个token，保留开头和结尾"""
+    if estimate_tokens(text) <= budget:
+        return text
+    if budget <= 0:
+        return ""
+    keep = len(text) * budget // estimate_tokens(text)
+    while keep > 0:
+        head = keep // 2
+        truncated = text[:head] + TRUNCATION_MARK + text[len(text) - (keep - head):]
+        if estimate_tokens(truncated) <= budget:
+            return truncated
+        keep = keep * 9 // 10
+    return ""
+
+def summarize_messages(messages: List[Dict[str, str]], budget: int) -> str:
+    """
+    将较早的消息压缩为一段摘要：每条消息只保留开头部分，从最近的消息开始，直到用完预算
+
+    摘要是抽取式的，不额外调用模型
+    """
+    header = "较早的对话摘要：\n"
+    budget -= estimate_tokens(header)
+    lines = []
+    for msg in reversed(messages):
+        speaker = "用户" if msg["role"] == "user" else "助手"
+        snippet = " ".join(msg["content"].split())
+        if len(snippet) > SUMMARY_SNIPPET_CHARS:
+            snippet = snippet[:SUMMARY_SNIPPET_CHARS] + TRUNCATION_MARK
+        line = f"{speaker}：{snippet}"
+        cost = estimate_tokens(line) + 1
+        if cost > budget:
+            # 放不下时截断这一条后结束
+            line = truncate_to_tokens(line, budget - 1)
+            if line:
+                lines.append(line)
+            break
+        lines.append(line)
+        budget -= cost
+    if not lines:
+        return ""
+    return header + "\n".join(reversed(lines))
+
+def build_context(messages: List[Dict[str, Any]], model: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    按token预算从最新的消息开始选取对话历史
+
+    最新的消息总会被保留（超出预算时截断）。放不下的较早消息按 CONTEXT_OVERFLOW 处理：
+    drop 直接丢弃；truncate 截断最近一条放不下的消息以用满预算；
+    summarize 将放不下的消息压缩为一条系统消息（最多 CONTEXT_SUMMARY_TOKENS 个token）放在最前面
+
+    Args:
+        messages: 按时间顺序排列的对话消息
+        model: 模型名称，决定预算，默认为 OLLAMA_MODEL
+
+    Returns:
+        List: 发送给模型的消息，格式为[{"role": "user", "content": "..."}, ...]
+    """
+    budget = model_budget(model)
+    selected = []
+    used = 0
+    remaining = len(messages)
+    while remaining > 0:
+        msg = messages[remaining - 1]
+        cost = estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        selected.append({"role": msg["role"], "content": msg["content"]})
+        used += cost
+        remaining -= 1
+
+    if not selected and messages:
+        # 最新的消息本身超出预算
+        newest = messages[-1]
+        content = truncate_to_tokens(newest["content"], budget - MESSAGE_OVERHEAD_TOKENS)
+        selected.append({"role": newest["role"], "content": content})
+        used = budget
+        remaining -= 1
+
+    older = messages[:remaining]
+    available = budget - used - MESSAGE_OVERHEAD_TOKENS
+    if older and settings.CONTEXT_OVERFLOW == "truncate" and available >= MIN_TRUNCATED_TOKENS:
+        msg = older[-1]
+        selected.append({"role": msg["role"], "content": truncate_to_tokens(msg["content"], available)})
+    elif older and settings.CONTEXT_OVERFLOW == "summarize":
+        summary = summarize_messages(older, min(settings.CONTEXT_SUMMARY_TOKENS, available))
+        if summary:
+            selected.append({"role": "system", "content": summary})
+
+    selected.reverse()
+    return selected
@@ -1,15 +1,36 @@
-from typing import List, Dict, Any, Optional
+import asyncio
+import base64
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 from datetime import datetime
 from bson import ObjectId
+from app.core.config import settings
 from app.db.mongodb import db
-from app.services.ollama import generate_response
+from app.services.ollama import FALLBACK_MESSAGES, IncompleteResponseError, generate_response, stream_response
+from app.services.context_builder import build_context
+from app.services.message_store import iter_messages, recent_messages, reserve_turn, save_turn
+from app.services.response_cache import response_cache
+from app.utils.scan_dispatcher import scan_dispatcher
 from app.utils.sensitive_word_filter import sensitive_word_filter
 
+# 模型回复因包含严重敏感词被中断时返回的内容
+REPLY_CUT_OFF_MESSAGE = "当前回答包含不当内容，已停止生成。"
+# 用户消息包含敏感词且未屏蔽时的拒绝回复
+REFUSAL_MESSAGE = "当前问题暂无法回答。"
+# 回复生成出错或被取消、且没有生成任何内容时保存的助手消息
+REPLY_INTERRUPTED_MESSAGE = "回答生成失败，已中断。"
+
+# 已开始但尚未完成的保存任务；请求被取消后保存仍在后台完成，保留引用避免任务被回收
+_pending_saves = set()
+
 async def create_conversation(user_id: str) -> str:
     """创建新对话"""
     conversation = {
         "user_id": ObjectId(user_id),
-        "messages": [],
+        "title": "",
+        "preview": "",
+        "message_count": 0,
+        "saved_message_count": 0,
+        "recent_messages": [],
         "created_at": datetime.now(),
         "updated_at": datetime.now()
     }
@@ -17,59 +38,127 @@ async def create_conversation(user_id: str) -> str:
     result = await db.db.conversations.insert_one(conversation)
     return str(result.inserted_id)
 
+def _pop_saved_message_count(conversation: Dict[str, Any]) -> int:
+    """
+    取出对话已保存的消息数
+
+    对话文档的 message_count 是seq分配计数，包含中途失败的轮次；saved_message_count 才是实际保存的消息数。
+    尚未补全该字段的旧对话退回使用分配计数
+    """
+    count = conversation.pop("saved_message_count", None)
+    return count if count is not None else conversation.get("message_count", 0)
+
 async def get_conversation(conversation_id: str, user_id: str) -> Optional[Dict]:
-    """获取对话"""
-    conversation = await db.db.conversations.find_one({
-        "_id": ObjectId(conversation_id),
-        "user_id": ObjectId(user_id)
-    })
+    """
+    获取对话及最近一页（PAGE_SIZE 条）消息
+    
+    older_before 为获取更早消息时使用的 before 参数，没有更早的消息时为None
+    """
+    conversation = await db.db.conversations.find_one(
+        {"_id": ObjectId(conversation_id), "user_id": ObjectId(user_id)},
+        {"recent_messages": 0}
+    )
     
     if conversation:
+        messages = await recent_messages(conversation_id, settings.PAGE_SIZE)
+        conversation["messages"] = messages
+        conversation["older_before"] = messages[0]["seq"] if messages and messages[0]["seq"] > 0 else None
+        conversation["message_count"] = _pop_saved_message_count(conversation)
         conversation["_id"] = str(conversation["_id"])
         conversation["user_id"] = str(conversation["user_id"])
     
     return conversation
 
-async def add_message(conversation_id: str, user_id: str, content: str) -> Dict[str, Any]:
+async def get_message_page(
+    conversation_id: str,
+    user_id: str,
+    limit: int,
+    before: Optional[int] = None,
+    after: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
     """
-    添加用户消息并获取AI回复
+    获取对话中一段连续seq范围内的消息
+    
+    - before: 返回seq小于 before 的最近 limit 条消息（向前翻页）
+    - after: 返回seq大于 after 的 limit 条消息（向后翻页）
+    - 都不指定时返回最新的 limit 条消息
+    
+    消息以异步迭代器返回，由调用方逐条输出，不在内存中组装整页
+    
+    Returns:
+        Dict: message_count 为对话已保存的消息数，older_before / newer_after 为继续翻页的游标（没有更多消息时为None），
+        messages 为按seq顺序排列的消息迭代器；对话不存在或不属于该用户时返回None
+    """
+    conversation = await db.db.conversations.find_one(
+        {"_id": ObjectId(conversation_id), "user_id": ObjectId(user_id)},
+        {"message_count": 1, "saved_message_count": 1}
+    )
+    if conversation is None:
+        return None
+    
+    # 按seq范围分页使用已分配的seq上界，而不是已保存的消息数
+    count = conversation.get("message_count", 0)
+    # 消息的seq是连续分配的，按seq范围取一页即可直接使用索引，不需要排序后跳过
+    # （保存失败的轮次会留下空缺，此时该页的消息少于 limit 条）
+    if after is not None:
+        start = min(after + 1, count)
+        end = min(count, start + limit, before if before is not None else count)
+    else:
+        end = min(count, before) if before is not None else count
+        start = max(0, end - limit)
+    end = max(start, end)
+    
+    return {
+        "conversation_id": conversation_id,
+        "message_count": _pop_saved_message_count(conversation),
+        "older_before": start if start > 0 else None,
+        "newer_after": end - 1 if end < count else None,
+        "messages": iter_messages(conversation_id, start, end)
+    }
+
+async def begin_turn(conversation_id: str, user_id: str, content: str) -> Optional[Dict[str, Any]]:
+    """
+    开始一轮对话：检查用户消息中的敏感词，同时校验对话归属、分配消息seq并读取最近的消息窗口
+    
+    整个过程只访问一次数据库；本轮的消息在结束时统一保存
     
-    Args:
-        conversation_id: 对话ID
-        user_id: 用户ID
-        content: 用户消息内容
-        
     Returns:
-        Dict: 包含处理结果的字典
+        Dict: 本轮对话的状态，其中 result 为用户消息的处理结果，
+        model_messages 为发送给模型的消息（拒绝回答时为None）；对话不存在或不属于该用户时返回None
     """
-    # 检查敏感词
-    check_result = sensitive_word_filter.check_text(content)
+    # 检查敏感词；mask 模式下同时生成屏蔽后的文本，只扫描一次
+    # 长文本的扫描交给线程池，避免阻塞事件循环中的其他请求；扫描与读取对话并发进行
+    mask_mode = settings.SENSITIVE_WORD_ACTION == "mask"
+    scan = sensitive_word_filter.mask_text if mask_mode else sensitive_word_filter.count_text
+    check_result, reserved = await asyncio.gather(
+        scan_dispatcher.run(scan, content),
+        # 每轮保存用户消息和回复两条消息
+        reserve_turn(conversation_id, user_id, 2)
+    )
+    if reserved is None:
+        return None
+    
     contains_sensitive = check_result["contains_sensitive_words"]
-    sensitive_words = check_result["sensitive_words_found"]
     highest_severity = check_result["highest_severity"]
+    # 重复出现的敏感词只保存一条（带命中次数），保存的文档大小有上限
+    sensitive_words = sensitive_word_filter.summarize_words(check_result["word_counts"])
     
-    # 创建用户消息
+    # 严重程度不超过阈值时屏蔽敏感词后继续对话，否则拒绝回答
+    masked = contains_sensitive and mask_mode and highest_severity <= settings.SENSITIVE_MASK_MAX_SEVERITY
+    
+    # 创建用户消息（屏蔽时只保存屏蔽后的内容，原文保存在敏感词记录中）
     user_message = {
         "role": "user",
-        "content": content,
+        "content": check_result["masked_text"] if masked else content,
         "timestamp": datetime.now(),
         "contains_sensitive_words": contains_sensitive,
         "sensitive_words_found": sensitive_words,
         "highest_severity": highest_severity
     }
     
-    # 更新对话
-    await db.db.conversations.update_one(
-        {"_id": ObjectId(conversation_id)},
-        {
-            "$push": {"messages": user_message},
-            "$set": {"updated_at": datetime.now()}
-        }
-    )
-    
-    # 如果包含敏感词，记录并返回拒绝回复
+    # 如果包含敏感词，记录原始内容
+    sensitive_record = None
     if contains_sensitive:
-        # 创建敏感词记录
         sensitive_record = {
             "user_id": ObjectId(user_id),
             "conversation_id": ObjectId(conversation_id),
@@ -78,78 +167,331 @@ async def add_message(conversation_id: str, user_id: str, content: str) -> Dict[
             "highest_severity": highest_severity,
             "timestamp": datetime.now()
         }
-        
-        await db.db.sensitive_records.insert_one(sensitive_record)
-        
-        # 创建系统回复
-        assistant_message = {
-            "role": "assistant",
-            "content": "当前问题暂无法回答。",
-            "timestamp": datetime.now(),
-            "contains_sensitive_words": False,
-            "sensitive_words_found": []
-        }
-        
-        # 更新对话
-        await db.db.conversations.update_one(
-            {"_id": ObjectId(conversation_id)},
-            {
-                "$push": {"messages": assistant_message},
-                "$set": {"updated_at": datetime.now()}
-            }
-        )
-        
-        return {
-            "contains_sensitive_words": True,
-            "sensitive_words_found": sensitive_words,
-            "assistant_response": "当前问题暂无法回答。"
-        }
-    
-    # 获取对话历史
-    conversation = await db.db.conversations.find_one({"_id": ObjectId(conversation_id)})
-    messages = conversation.get("messages", [])
     
-    # 准备发送给模型的消息（最多取最近10条）
-    model_messages = [
-        {"role": msg["role"], "content": msg["content"]}
-        for msg in messages[-10:]
-    ]
+    result = {
+        "contains_sensitive_words": contains_sensitive,
+        "sensitive_words_found": sensitive_words
+    }
+    if masked:
+        result["masked_content"] = user_message["content"]
     
-    # 调用模型生成回复
-    assistant_response = await generate_response(model_messages)
+    # 未屏蔽的敏感消息拒绝回答，不调用模型
+    model_messages = None
+    if not contains_sensitive or masked:
+        # 按token预算选取发送给模型的消息
+        model_messages = build_context(reserved["window"] + [user_message])
     
-    # 创建助手回复消息
-    assistant_message = {
+    return {
+        "conversation_id": conversation_id,
+        "first_seq": reserved["first_seq"],
+        # 对话还没有标题时以本轮的用户消息作为标题（拒绝回答的消息除外）
+        "set_title": not reserved["has_title"] and model_messages is not None,
+        "user_message": user_message,
+        "sensitive_record": sensitive_record,
+        "result": result,
+        "model_messages": model_messages
+    }
+
+async def _write_turn(turn: Dict[str, Any], assistant_message: Dict[str, Any]):
+    """保存本轮的用户消息和回复，敏感词记录与之并发写入"""
+    writes = [save_turn(
+        turn["conversation_id"], turn["first_seq"], [turn["user_message"], assistant_message], turn["set_title"]
+    )]
+    if turn["sensitive_record"] is not None:
+        writes.append(db.db.sensitive_records.insert_one(turn["sensitive_record"]))
+    await asyncio.gather(*writes)
+
+def _save_done(task: asyncio.Task):
+    _pending_saves.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"保存对话消息出错: {task.exception()}")
+
+async def _finish_turn(turn: Dict[str, Any], assistant_message: Dict[str, Any]):
+    """
+    保存本轮的用户消息和回复
+
+    写入在独立的任务中执行：请求被取消（如客户端断开）时等待被中断，但保存仍会完成
+    """
+    task = asyncio.ensure_future(_write_turn(turn, assistant_message))
+    _pending_saves.add(task)
+    task.add_done_callback(_save_done)
+    await asyncio.shield(task)
+
+async def _refuse_turn(turn: Dict[str, Any]) -> Dict[str, Any]:
+    """保存拒绝回复，返回最终结果"""
+    await _finish_turn(turn, {
         "role": "assistant",
-        "content": assistant_response,
+        "content": REFUSAL_MESSAGE,
         "timestamp": datetime.now(),
         "contains_sensitive_words": False,
         "sensitive_words_found": []
+    })
+    result = turn["result"]
+    result["assistant_response"] = REFUSAL_MESSAGE
+    return result
+
+def _assistant_message(reply: Dict[str, Any]) -> Dict[str, Any]:
+    """由 ScreenedReply.result() 生成保存的助手消息"""
+    message = {
+        "role": "assistant",
+        "content": reply["content"],
+        "timestamp": datetime.now(),
+        "contains_sensitive_words": reply["contains_sensitive_words"],
+        "sensitive_words_found": reply["sensitive_words_found"],
+        "highest_severity": reply["highest_severity"],
+        "cut_off": reply["cut_off"]
     }
+    if reply["interrupted"]:
+        message["interrupted"] = True
+    return message
+
+async def _complete_turn(turn: Dict[str, Any], reply: Dict[str, Any]) -> Dict[str, Any]:
+    """保存经过检查的助手回复，返回最终结果"""
+    await _finish_turn(turn, _assistant_message(reply))
+    result = turn["result"]
+    result["assistant_response"] = reply["content"]
+    result["assistant_cut_off"] = reply["cut_off"]
+    return result
+
+async def _abort_turn(turn: Dict[str, Any], reply: "ScreenedReply"):
+    """
+    回复生成出错或被取消时保存本轮
+
+    用户消息和敏感词记录照常保存，回复保存为已生成部分（屏蔽敏感词后）或中断提示，标记为中断
+    """
+    reply.interrupted = True
+    await _finish_turn(turn, _assistant_message(reply.result()))
+
+async def add_message(conversation_id: str, user_id: str, content: str) -> Optional[Dict[str, Any]]:
+    """
+    添加用户消息并获取AI回复
     
-    # 更新对话
-    await db.db.conversations.update_one(
-        {"_id": ObjectId(conversation_id)},
-        {
-            "$push": {"messages": assistant_message},
-            "$set": {"updated_at": datetime.now()}
-        }
+    Args:
+        conversation_id: 对话ID
+        user_id: 用户ID
+        content: 用户消息内容
+        
+    Returns:
+        Dict: 包含处理结果的字典；对话不存在或不属于该用户时返回None
+    """
+    turn = await begin_turn(conversation_id, user_id, content)
+    if turn is None:
+        return None
+    if turn["model_messages"] is None:
+        return await _refuse_turn(turn)
+    
+    # 调用模型生成回复，并检查回复中的敏感词
+    # 屏蔽过敏感词的消息不使用回复缓存
+    reply = ScreenedReply(
+        turn["model_messages"], conversation_id, cacheable=not turn["result"]["contains_sensitive_words"]
     )
+    try:
+        async for _ in reply:
+            pass
+    except BaseException:
+        # 模型服务繁忙、生成出错或请求被取消：仍保存用户消息和敏感词记录
+        await _abort_turn(turn, reply)
+        raise
+    return await _complete_turn(turn, reply.result())
+
+async def stream_turn(turn: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    以流式方式返回 begin_turn 开始的一轮对话的AI回复
     
-    return {
-        "contains_sensitive_words": False,
-        "sensitive_words_found": [],
-        "assistant_response": assistant_response
-    }
+    依次产生以下事件（{"event": 名称, "data": 数据}）：
+    - message: 用户消息的处理结果（是否包含敏感词、屏蔽后的内容）
+    - token: 一段可以安全输出的回复文本，敏感词已屏蔽
+    - done: 最终结果，与 add_message 的返回值相同；回复被中断时 assistant_response 为中断提示
+    
+    用户消息和完整回复在生成结束后一次性保存，不会逐段写入数据库；
+    客户端中途断开（生成器被关闭或任务被取消）或生成出错时，已生成的部分回复标记为中断后保存
+    """
+    yield {"event": "message", "data": dict(turn["result"])}
+    if turn["model_messages"] is None:
+        yield {"event": "done", "data": await _refuse_turn(turn)}
+        return
+    
+    reply = ScreenedReply(
+        turn["model_messages"], turn["conversation_id"],
+        cacheable=not turn["result"]["contains_sensitive_words"]
+    )
+    try:
+        async for piece in reply:
+            yield {"event": "token", "data": {"content": piece}}
+    except BaseException:
+        # 包括客户端断开时的 GeneratorExit / CancelledError；保存在独立任务中完成
+        await _abort_turn(turn, reply)
+        raise
+    yield {"event": "done", "data": await _complete_turn(turn, reply.result())}
 
-async def get_user_conversations(user_id: str) -> List[Dict]:
-    """获取用户的所有对话"""
-    conversations = []
-    cursor = db.db.conversations.find({"user_id": ObjectId(user_id)}).sort("updated_at", -1)
+def _should_cut_off(hits: List[Tuple[int, int, Dict[str, Any]]]) -> bool:
+    """命中中是否有需要立即停止生成的严重敏感词"""
+    return any(
+        word_info.get("severity", 1) >= settings.SENSITIVE_STREAM_CUTOFF_SEVERITY
+        for _, _, word_info in hits
+    )
+
+class ScreenedReply:
+    """
+    经过敏感词检查的模型回复
     
-    async for conversation in cursor:
+    迭代时逐段返回可以安全输出的文本：每收到一段模型输出就送入增量匹配器（自动机状态跨段保留），
+    只返回之后不可能再成为敏感词一部分的前缀，其中的敏感词已屏蔽。
+    出现严重程度达到 SENSITIVE_STREAM_CUTOFF_SEVERITY 的敏感词时立即停止生成，
+    已返回的文本应由调用方替换为 result() 中的中断提示。
+    迭代结束后调用 result() 获取完整回复和检查结果
+    
+    cacheable 为真且启用了回复缓存时，先查找相同消息窗口的缓存回复；
+    只有完整生成、不含敏感词的回复才会写入缓存
+    """
+    def __init__(
+        self,
+        model_messages: List[Dict[str, str]],
+        conversation_id: Optional[str] = None,
+        cacheable: bool = False
+    ):
+        self.model_messages = model_messages
+        self.conversation_id = conversation_id
+        self.matcher = sensitive_word_filter.stream_matcher()
+        self.cut_off = False
+        self.complete = True  # 模型输出是否完整（流式生成中途出错时为假）
+        self.interrupted = False  # 生成是否因出错或取消而提前结束，由调用方设置
+        self.cached = False  # 是否来自回复缓存
+        self.cache_key = None
+        if cacheable and response_cache.enabled:
+            self.cache_key = response_cache.make_key(model_messages)
+    
+    async def __aiter__(self) -> AsyncIterator[str]:
+        if self.cache_key is not None:
+            cached = await response_cache.get(self.cache_key)
+            if cached is not None:
+                if not self.matcher.feed(cached):
+                    self.cached = True
+                    self.matcher.finish()
+                    yield self.matcher.take_safe()
+                    return
+                # 词库更新后缓存的回复可能包含新增的敏感词，丢弃缓存重新生成
+                await response_cache.invalidate(self.cache_key)
+                self.matcher = sensitive_word_filter.stream_matcher()
+        
+        matcher = self.matcher
+        if settings.OLLAMA_STREAM:
+            chunks = stream_response(self.model_messages, self.conversation_id)
+            try:
+                async for chunk in chunks:
+                    if _should_cut_off(matcher.feed(chunk)):
+                        self.cut_off = True
+                        break
+                    piece = matcher.take_safe()
+                    if piece:
+                        yield piece
+            except IncompleteResponseError:
+                self.complete = False
+            finally:
+                # 提前结束时关闭连接，Ollama随之停止生成
+                await chunks.aclose()
+        else:
+            content = await generate_response(self.model_messages, self.conversation_id)
+            self.cut_off = _should_cut_off(matcher.feed(content))
+        matcher.finish()
+        
+        if not self.cut_off:
+            piece = matcher.take_safe()
+            if piece:
+                yield piece
+        
+        if (self.cache_key is not None and self.complete and not self.cut_off
+                and not matcher.hits and matcher.text and matcher.text not in FALLBACK_MESSAGES):
+            await response_cache.put(self.cache_key, matcher.text)
+    
+    def result(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict: 回复内容、敏感词检查结果以及是否被中断（cut_off）；
+            interrupted 表示生成因出错或取消提前结束
+        """
+        check_result = self.matcher.result()
+        if self.cut_off:
+            content = REPLY_CUT_OFF_MESSAGE
+        else:
+            content = self.matcher.masked_text()
+            if self.interrupted and not content:
+                content = REPLY_INTERRUPTED_MESSAGE
+        return {
+            "content": content,
+            "contains_sensitive_words": check_result["contains_sensitive_words"],
+            "sensitive_words_found": sensitive_word_filter.summarize_words(check_result["word_counts"]),
+            "highest_severity": check_result["highest_severity"],
+            # 提前结束的回复同样标记为中断
+            "cut_off": self.cut_off or self.interrupted,
+            "interrupted": self.interrupted
+        }
+
+async def generate_screened_reply(
+    model_messages: List[Dict[str, str]],
+    conversation_id: Optional[str] = None,
+    cacheable: bool = False
+) -> Dict[str, Any]:
+    """
+    生成模型回复并检查其中的敏感词
+    
+    严重敏感词会中断生成，其余敏感词在回复中被屏蔽，见 ScreenedReply
+    
+    Returns:
+        Dict: 回复内容、敏感词检查结果以及是否被中断
+    """
+    reply = ScreenedReply(model_messages, conversation_id, cacheable)
+    async for _ in reply:
+        pass
+    return reply.result()
+
+def _encode_cursor(conversation: Dict[str, Any]) -> str:
+    """将对话的 (updated_at, _id) 编码为不透明的分页游标"""
+    raw = f"{conversation['updated_at'].isoformat()}|{conversation['_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """解析分页游标，格式无效时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        updated_at, conversation_id = raw.split("|")
+        return datetime.fromisoformat(updated_at), ObjectId(conversation_id)
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+async def get_user_conversations(user_id: str, limit: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    按最近更新时间分页获取用户的对话摘要
+    
+    以 (updated_at, _id) 为键分页，翻页不需要跳过前面的对话；只返回标题、预览、消息数和时间，不读取消息内容
+    
+    Args:
+        user_id: 用户ID
+        limit: 每页的对话数
+        cursor: 上一页返回的 next_cursor，为空时返回第一页
+        
+    Returns:
+        Dict: conversations 为对话摘要列表，next_cursor 为下一页的游标（没有更多对话时为None）
+    """
+    query: Dict[str, Any] = {"user_id": ObjectId(user_id)}
+    if cursor:
+        updated_at, last_id = _decode_cursor(cursor)
+        query["$or"] = [
+            {"updated_at": {"$lt": updated_at}},
+            {"updated_at": updated_at, "_id": {"$lt": last_id}}
+        ]
+    
+    # 多取一条用于判断是否还有下一页
+    documents = await db.db.conversations.find(
+        query,
+        {"title": 1, "preview": 1, "message_count": 1, "saved_message_count": 1, "created_at": 1, "updated_at": 1}
+    ).sort([("updated_at", -1), ("_id", -1)]).limit(limit + 1).to_list(length=limit + 1)
+    
+    next_cursor = _encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    conversations = []
+    for conversation in documents[:limit]:
         conversation["_id"] = str(conversation["_id"])
-        conversation["user_id"] = str(conversation["user_id"])
+        conversation["message_count"] = _pop_saved_message_count(conversation)
         conversations.append(conversation)
     
-    return conversations
\ No newline at end of file
+    return {"conversations": conversations, "next_cursor": next_cursor}
@@ -0,0 +1,374 @@
+import asyncio
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError
+from app.core.config import settings
+from app.db.mongodb import db
+from app.utils.compact_trie import CompactTrie
+from app.utils.lexicon_snapshot import (
+    SnapshotError, format_lexicon_hash, lexicon_hash, load_snapshot,
+    read_snapshot_header, write_snapshot
+)
+from app.utils.sensitive_word_filter import sensitive_word_filter
+
+# 词库版本文档的ID（位于 lexicon_meta 集合）
+LEXICON_META_ID = "sensitive_words"
+
+# 补写 normalized_word 字段时每批写入的文档数
+NORMALIZED_WORD_BATCH = 1000
+
+# MongoDB单节点部署不支持change stream时返回的错误码
+CHANGE_STREAM_UNSUPPORTED_CODES = {40573, 40324}
+
+class LexiconSyncState:
+    """当前worker的词库同步状态"""
+    version: int = 0  # 已应用到本地过滤器的变更日志版本
+    mode: Optional[str] = None  # 实际使用的同步方式
+    task: Optional[asyncio.Task] = None
+
+sync_state = LexiconSyncState()
+
+def apply_updated_documents(documents: List[Dict[str, Any]]) -> None:
+    """将新增或更新后的敏感词文档增量应用到本地过滤器，全部修改作为一个批次发布"""
+    with sensitive_word_filter.batch_edit():
+        for document in documents:
+            word_info = sensitive_word_filter.word_info_from_document(document)
+            if not word_info["word"]:
+                continue
+
+            # 敏感词内容被修改时，先移除旧的敏感词
+            previous = sensitive_word_filter.word_for_id(word_info["id"])
+            if previous is not None and previous != word_info["word"]:
+                sensitive_word_filter.remove_word(previous)
+
+            current = sensitive_word_filter.get_word_info(word_info["word"])
+            if current == word_info:
+                # 本worker发起的修改会再次从同步通道收到，无需重复应用
+                continue
+            # 同一敏感词存在多条记录时，只更新当前生效的记录
+            if current is None or current["id"] == word_info["id"]:
+                sensitive_word_filter.add_word(word_info)
+
+async def apply_removed_documents(documents: List[Dict[str, Any]]) -> None:
+    """将已删除的敏感词文档增量应用到本地过滤器"""
+    removed_words = []
+    with sensitive_word_filter.batch_edit():
+        for document in documents:
+            word = document.get("word") or sensitive_word_filter.word_for_id(str(document["_id"]))
+            current = sensitive_word_filter.get_word_info(word) if word else None
+            if current is not None and current["id"] == str(document["_id"]):
+                sensitive_word_filter.remove_word(word)
+                removed_words.append(sensitive_word_filter.normalizer.normalize_word(word))
+
+    if not removed_words:
+        return
+
+    # 同一敏感词可能存在多条记录（包括不同写法，如 賭博 与 赌博），删除生效的记录后改用剩余的记录
+    survivors = await db.db.sensitive_words.find({"normalized_word": {"$in": removed_words}}).to_list(length=None)
+    with sensitive_word_filter.batch_edit():
+        for document in survivors:
+            if sensitive_word_filter.get_word_info(document["word"]) is None:
+                sensitive_word_filter.add_word(sensitive_word_filter.word_info_from_document(document))
+
+async def backfill_normalized_words() -> int:
+    """
+    为敏感词文档补写 normalized_word 字段（按当前归一化配置处理后的敏感词）
+
+    lexicon_meta 中记录了补写时使用的归一化配置，配置未变化时直接返回；
+    首次启动或修改归一化配置后重新计算全部文档，只写入发生变化的文档。可重复执行
+
+    Returns:
+        int: 更新的文档数
+    """
+    signature = sensitive_word_filter.normalizer.signature
+    meta = await db.db.lexicon_meta.find_one({"_id": LEXICON_META_ID})
+    if meta and meta.get("normalizer") == signature:
+        return 0
+
+    normalize_word = sensitive_word_filter.normalizer.normalize_word
+    updated = 0
+    operations = []
+    cursor = db.db.sensitive_words.find({}, {"word": 1, "normalized_word": 1})
+    async for document in cursor:
+        normalized_word = normalize_word(document.get("word", ""))
+        if document.get("normalized_word") == normalized_word:
+            continue
+        operations.append(UpdateOne({"_id": document["_id"]}, {"$set": {"normalized_word": normalized_word}}))
+        if len(operations) >= NORMALIZED_WORD_BATCH:
+            await db.db.sensitive_words.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await db.db.sensitive_words.bulk_write(operations, ordered=False)
+        updated += len(operations)
+
+    await db.db.lexicon_meta.update_one(
+        {"_id": LEXICON_META_ID}, {"$set": {"normalizer": signature}}, upsert=True
+    )
+    return updated
+
+async def get_lexicon_version() -> int:
+    """获取数据库中词库变更日志的最新版本"""
+    meta = await db.db.lexicon_meta.find_one({"_id": LEXICON_META_ID})
+    return meta.get("version", 0) if meta else 0
+
+async def record_lexicon_changes(op: str, documents: List[Dict[str, Any]]) -> None:
+    """
+    记录敏感词变更，供其他worker轮询同步
+
+    Args:
+        op: "upsert" 或 "delete"
+        documents: 变更后的（或被删除的）敏感词文档
+    """
+    if not documents:
+        return
+
+    # 一次性分配连续的版本号区间
+    meta = await db.db.lexicon_meta.find_one_and_update(
+        {"_id": LEXICON_META_ID},
+        {"$inc": {"version": len(documents)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    first_version = meta["version"] - len(documents) + 1
+
+    changes = []
+    for offset, document in enumerate(documents):
+        word_info = sensitive_word_filter.word_info_from_document(document)
+        changes.append({
+            "version": first_version + offset,
+            "op": op,
+            "word_id": document["_id"],
+            "word": word_info["word"],
+            "category": word_info["category"],
+            "subcategory": word_info["subcategory"],
+            "severity": word_info["severity"],
+            "timestamp": datetime.now()
+        })
+    await db.db.sensitive_word_changes.insert_many(changes)
+
+async def load_lexicon() -> None:
+    """
+    完整加载词库，并记录加载时对应的变更日志版本
+
+    配置了快照文件且快照未过期时直接映射快照，否则从数据库重新构建
+    """
+    # 先读取版本再加载：加载期间产生的变更会在之后被重复应用，增量应用是幂等的
+    version = await get_lexicon_version()
+    if not (settings.SENSITIVE_FILTER_SNAPSHOT_PATH and await _load_lexicon_snapshot(version)):
+        await sensitive_word_filter.load_sensitive_words()
+    sync_state.version = version
+
+async def _load_lexicon_snapshot(version: int) -> bool:
+    """快照与数据库中的词库版本一致时加载快照，返回是否加载成功"""
+    path = settings.SENSITIVE_FILTER_SNAPSHOT_PATH
+    try:
+        header = read_snapshot_header(path)
+        # 直接修改数据库（如重新执行init_db.py）不会更新版本，因此同时核对文档数量
+        document_count = await db.db.sensitive_words.estimated_document_count()
+        if header.get("lexicon_version") != version or header.get("document_count") != document_count:
+            print("敏感词快照已过期，从数据库重新加载")
+            return False
+        if header.get("normalizer") != sensitive_word_filter.normalizer.signature:
+            print("敏感词快照的归一化配置与当前配置不一致，从数据库重新加载")
+            return False
+        trie, header = load_snapshot(path)
+    except SnapshotError as e:
+        print(f"无法使用敏感词快照: {str(e)}")
+        return False
+
+    sensitive_word_filter.publish_compact(trie)
+    print(f"已从快照加载 {header['word_count']} 个敏感词（词库哈希 {header['lexicon_hash'][:12]}）")
+    return True
+
+async def build_lexicon_snapshot(path: str) -> Dict[str, Any]:
+    """从数据库读取词库，编译为紧凑自动机并写入快照文件"""
+    version = await get_lexicon_version()
+    document_count = await db.db.sensitive_words.estimated_document_count()
+    sensitive_words = await sensitive_word_filter.fetch_sensitive_words()
+    trie = CompactTrie.build(sensitive_words)
+    return write_snapshot(path, trie, {
+        "lexicon_hash": format_lexicon_hash(lexicon_hash(sensitive_words)),
+        "normalizer": sensitive_word_filter.normalizer.signature,
+        "lexicon_version": version,
+        "document_count": document_count
+    })
+
+async def _apply_logged_changes() -> bool:
+    """
+    应用变更日志中尚未同步的变更
+
+    以 lexicon_meta 中的最新版本为目标，按版本顺序分批读取日志，每批最多 SENSITIVE_WORD_SYNC_BATCH 条
+
+    Returns:
+        bool: 日志中是否存在版本缺口（并发写入尚未落库，或日志已被TTL索引删除）
+    """
+    target = await get_lexicon_version()
+    batch_size = max(1, settings.SENSITIVE_WORD_SYNC_BATCH)
+
+    while sync_state.version < target:
+        changes = await db.db.sensitive_word_changes.find(
+            {"version": {"$gt": sync_state.version, "$lte": target}}
+        ).sort("version", 1).limit(batch_size).to_list(length=batch_size)
+
+        # 下一条日志缺失（包括日志已全部过期、查询结果为空的情况）
+        if not changes:
+            return True
+        # 只应用连续的部分，相邻的同类变更合并为一个批次，每批只复制一次词库快照
+        contiguous = []
+        for change in changes:
+            if change["version"] != sync_state.version + len(contiguous) + 1:
+                break
+            contiguous.append(change)
+        start = 0
+        while start < len(contiguous):
+            op = contiguous[start]["op"]
+            end = start
+            while end < len(contiguous) and contiguous[end]["op"] == op:
+                end += 1
+            documents = [{**change, "_id": change["word_id"]} for change in contiguous[start:end]]
+            if op == "delete":
+                await apply_removed_documents(documents)
+            else:
+                apply_updated_documents(documents)
+            sync_state.version = contiguous[end - 1]["version"]
+            start = end
+        if len(contiguous) < len(changes):
+            return True
+    return False
+
+async def _poll_changes() -> None:
+    """轮询变更日志，将其他worker的修改应用到本地过滤器"""
+    gap_seen = False
+    while True:
+        await asyncio.sleep(settings.SENSITIVE_WORD_SYNC_INTERVAL)
+        has_gap = await _apply_logged_changes()
+        if has_gap and gap_seen:
+            # 缺口持续超过一个轮询周期，说明变更日志已过期，退回完整加载
+            print("敏感词变更日志不连续，重新加载词库")
+            await load_lexicon()
+            has_gap = False
+        gap_seen = has_gap
+
+def _change_kind(change: Dict[str, Any]) -> str:
+    operation = change["operationType"]
+    if operation in ("insert", "update", "replace"):
+        return "upsert"
+    if operation == "delete":
+        return "delete"
+    if operation in ("drop", "rename", "invalidate"):
+        return "reload"
+    return "ignore"
+
+async def apply_change_events(changes: List[Dict[str, Any]]) -> None:
+    """
+    将 sensitive_words 集合的一组change stream事件按顺序应用到本地过滤器
+
+    相邻的同类事件合并为一个批次（一次 batch_edit），每批只复制并发布一次词库快照
+    """
+    start = 0
+    while start < len(changes):
+        kind = _change_kind(changes[start])
+        end = start + 1
+        while end < len(changes) and _change_kind(changes[end]) == kind:
+            end += 1
+        batch = changes[start:end]
+        if kind == "upsert":
+            documents = [change["fullDocument"] for change in batch if change.get("fullDocument")]
+            if documents:
+                apply_updated_documents(documents)
+        elif kind == "delete":
+            await apply_removed_documents([change["documentKey"] for change in batch])
+        elif kind == "reload":
+            await load_lexicon()
+        start = end
+
+async def apply_change_event(change: Dict[str, Any]) -> None:
+    """将 sensitive_words 集合的单个change stream事件应用到本地过滤器"""
+    await apply_change_events([change])
+
+async def _read_change_stream(stream, queue: asyncio.Queue) -> None:
+    """将change stream事件依次放入队列；监听结束时放入None，出错时放入异常"""
+    try:
+        async for change in stream:
+            queue.put_nowait(change)
+    except Exception as e:
+        queue.put_nowait(e)
+        return
+    queue.put_nowait(None)
+
+async def _watch_change_stream() -> None:
+    """
+    监听 sensitive_words 集合的change stream
+
+    事件由单独的任务读入队列；每次取出队列中已到达的全部事件（最多 SENSITIVE_WORD_SYNC_BATCH 个）一起应用，
+    批量导入等连续修改不会为每个事件单独复制和发布词库快照
+    """
+    batch_size = max(1, settings.SENSITIVE_WORD_SYNC_BATCH)
+    async with db.db.sensitive_words.watch(full_document="updateLookup") as stream:
+        sync_state.mode = "change_stream"
+        # 追上启动加载之后、开始监听之前产生的变更
+        await _apply_logged_changes()
+        queue = asyncio.Queue()
+        reader = asyncio.ensure_future(_read_change_stream(stream, queue))
+        try:
+            while True:
+                changes = [await queue.get()]
+                while len(changes) < batch_size and not queue.empty():
+                    changes.append(queue.get_nowait())
+                # 监听结束或出错之前到达的事件照常应用
+                end = next((i for i, change in enumerate(changes) if not isinstance(change, dict)), len(changes))
+                await apply_change_events(changes[:end])
+                if end < len(changes):
+                    if isinstance(changes[end], Exception):
+                        raise changes[end]
+                    return
+        finally:
+            reader.cancel()
+
+async def run_lexicon_sync() -> None:
+    """后台同步任务：优先使用change stream，不可用时轮询变更日志"""
+    mode = settings.SENSITIVE_WORD_SYNC_MODE
+    while True:
+        try:
+            if mode in ("auto", "change_stream"):
+                await _watch_change_stream()
+            else:
+                sync_state.mode = "poll"
+                await _poll_changes()
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            if mode == "auto" and e.code in CHANGE_STREAM_UNSUPPORTED_CODES:
+                print("当前MongoDB部署不支持change stream，改为轮询敏感词变更日志")
+                mode = "poll"
+                continue
+            print(f"敏感词同步出错: {str(e)}")
+        except PyMongoError as e:
+            print(f"敏感词同步出错: {str(e)}")
+
+        # 连接中断后可能漏掉变更，重新完整加载后再恢复同步
+        await asyncio.sleep(settings.SENSITIVE_WORD_SYNC_INTERVAL)
+        try:
+            await load_lexicon()
+        except PyMongoError as e:
+            print(f"重新加载敏感词失败: {str(e)}")
+
+def start_lexicon_sync() -> None:
+    """启动后台词库同步任务"""
+    if settings.SENSITIVE_WORD_SYNC_MODE == "off" or sync_state.task is not None:
+        return
+    sync_state.task = asyncio.create_task(run_lexicon_sync())
+
+async def stop_lexicon_sync() -> None:
+    """停止后台词库同步任务"""
+    task = sync_state.task
+    if task is None:
+        return
+    sync_state.task = None
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
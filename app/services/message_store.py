@@ -0,0 +1,225 @@
+import asyncio
+from typing import List, Dict, Any, Optional, AsyncIterator
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from app.core.config import settings
+from app.db.mongodb import db
+from app.db.indexes import ensure_indexes
+
+# 消息保存在 messages 集合中，每条消息一个文档，以 (conversation_id, seq) 唯一标识；
+# seq 为消息在对话中的序号（从0开始），由对话文档的 message_count 分配。
+# message_count 在分配时递增，中途失败或被放弃的轮次也会占用seq；实际保存的消息数另记在 saved_message_count 中。
+# 对话文档本身不再随消息数量增长，读取最近的消息只需按索引读取对应的条数。
+# 对话文档另外保存最近 CONTEXT_MAX_MESSAGES 条消息的精简副本（recent_messages），
+# 一轮对话只需读取对话文档一次即可同时完成归属校验、seq分配和历史读取。
+# 对话列表使用的标题（第一条用户消息的第一行）和预览（最后一条消息）在保存消息时一并写入对话文档
+
+# 最近消息窗口中保存的字段
+WINDOW_FIELDS = ("seq", "role", "content", "timestamp")
+
+# 标题和预览的最大字符数
+TITLE_MAX_CHARS = 30
+PREVIEW_MAX_CHARS = 80
+
+# 返回消息时不包含的字段
+MESSAGE_PROJECTION = {"_id": 0, "conversation_id": 0}
+
+# 重复键错误码（迁移中断后重新执行时已存在的消息）
+DUPLICATE_KEY_ERROR = 11000
+
+def make_title(content: str) -> str:
+    """取消息的第一行作为对话标题"""
+    lines = content.strip().splitlines()
+    title = lines[0].strip() if lines else ""
+    return title[:TITLE_MAX_CHARS] + "…" if len(title) > TITLE_MAX_CHARS else title
+
+def make_preview(content: str) -> str:
+    """将消息压缩为一行作为对话预览"""
+    preview = " ".join(content.split())
+    return preview[:PREVIEW_MAX_CHARS] + "…" if len(preview) > PREVIEW_MAX_CHARS else preview
+
+def _summary_fields(messages: List[Dict[str, Any]], with_title: bool) -> Dict[str, Any]:
+    """根据按时间顺序排列的消息生成对话的标题和预览字段"""
+    fields = {"preview": make_preview(messages[-1]["content"]) if messages else ""}
+    if with_title:
+        first_user = next((message for message in messages if message["role"] == "user"), None)
+        fields["title"] = make_title(first_user["content"]) if first_user else ""
+    return fields
+
+async def reserve_turn(conversation_id: str, user_id: str, count: int) -> Optional[Dict[str, Any]]:
+    """
+    校验对话归属，为本轮的 count 条消息分配seq，并返回最近的消息窗口（一次往返）
+
+    Returns:
+        Dict: first_seq 为本轮第一条消息的seq，window 为按时间顺序排列的最近消息，
+        has_title 表示对话是否已有标题；对话不存在或不属于该用户时返回None
+    """
+    conversation = await db.db.conversations.find_one_and_update(
+        {"_id": ObjectId(conversation_id), "user_id": ObjectId(user_id)},
+        {
+            "$inc": {"message_count": count},
+            "$set": {"updated_at": datetime.now()}
+        },
+        projection={
+            "message_count": 1,
+            "title": 1,
+            "recent_messages": {"$slice": -settings.CONTEXT_MAX_MESSAGES}
+        },
+        return_document=ReturnDocument.BEFORE
+    )
+    if conversation is None:
+        return None
+    
+    first_seq = conversation.get("message_count", 0)
+    window = conversation.get("recent_messages")
+    if window is None and first_seq:
+        # 还没有最近消息窗口的对话从 messages 集合读取，保存本轮消息后窗口即建立
+        window = await recent_messages(conversation_id, settings.CONTEXT_MAX_MESSAGES)
+    return {"first_seq": first_seq, "window": window or [], "has_title": bool(conversation.get("title"))}
+
+async def save_turn(conversation_id: str, first_seq: int, messages: List[Dict[str, Any]], set_title: bool = False):
+    """
+    保存一轮对话的消息（seq 由 reserve_turn 分配）
+
+    消息追加到对话文档的最近消息窗口（只保留 CONTEXT_MAX_MESSAGES 条），同时写入 messages 集合，
+    两个写操作并发执行。对话预览更新为最后一条消息，set_title 为真时以本轮的用户消息设置标题，
+    saved_message_count 增加本轮保存的消息数
+    """
+    oid = ObjectId(conversation_id)
+    documents = [
+        {**message, "conversation_id": oid, "seq": first_seq + offset}
+        for offset, message in enumerate(messages)
+    ]
+    window = [{field: document[field] for field in WINDOW_FIELDS} for document in documents]
+    await asyncio.gather(
+        db.db.conversations.update_one(
+            {"_id": oid},
+            {
+                "$push": {"recent_messages": {"$each": window, "$slice": -settings.CONTEXT_MAX_MESSAGES}},
+                "$set": {"updated_at": datetime.now(), **_summary_fields(messages, set_title)},
+                "$inc": {"saved_message_count": len(messages)}
+            }
+        ),
+        db.db.messages.insert_many(documents)
+    )
+
+async def recent_messages(conversation_id: str, limit: int) -> List[Dict[str, Any]]:
+    """按时间顺序返回对话最近的 limit 条消息"""
+    cursor = db.db.messages.find(
+        {"conversation_id": ObjectId(conversation_id)},
+        MESSAGE_PROJECTION
+    ).sort("seq", -1).limit(limit)
+    messages = await cursor.to_list(length=limit)
+    messages.reverse()
+    return messages
+
+async def iter_messages(conversation_id: str, start: int, end: int) -> AsyncIterator[Dict[str, Any]]:
+    """按seq顺序逐条返回 start <= seq < end 的消息（使用 (conversation_id, seq) 索引的范围扫描）"""
+    cursor = db.db.messages.find(
+        {"conversation_id": ObjectId(conversation_id), "seq": {"$gte": start, "$lt": end}},
+        MESSAGE_PROJECTION
+    ).sort("seq", 1)
+    async for message in cursor:
+        yield message
+
+async def migrate_embedded_messages() -> Dict[str, int]:
+    """
+    将旧版嵌入在对话文档 messages 数组中的消息迁移到 messages 集合
+
+    每个对话的消息按原顺序分配seq，迁移完成后设置 message_count、saved_message_count、最近消息窗口、标题和预览并删除嵌入的数组。
+    可重复执行：中断后重新执行时已迁移的消息被跳过。应在停止服务后执行
+
+    Returns:
+        Dict: 迁移的对话数和消息数
+    """
+    # 依赖 (conversation_id, seq) 唯一索引跳过已迁移的消息
+    await ensure_indexes(["messages"])
+    migrated_conversations = 0
+    migrated_messages = 0
+    cursor = db.db.conversations.find({"messages": {"$exists": True}}, {"messages": 1})
+    async for conversation in cursor:
+        embedded = conversation.get("messages") or []
+        if embedded:
+            try:
+                await db.db.messages.insert_many(
+                    [
+                        {**message, "conversation_id": conversation["_id"], "seq": seq}
+                        for seq, message in enumerate(embedded)
+                    ],
+                    ordered=False
+                )
+            except BulkWriteError as e:
+                if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                    raise
+        window = [
+            {"seq": seq, "role": message["role"], "content": message["content"], "timestamp": message.get("timestamp")}
+            for seq, message in enumerate(embedded)
+        ][-settings.CONTEXT_MAX_MESSAGES:]
+        await db.db.conversations.update_one(
+            {"_id": conversation["_id"]},
+            {
+                "$set": {
+                    "message_count": len(embedded),
+                    "saved_message_count": len(embedded),
+                    "recent_messages": window,
+                    **_summary_fields(embedded, True)
+                },
+                "$unset": {"messages": ""}
+            }
+        )
+        migrated_conversations += 1
+        migrated_messages += len(embedded)
+    return {"conversations": migrated_conversations, "messages": migrated_messages}
+
+async def backfill_conversation_summaries() -> int:
+    """
+    为没有预览字段的对话（在列表摘要加入之前迁移或创建的对话）补全标题和预览
+
+    只读取每个对话的第一条用户消息和最后一条消息。可重复执行
+
+    Returns:
+        int: 补全的对话数
+    """
+    updated = 0
+    cursor = db.db.conversations.find({"preview": {"$exists": False}, "messages": {"$exists": False}}, {"_id": 1})
+    async for conversation in cursor:
+        first_user, last = await asyncio.gather(
+            db.db.messages.find_one(
+                {"conversation_id": conversation["_id"], "role": "user"},
+                {"content": 1, "role": 1},
+                sort=[("seq", 1)]
+            ),
+            db.db.messages.find_one(
+                {"conversation_id": conversation["_id"]},
+                {"content": 1, "role": 1},
+                sort=[("seq", -1)]
+            )
+        )
+        fields = _summary_fields([message for message in (first_user, last) if message], True)
+        await db.db.conversations.update_one({"_id": conversation["_id"]}, {"$set": fields})
+        updated += 1
+    return updated
+
+async def backfill_saved_message_counts() -> int:
+    """
+    为没有 saved_message_count 字段的对话（在该字段加入之前创建的对话）统计已保存的消息数
+
+    按 (conversation_id, seq) 索引计数。可重复执行
+
+    Returns:
+        int: 补全的对话数
+    """
+    updated = 0
+    cursor = db.db.conversations.find(
+        {"saved_message_count": {"$exists": False}, "messages": {"$exists": False}}, {"_id": 1}
+    )
+    async for conversation in cursor:
+        count = await db.db.messages.count_documents({"conversation_id": conversation["_id"]})
+        await db.db.conversations.update_one(
+            {"_id": conversation["_id"], "saved_message_count": {"$exists": False}},
+            {"$set": {"saved_message_count": count}}
+        )
+        updated += 1
+    return updated
@@ -1,43 +1,484 @@
+import asyncio
 import httpx
-from typing import List, Dict, Any
+import json
+import time
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, AsyncIterator, Optional, Sequence, Tuple
 from app.core.config import settings
+from app.utils.metrics import metrics
 
-async def generate_response(messages: List[Dict[str, str]]) -> str:
+# 所有节点都不可用时返回的回复
+UNAVAILABLE_MESSAGE = "抱歉，模型服务暂时不可用。"
+# 模型返回空内容时的回复
+EMPTY_REPLY_MESSAGE = "抱歉，我无法生成回复。"
+# 不是由模型生成的兜底回复
+FALLBACK_MESSAGES = (UNAVAILABLE_MESSAGE, EMPTY_REPLY_MESSAGE)
+
+# generate 模式下提示词中各角色的前缀
+ROLE_PREFIXES = {"system": "System: ", "user": "User: ", "assistant": "Assistant: "}
+
+# 最多记住多少个对话最近使用的节点
+AFFINITY_CACHE_SIZE = 10000
+
+class ModelOverloadedError(Exception):
+    """模型服务繁忙，请求未被接受：等待队列已满（429）或排队超时、没有可用节点（503）"""
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+class IncompleteResponseError(Exception):
+    """流式生成在输出部分文本后中断，已输出的文本不是完整的回复"""
+
+class OllamaClient:
+    client: httpx.AsyncClient = None
+
+ollama = OllamaClient()
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OLLAMA_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(
+            settings.OLLAMA_READ_TIMEOUT,
+            connect=settings.OLLAMA_CONNECT_TIMEOUT,
+            pool=settings.OLLAMA_POOL_TIMEOUT
+        )
+    )
+
+async def connect_to_ollama():
+    """创建应用生命周期内共用的HTTP客户端，连接池中的连接在请求之间保持复用"""
+    if ollama.client is None:
+        ollama.client = _create_client()
+        print("Created Ollama HTTP client")
+
+async def close_ollama_client():
+    """关闭HTTP客户端及连接池中的连接"""
+    if ollama.client is not None:
+        await ollama.client.aclose()
+        ollama.client = None
+        print("Closed Ollama HTTP client")
+
+def get_client() -> httpx.AsyncClient:
+    """返回共用的HTTP客户端；未经启动钩子创建时（如脚本中调用）按需创建"""
+    if ollama.client is None:
+        ollama.client = _create_client()
+    return ollama.client
+
+def backend_urls() -> List[str]:
+    """配置的Ollama节点地址：OLLAMA_BASE_URLS（逗号分隔），未设置时为 OLLAMA_BASE_URL"""
+    urls = [url.strip().rstrip("/") for url in settings.OLLAMA_BASE_URLS.split(",") if url.strip()]
+    return urls or [settings.OLLAMA_BASE_URL.rstrip("/")]
+
+class OllamaBackend:
+    """一个Ollama推理节点及其负载和健康状态"""
+    def __init__(self, url: str):
+        self.url = url
+        self.in_flight = 0  # 正在处理的请求数
+        self.failures = 0  # 连续失败次数
+        self.ejected_until = 0.0  # 被摘除到的时间点（time.monotonic），之前不再分配请求
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def has_capacity(self) -> bool:
+        """是否还能接受请求：每个节点同时处理的请求数不超过 OLLAMA_BACKEND_CONCURRENCY"""
+        return self.in_flight < settings.OLLAMA_BACKEND_CONCURRENCY
+
+    def record_success(self):
+        if self.ejected_until:
+            print(f"Ollama节点已恢复: {self.url}")
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def record_failure(self):
+        """记录一次失败，连续失败达到 OLLAMA_MAX_FAILURES 次时摘除节点"""
+        self.errors += 1
+        self.failures += 1
+        if self.failures >= settings.OLLAMA_MAX_FAILURES:
+            self.eject()
+
+    def eject(self):
+        """摘除节点 OLLAMA_EJECT_SECONDS 秒；期间健康检查通过会提前恢复"""
+        if not self.ejected_until:
+            print(f"Ollama节点不可用，暂时摘除: {self.url}")
+        self.ejected_until = time.monotonic() + settings.OLLAMA_EJECT_SECONDS
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "available": self.available(time.monotonic()),
+            "in_flight": self.in_flight,
+            "consecutive_failures": self.failures,
+            "requests": self.requests,
+            "errors": self.errors
+        }
+
+class BackendPool:
+    """
+    多个Ollama节点组成的节点池
+
+    每个请求分配给未被摘除、正在处理请求最少的节点（数量相同时轮流分配），
+    所有节点都被摘除时仍尝试最早恢复的节点。后台任务定期探测各节点，
+    探测失败的节点被摘除，探测成功的节点恢复分配。
+
+    节点池同时负责准入控制：每个节点的并发请求数有上限，
+    超出的请求在有界队列中等待，队列满或等待超时时快速拒绝，避免过载时所有请求一起超时。
+    上限和队列只在当前进程内生效，多个worker时每个节点的总并发为 worker 数 × OLLAMA_BACKEND_CONCURRENCY
+    """
+    def __init__(self, urls: Sequence[str]):
+        self.backends = [OllamaBackend(url) for url in urls]
+        self.task: Optional[asyncio.Task] = None
+        self._next = 0
+        self._waiters = deque()  # 等待节点容量的请求：(future, 排除的节点)
+        self.affinity: "OrderedDict[str, str]" = OrderedDict()  # 对话ID -> 最近处理该对话的节点地址
+
+    def choose(
+        self,
+        exclude: Sequence[OllamaBackend] = (),
+        prefer: Optional[OllamaBackend] = None
+    ) -> Optional[OllamaBackend]:
+        """
+        选择处理下一个请求的节点；exclude 中的节点（如本次请求已失败的节点）不参与选择，
+        prefer 可用且有空闲容量时优先选择
+
+        Returns:
+            有空闲容量的节点；候选节点都已满时返回None
+        """
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        available = [backend for backend in candidates if backend.available(now)]
+        if not available:
+            available = [min(candidates, key=lambda backend: backend.ejected_until)]
+        available = [backend for backend in available if backend.has_capacity()]
+        if not available:
+            return None
+        if prefer is not None and prefer in available:
+            return prefer
+
+        # 从轮转位置开始取负载最低的节点，负载相同的节点轮流分配
+        start = self._next % len(available)
+        self._next += 1
+        rotated = available[start:] + available[:start]
+        return min(rotated, key=lambda backend: backend.in_flight)
+
+    def check_admission(self):
+        """在处理请求之前快速判断是否会被拒绝：没有空闲节点且等待队列已满时抛出 ModelOverloadedError（429）"""
+        if len(self._waiters) >= settings.OLLAMA_QUEUE_SIZE and self.choose() is None:
+            metrics.increment("ollama.rejected_queue_full")
+            raise ModelOverloadedError(429, "模型服务繁忙，请稍后重试", settings.OLLAMA_RETRY_AFTER)
+
+    def preferred(self, key: Optional[str]) -> Optional[OllamaBackend]:
+        """最近处理过对话 key 的节点"""
+        url = self.affinity.get(key) if key else None
+        for backend in self.backends:
+            if backend.url == url:
+                return backend
+        return None
+
+    def remember(self, key: Optional[str], backend: OllamaBackend):
+        """
+        记录处理对话 key 的节点
+
+        同一对话的后续请求优先发往该节点：模型常驻内存时，节点可以复用上一轮已计算的相同前缀，
+        只需处理新增的消息
+        """
+        if not key:
+            return
+        self.affinity[key] = backend.url
+        self.affinity.move_to_end(key)
+        while len(self.affinity) > AFFINITY_CACHE_SIZE:
+            self.affinity.popitem(last=False)
+
+    async def acquire(
+        self,
+        exclude: Sequence[OllamaBackend] = (),
+        affinity_key: Optional[str] = None
+    ) -> Optional[OllamaBackend]:
+        """
+        为一个请求占用节点容量，用完后必须调用 release
+
+        有空闲容量时优先使用最近处理过 affinity_key 对应对话的节点。
+        没有空闲节点时进入有界等待队列（先到先得），最多等待 OLLAMA_QUEUE_TIMEOUT 秒；
+        队列已满或等待超时时抛出 ModelOverloadedError
+
+        Returns:
+            占用的节点；所有节点都在 exclude 中时返回None
+        """
+        if len(exclude) >= len(self.backends):
+            return None
+        backend = self.choose(exclude, self.preferred(affinity_key))
+        if backend is not None:
+            backend.in_flight += 1
+            metrics.increment("ollama.admitted")
+            return backend
+
+        self.check_admission()
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        entry = (waiter, tuple(exclude))
+        self._waiters.append(entry)
+        metrics.add_gauge("ollama.queue_depth", 1)
+        queued = time.perf_counter()
+        try:
+            backend = await asyncio.wait_for(waiter, settings.OLLAMA_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if not waiter.done() or waiter.cancelled():
+                metrics.increment("ollama.rejected_timeout")
+                raise ModelOverloadedError(503, "模型服务繁忙，排队超时", settings.OLLAMA_RETRY_AFTER)
+            # 超时的同时已被分配节点
+            backend = waiter.result()
+        except asyncio.CancelledError:
+            # 调用方被取消（如客户端断开）时归还已分配的节点
+            if waiter.done() and not waiter.cancelled():
+                self.release(waiter.result())
+            raise
+        finally:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+            metrics.add_gauge("ollama.queue_depth", -1)
+            metrics.observe("ollama.queue_wait_seconds", time.perf_counter() - queued)
+        metrics.increment("ollama.admitted")
+        return backend
+
+    def release(self, backend: OllamaBackend):
+        """归还节点容量，并按排队顺序把空出的容量交给等待中的请求"""
+        backend.in_flight -= 1
+        for entry in list(self._waiters):
+            waiter, exclude = entry
+            if waiter.done():
+                continue
+            candidate = self.choose(exclude)
+            if candidate is None:
+                if self.choose() is None:
+                    break
+                continue
+            candidate.in_flight += 1
+            waiter.set_result(candidate)
+            self._waiters.remove(entry)
+
+    async def probe(self, backend: OllamaBackend):
+        """探测节点是否可用（请求模型列表）"""
+        try:
+            response = await get_client().get(
+                f"{backend.url}/api/tags",
+                timeout=settings.OLLAMA_HEALTH_CHECK_TIMEOUT
+            )
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Ollama节点健康检查失败 {backend.url}: {str(e)}")
+            backend.eject()
+            return
+        backend.record_success()
+
+    async def run_health_checks(self):
+        """后台健康检查任务"""
+        while True:
+            await asyncio.gather(*(self.probe(backend) for backend in self.backends))
+            await asyncio.sleep(settings.OLLAMA_HEALTH_CHECK_INTERVAL)
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [backend.to_dict() for backend in self.backends]
+
+# 创建全局节点池实例
+backend_pool = BackendPool(backend_urls())
+
+def start_health_checks():
+    """启动后台健康检查任务；OLLAMA_HEALTH_CHECK_INTERVAL 为0时不检查"""
+    if settings.OLLAMA_HEALTH_CHECK_INTERVAL <= 0 or backend_pool.task is not None:
+        return
+    backend_pool.task = asyncio.create_task(backend_pool.run_health_checks())
+
+async def stop_health_checks():
+    """停止后台健康检查任务"""
+    task = backend_pool.task
+    if task is None:
+        return
+    backend_pool.task = None
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+def build_prompt(messages: List[Dict[str, str]]) -> str:
+    """将对话历史转换为Ollama /api/generate 所需的提示词"""
+    prompt = ""
+    for msg in messages:
+        role_prefix = ROLE_PREFIXES.get(msg["role"], "Assistant: ")
+        prompt += f"{role_prefix}{msg['content']}\n"
+    
+    prompt += "Assistant: "
+    return prompt
+
+def _keep_alive() -> Any:
+    """keep_alive 参数：纯数字按秒数传递（如 -1 表示一直常驻），其余按时长字符串传递（如 30m）"""
+    value = settings.OLLAMA_KEEP_ALIVE.strip()
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def build_request(messages: List[Dict[str, str]], stream: bool) -> Tuple[str, Dict[str, Any]]:
+    """
+    构建Ollama请求
+
+    chat 模式把对话历史作为结构化消息发送到 /api/chat，由模型的对话模板处理角色；
+    generate 模式把历史拼接为提示词发送到 /api/generate
+
+    Returns:
+        Tuple: 请求路径和请求数据
+    """
+    if settings.OLLAMA_API_MODE == "chat":
+        path = "/api/chat"
+        data = {
+            "model": settings.OLLAMA_MODEL,
+            "messages": [{"role": msg["role"], "content": msg["content"]} for msg in messages],
+            "stream": stream
+        }
+    else:
+        path = "/api/generate"
+        data = {
+            "model": settings.OLLAMA_MODEL,
+            "prompt": build_prompt(messages),
+            "stream": stream
+        }
+    # 生成结束后模型在节点上常驻的时长，下一轮无需重新加载模型
+    if settings.OLLAMA_KEEP_ALIVE:
+        data["keep_alive"] = _keep_alive()
+    return path, data
+
+def _response_text(result: Dict[str, Any]) -> Optional[str]:
+    """从Ollama返回的JSON对象（或流式输出的一行）中取出生成的文本"""
+    if settings.OLLAMA_API_MODE == "chat":
+        return (result.get("message") or {}).get("content")
+    return result.get("response")
+
+async def _acquire_backend(tried: List[OllamaBackend], affinity_key: Optional[str]) -> Optional[OllamaBackend]:
+    """
+    为一次尝试占用节点，并记入 tried
+
+    首次尝试被拒绝时抛出 ModelOverloadedError；重试时没有可用节点则返回None，由调用方结束重试
+    """
+    try:
+        backend = await backend_pool.acquire(exclude=tried, affinity_key=affinity_key)
+    except ModelOverloadedError:
+        if not tried:
+            raise
+        return None
+    if backend is None:
+        return None
+    if tried:
+        metrics.increment("ollama.retries")
+    tried.append(backend)
+    backend.requests += 1
+    metrics.add_gauge("ollama.in_flight", 1)
+    return backend
+
+async def generate_response(messages: List[Dict[str, str]], conversation_id: Optional[str] = None) -> str:
     """
     调用Ollama API生成回复
     
+    生成请求可以安全重试：节点出错时换一个节点重试，最多尝试 OLLAMA_MAX_ATTEMPTS 个节点。
+    没有空闲节点时排队等待，队列已满或排队超时时抛出 ModelOverloadedError
+    
     Args:
         messages: 对话历史消息列表，格式为[{"role": "user", "content": "..."}, ...]
+        conversation_id: 对话ID，同一对话的请求优先发往上一次处理它的节点
         
     Returns:
         str: 模型生成的回复
     """
-    # 转换消息格式为Ollama API所需格式
-    prompt = ""
-    for msg in messages:
-        role_prefix = "User: " if msg["role"] == "user" else "Assistant: "
-        prompt += f"{role_prefix}{msg['content']}\n"
-    
-    prompt += "Assistant: "
-    
     # 构建请求数据
-    data = {
-        "model": settings.OLLAMA_MODEL,
-        "prompt": prompt,
-        "stream": False
-    }
+    path, data = build_request(messages, stream=False)
     
-    try:
-        # 发送请求到Ollama API
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{settings.OLLAMA_BASE_URL}/api/generate",
-                json=data,
-                timeout=60.0
+    tried = []
+    while len(tried) < settings.OLLAMA_MAX_ATTEMPTS:
+        backend = await _acquire_backend(tried, conversation_id)
+        if backend is None:
+            break
+        
+        try:
+            # 发送请求到Ollama API（复用连接池中的连接）
+            response = await get_client().post(
+                f"{backend.url}{path}",
+                json=data
             )
             response.raise_for_status()
             result = response.json()
-            return result.get("response", "抱歉，我无法生成回复。")
-    except Exception as e:
-        print(f"调用Ollama API出错: {str(e)}")
-        return "抱歉，模型服务暂时不可用。"
\ No newline at end of file
+            backend.record_success()
+            backend_pool.remember(conversation_id, backend)
+            return _response_text(result) or EMPTY_REPLY_MESSAGE
+        except Exception as e:
+            print(f"调用Ollama API出错 {backend.url}: {str(e)}")
+            backend.record_failure()
+            metrics.increment("ollama.failures")
+        finally:
+            backend_pool.release(backend)
+            metrics.add_gauge("ollama.in_flight", -1)
+    return UNAVAILABLE_MESSAGE
+
+async def stream_response(messages: List[Dict[str, str]], conversation_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    以流式方式调用Ollama API，逐段返回模型生成的文本
+    
+    Ollama按行返回JSON对象（NDJSON），每行包含新生成的文本（chat 模式为 message.content，generate 模式为 response）。
+    调用方提前结束迭代时响应随之关闭（连接不再放回连接池），Ollama会停止生成。
+    尚未收到任何输出时出错会换一个节点重试；已经输出部分文本后出错则抛出 IncompleteResponseError。
+    准入控制同 generate_response
+    
+    Args:
+        messages: 对话历史消息列表，格式为[{"role": "user", "content": "..."}, ...]
+        conversation_id: 对话ID，同一对话的请求优先发往上一次处理它的节点
+    """
+    path, data = build_request(messages, stream=True)
+    
+    produced = False
+    tried = []
+    while not produced and len(tried) < settings.OLLAMA_MAX_ATTEMPTS:
+        backend = await _acquire_backend(tried, conversation_id)
+        if backend is None:
+            break
+        
+        try:
+            async with get_client().stream(
+                "POST",
+                f"{backend.url}{path}",
+                json=data
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"])
+                    text = _response_text(chunk)
+                    if text:
+                        produced = True
+                        yield text
+                    if chunk.get("done"):
+                        break
+            backend.record_success()
+            backend_pool.remember(conversation_id, backend)
+            return
+        except Exception as e:
+            print(f"调用Ollama API出错 {backend.url}: {str(e)}")
+            backend.record_failure()
+            metrics.increment("ollama.failures")
+        finally:
+            backend_pool.release(backend)
+            metrics.add_gauge("ollama.in_flight", -1)
+    
+    if produced:
+        # 已输出部分文本，无法换节点重试
+        raise IncompleteResponseError("模型输出中断")
+    yield UNAVAILABLE_MESSAGE
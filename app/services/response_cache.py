@@ -0,0 +1,147 @@
+import hashlib
+import json
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Tuple
+from pymongo.errors import PyMongoError
+from app.core.config import settings
+from app.db.mongodb import db
+from app.utils.metrics import metrics
+
+def _normalize_content(content: str) -> str:
+    """统一全角/半角和空白，使只在格式上不同的消息命中同一条缓存"""
+    return " ".join(unicodedata.normalize("NFKC", content).split())
+
+class ResponseCache:
+    """
+    模型回复缓存
+
+    键为模型、调用方式和发送给模型的消息窗口（规范化后）的哈希。
+    第一层为进程内LRU缓存，受条目数和总字节数限制，条目超过 RESPONSE_CACHE_TTL 秒后失效；
+    RESPONSE_CACHE_BACKEND=mongo 时第二层保存在 response_cache 集合中，由所有worker共享，
+    过期文档由TTL索引（见 app/db/indexes.py）清理。只缓存不含敏感词、未被中断的回复
+    """
+    def __init__(self):
+        self.entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # 键 -> (回复, 过期时间)
+        self.size = 0  # 缓存回复的总字节数
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.RESPONSE_CACHE_ENABLED
+
+    def make_key(self, messages: List[Dict[str, str]]) -> str:
+        window = [[msg["role"], _normalize_content(msg["content"])] for msg in messages]
+        payload = json.dumps(
+            [settings.OLLAMA_MODEL, settings.OLLAMA_API_MODE, window],
+            ensure_ascii=False, separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _remove(self, key: str):
+        content, _ = self.entries.pop(key)
+        self.size -= len(content.encode("utf-8"))
+
+    def _store(self, key: str, content: str, expires_at: float):
+        """写入进程内缓存，按LRU顺序淘汰超出条目数或字节数上限的条目"""
+        nbytes = len(content.encode("utf-8"))
+        if nbytes > settings.RESPONSE_CACHE_MAX_BYTES:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (content, expires_at)
+        self.size += nbytes
+        while len(self.entries) > settings.RESPONSE_CACHE_MAX_ENTRIES or self.size > settings.RESPONSE_CACHE_MAX_BYTES:
+            self._remove(next(iter(self.entries)))
+            metrics.increment("response_cache.evictions")
+        self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.set_gauge("response_cache.entries", len(self.entries))
+        metrics.set_gauge("response_cache.bytes", self.size)
+
+    def _record_lookup(self, hit: bool):
+        if hit:
+            self.hits += 1
+            metrics.increment("response_cache.hits")
+        else:
+            self.misses += 1
+            metrics.increment("response_cache.misses")
+        metrics.set_gauge("response_cache.hit_rate", round(self.hits / (self.hits + self.misses), 4))
+
+    async def get(self, key: str) -> Optional[str]:
+        """查找缓存的回复，依次查找进程内缓存和MongoDB"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            content, expires_at = entry
+            if expires_at > time.time():
+                self.entries.move_to_end(key)
+                metrics.increment("response_cache.memory_hits")
+                self._record_lookup(True)
+                return content
+            self._remove(key)
+            self._update_gauges()
+
+        if settings.RESPONSE_CACHE_BACKEND == "mongo":
+            try:
+                document = await db.db.response_cache.find_one({
+                    "_id": key,
+                    "expires_at": {"$gt": datetime.utcnow()}
+                })
+            except PyMongoError as e:
+                print(f"读取回复缓存出错: {str(e)}")
+                document = None
+            if document is not None:
+                # 提升到进程内缓存，剩余有效期不变
+                remaining = (document["expires_at"] - datetime.utcnow()).total_seconds()
+                self._store(key, document["content"], time.time() + remaining)
+                metrics.increment("response_cache.mongo_hits")
+                self._record_lookup(True)
+                return document["content"]
+
+        self._record_lookup(False)
+        return None
+
+    async def put(self, key: str, content: str):
+        """缓存一条回复"""
+        self._store(key, content, time.time() + settings.RESPONSE_CACHE_TTL)
+        if settings.RESPONSE_CACHE_BACKEND == "mongo":
+            try:
+                await db.db.response_cache.replace_one(
+                    {"_id": key},
+                    {
+                        "_id": key,
+                        "model": settings.OLLAMA_MODEL,
+                        "content": content,
+                        "expires_at": datetime.utcnow() + timedelta(seconds=settings.RESPONSE_CACHE_TTL)
+                    },
+                    upsert=True
+                )
+            except PyMongoError as e:
+                print(f"写入回复缓存出错: {str(e)}")
+
+    async def invalidate(self, key: str):
+        """删除一条缓存的回复（如词库更新后该回复已包含敏感词）"""
+        metrics.increment("response_cache.invalidations")
+        if key in self.entries:
+            self._remove(key)
+            self._update_gauges()
+        if settings.RESPONSE_CACHE_BACKEND == "mongo":
+            try:
+                await db.db.response_cache.delete_one({"_id": key})
+            except PyMongoError as e:
+                print(f"删除回复缓存出错: {str(e)}")
+
+    async def clear(self):
+        """清空缓存"""
+        self.entries.clear()
+        self.size = 0
+        self._update_gauges()
+        if settings.RESPONSE_CACHE_BACKEND == "mongo":
+            await db.db.response_cache.delete_many({})
+
+# 创建全局回复缓存实例
+response_cache = ResponseCache()
@@ -1,5 +1,6 @@
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+import asyncio
 from bson.objectid import ObjectId
 from app.db.mongodb import db
 from app.utils.sensitive_word_filter import sensitive_word_filter
@@ -8,6 +9,9 @@ from app.models.sensitive_word import (
     SENSITIVE_WORD_CATEGORIES, SENSITIVE_WORD_SUBCATEGORIES
 )
 from app.schemas.sensitive_word import SensitiveWordCreate
+from app.services.lexicon_sync import (
+    apply_updated_documents, apply_removed_documents, record_lexicon_changes
+)
 
 async def add_sensitive_word(
     word: str, 
@@ -28,15 +32,19 @@ async def add_sensitive_word(
     # 使用全局数据库连接
     sensitive_word = SensitiveWordModel(
         word=word,
+        normalized_word=sensitive_word_filter.normalizer.normalize_word(word),
         category=category,
         subcategory=subcategory,
         severity=severity
     )
     
-    result = await db.db.sensitive_words.insert_one(sensitive_word.dict())
+    document = sensitive_word.dict()
+    result = await db.db.sensitive_words.insert_one(document)
     
-    # 更新敏感词过滤器
-    await sensitive_word_filter.load_sensitive_words()
+    # 增量更新敏感词过滤器，并通知其他worker
+    documents = [{**document, "_id": result.inserted_id}]
+    apply_updated_documents(documents)
+    await record_lexicon_changes("upsert", documents)
     
     return str(result.inserted_id)
 
@@ -59,6 +67,7 @@ async def bulk_import_sensitive_words(words: List[SensitiveWordCreate]) -> int:
         
         word_model = SensitiveWordModel(
             word=word_data.word,
+            normalized_word=sensitive_word_filter.normalizer.normalize_word(word_data.word),
             category=word_data.category,
             subcategory=word_data.subcategory,
             severity=word_data.severity
@@ -68,19 +77,25 @@ async def bulk_import_sensitive_words(words: List[SensitiveWordCreate]) -> int:
     # 批量插入数据库
     result = await db.db.sensitive_words.insert_many(word_models)
     
-    # 更新敏感词过滤器
-    await sensitive_word_filter.load_sensitive_words()
+    # 增量更新敏感词过滤器，并通知其他worker
+    documents = [
+        {**document, "_id": inserted_id}
+        for document, inserted_id in zip(word_models, result.inserted_ids)
+    ]
+    apply_updated_documents(documents)
+    await record_lexicon_changes("upsert", documents)
     
     return len(result.inserted_ids)
 
 async def delete_sensitive_word(word_id: str) -> bool:
     """删除敏感词"""
     # 使用全局数据库连接
-    result = await db.db.sensitive_words.delete_one({"_id": ObjectId(word_id)})
+    document = await db.db.sensitive_words.find_one_and_delete({"_id": ObjectId(word_id)})
     
-    # 更新敏感词过滤器
-    if result.deleted_count > 0:
-        await sensitive_word_filter.load_sensitive_words()
+    # 增量更新敏感词过滤器，并通知其他worker
+    if document:
+        await apply_removed_documents([document])
+        await record_lexicon_changes("delete", [document])
         return True
     return False
 
@@ -123,12 +138,23 @@ async def get_all_sensitive_words(
         })
     return sensitive_words
 
-async def check_sensitive_words(text: str) -> Dict[str, Any]:
-    """检查文本中是否包含敏感词"""
+async def check_sensitive_words(text: str, mode: str = "first") -> Dict[str, Any]:
+    """检查文本中是否包含敏感词，mode 为匹配模式（first / longest / all）"""
     # 使用敏感词过滤器检查文本
-    result = sensitive_word_filter.check_text(text)
+    result = sensitive_word_filter.check_text(text, mode)
     return result
 
+async def check_texts_batch(texts: List[str], mode: str = "first") -> List[Dict[str, Any]]:
+    """批量检查文本，在线程中执行（大批量由进程池并行处理），不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, sensitive_word_filter.check_many, texts, mode)
+
+async def get_filter_memory_report() -> Dict[str, Any]:
+    """获取敏感词过滤器的内存占用报告（对象Trie与紧凑自动机对比）"""
+    # 测量需要遍历整个匹配结构（20万词约百万个状态），在线程中执行
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, sensitive_word_filter.memory_report)
+
 async def record_sensitive_word_usage(
     user_id: str,
     conversation_id: str,
@@ -247,8 +273,10 @@ async def add_category(category: str, subcategories: List[str] = None) -> bool:
         return False
     
     # 创建一个占位敏感词来添加分类
+    placeholder_word = f"__placeholder_{category}__"
     placeholder = SensitiveWordModel(
-        word=f"__placeholder_{category}__",
+        word=placeholder_word,
+        normalized_word=sensitive_word_filter.normalizer.normalize_word(placeholder_word),
         category=category,
         subcategory=subcategories[0] if subcategories else None,
         severity=1,
@@ -284,6 +312,9 @@ async def delete_category(category: str, reassign_to: str = None) -> bool:
     if not category:
         return False
     
+    # 记录受影响的敏感词，用于增量更新过滤器
+    affected = await db.db.sensitive_words.find({"category": category}).to_list(length=None)
+    
     # 如果提供了重新分配的分类，则更新敏感词
     if reassign_to:
         await db.db.sensitive_words.update_many(
@@ -297,7 +328,15 @@ async def delete_category(category: str, reassign_to: str = None) -> bool:
     # 删除占位敏感词
     await db.db.sensitive_words.delete_many({"category": category, "is_placeholder": True})
     
-    # 更新敏感词过滤器
-    await sensitive_word_filter.load_sensitive_words()
+    # 增量更新敏感词过滤器，并通知其他worker
+    if reassign_to:
+        for document in affected:
+            document["category"] = reassign_to
+            document["subcategory"] = None
+        apply_updated_documents(affected)
+        await record_lexicon_changes("upsert", affected)
+    else:
+        await apply_removed_documents(affected)
+        await record_lexicon_changes("delete", affected)
     
     return True
\ No newline at end of file
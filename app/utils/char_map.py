@@ -0,0 +1,24 @@
+# 常用繁体字 -> 简体字映射，用于敏感词匹配前的文本归一化
+# 仅收录敏感词中常见的字，可通过 SENSITIVE_CHAR_MAP_PATH 指定的JSON文件补充
+_TRADITIONAL = (
+    "賭博網詐騙販毒購買賣錢幣銀帳號碼註冊登錄頁連結點擊視頻聽說話語言論"
+    "殺傷殘殲滅槍彈軍戰爭恐怖義極端襲擊爆炸燒燬壞亂"
+    "種族歧視別國際黨選舉議會權獨統陣遊藥麻醉製劑針筒煙"
+    "嫖娼淫穢裸體愛約會聊發東門開關飛機車輛鐵馬鳥魚龍"
+    "們個這那來時間後對問題無為與從會學習經濟業務員動員電話"
+    "線傳銷騙術貸款還債務險資產證劵營運廣告"
+)
+_SIMPLIFIED = (
+    "赌博网诈骗贩毒购买卖钱币银帐号码注册登录页连结点击视频听说话语言论"
+    "杀伤残歼灭枪弹军战争恐怖义极端袭击爆炸烧毁坏乱"
+    "种族歧视别国际党选举议会权独统阵游药麻醉制剂针筒烟"
+    "嫖娼淫秽裸体爱约会聊发东门开关飞机车辆铁马鸟鱼龙"
+    "们个这那来时间后对问题无为与从会学习经济业务员动员电话"
+    "线传销骗术贷款还债务险资产证券营运广告"
+)
+
+TRADITIONAL_TO_SIMPLIFIED = {
+    traditional: simplified
+    for traditional, simplified in zip(_TRADITIONAL, _SIMPLIFIED)
+    if traditional != simplified
+}
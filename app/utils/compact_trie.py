@@ -0,0 +1,457 @@
+from array import array
+from bisect import bisect_left
+from collections import deque
+from typing import List, Dict, Tuple, Any, Iterator
+import json
+
+# 匹配模式：first 为每个起点处最短的敏感词，longest 为每个起点处最长的敏感词，all 为所有（可重叠的）命中
+MATCH_MODES = ("first", "longest", "all")
+
+# 每个紧凑自动机缓存的已解码敏感词信息数量上限
+WORD_INFO_CACHE_SIZE = 4096
+
+def shortest_per_start(
+    matches: Iterator[Tuple[int, int, Dict[str, Any]]]
+) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    """
+    将命中归并为每个起点处最短的敏感词，并按起点排序
+    """
+    shortest = {}
+    for start, end, word_info in matches:
+        current = shortest.get(start)
+        if current is None or end < current[0]:
+            shortest[start] = (end, word_info)
+
+    for start in sorted(shortest):
+        end, word_info = shortest[start]
+        yield start, end, word_info
+
+def longest_per_start(
+    matches: Iterator[Tuple[int, int, Dict[str, Any]]]
+) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    """
+    将命中归并为每个起点处最长的敏感词，并按起点排序
+    """
+    longest = {}
+    for start, end, word_info in matches:
+        current = longest.get(start)
+        if current is None or end > current[0]:
+            longest[start] = (end, word_info)
+
+    for start in sorted(longest):
+        end, word_info = longest[start]
+        yield start, end, word_info
+
+def select_matches(
+    matches: Iterator[Tuple[int, int, Dict[str, Any]]], mode: str = "first"
+) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    """按匹配模式从所有命中中选取结果，结果按起点（其次终点）排序"""
+    if mode == "all":
+        return iter(sorted(matches, key=lambda match: (match[0], match[1])))
+    if mode == "longest":
+        return longest_per_start(matches)
+    return shortest_per_start(matches)
+
+class MatchTally:
+    """
+    按匹配模式统计每个敏感词的命中次数（及可选的命中位置）
+
+    扫描过程中只更新预先分配的数组和计数字典，不为每次命中创建结果对象；
+    first / longest 模式先记录每个起点选中的命中，扫描结束后再计数
+    """
+    def __init__(self, length: int, mode: str = "first", position_limit: int = 0):
+        self.mode = mode
+        self.position_limit = position_limit  # 每个敏感词最多记录的命中位置数，0表示不记录
+        self.counts = {}
+        self.positions = {}
+        if mode != "all":
+            self.ends = array("i", [0]) * length  # 每个起点选中的命中终点，0表示无
+            self.keys = [None] * length
+
+    def add(self, start: int, end: int, key):
+        """记录一次命中，key 为敏感词的编号"""
+        if self.mode == "all":
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if self.position_limit:
+                self._record(key, start, end)
+            return
+        current = self.ends[start]
+        if not current or (end < current if self.mode == "first" else end > current):
+            self.ends[start] = end
+            self.keys[start] = key
+
+    def _record(self, key, start: int, end: int):
+        spans = self.positions.get(key)
+        if spans is None:
+            spans = self.positions[key] = []
+        if len(spans) < self.position_limit:
+            spans.append((start, end))
+
+    def finish(self) -> Tuple[Dict[Any, int], Dict[Any, List[Tuple[int, int]]]]:
+        """
+        结束统计
+
+        Returns:
+            Tuple: 敏感词编号 -> 命中次数，以及 敏感词编号 -> 按起点排序的命中区间
+        """
+        if self.mode != "all":
+            ends = self.ends
+            counts = self.counts
+            for start, key in enumerate(self.keys):
+                if key is None:
+                    continue
+                counts[key] = counts.get(key, 0) + 1
+                if self.position_limit:
+                    self._record(key, start, ends[start])
+        return self.counts, self.positions
+
+def _encode_record(word_info: Dict[str, Any]) -> bytes:
+    """敏感词信息在 records 列中的编码"""
+    return json.dumps(word_info, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class CompactTrie:
+    """
+    紧凑的只读AC自动机
+
+    状态按层序编号，所有转移边按状态连续存放在扁平数组中：
+    - edge_offsets[s] 到 edge_offsets[s + 1] 为状态s的转移边区间
+    - 区间内的 edge_chars 按字符码点升序排列，edge_targets 为对应的目标状态
+    - fail / output 为失配指针和输出链接，word_ids 为状态对应的敏感词编号（-1表示无）
+    - word_lengths 为各敏感词归一化后的长度，即命中时在归一化文本中的跨度
+
+    敏感词的完整信息按整数编号打包存放，不展开为对象：
+    - records 为各敏感词信息的JSON编码依次拼接，record_offsets[i] 到 record_offsets[i + 1] 为第i个敏感词的区间
+    - ids 为各敏感词ID（UTF-8）依次拼接，区间由 id_offsets 给出；id_order 为按ID排序的敏感词编号，用于按ID查找
+    敏感词信息在命中或查询时才解码（并缓存最近使用的一部分），从快照映射时这些列与转移表一样由各进程共享。
+    """
+
+    def __init__(
+        self,
+        edge_offsets: array,
+        edge_chars: array,
+        edge_targets: array,
+        fail: array,
+        output: array,
+        word_ids: array,
+        word_lengths: array,
+        record_offsets: array,
+        records: bytes,
+        id_offsets: array,
+        ids: bytes,
+        id_order: array
+    ):
+        self.edge_offsets = edge_offsets
+        self.edge_chars = edge_chars
+        self.edge_targets = edge_targets
+        self.fail = fail
+        self.output = output
+        self.word_ids = word_ids
+        self.word_lengths = word_lengths
+        self.record_offsets = record_offsets
+        self.records = records
+        self.id_offsets = id_offsets
+        self.ids = ids
+        self.id_order = id_order
+        self.buffer = None  # 从快照加载时引用的内存映射
+        self._info_cache = {}  # 敏感词编号 -> 已解码的敏感词信息
+
+    @classmethod
+    def build(cls, sensitive_words: Dict[str, Dict[str, Any]]) -> "CompactTrie":
+        """由 归一化后的敏感词 -> 敏感词信息 的字典构建紧凑自动机"""
+        words = []
+        word_lengths = array("I")
+        # 构建过程中使用的临时Trie，状态0为根节点
+        children = [{}]
+        terminal = [-1]
+
+        for word, word_info in sensitive_words.items():
+            if not word:
+                continue
+            state = 0
+            for char in word:
+                next_state = children[state].get(char)
+                if next_state is None:
+                    next_state = len(children)
+                    children[state][char] = next_state
+                    children.append({})
+                    terminal.append(-1)
+                state = next_state
+            if terminal[state] < 0:
+                terminal[state] = len(words)
+                words.append(word_info)
+                word_lengths.append(len(word))
+            else:
+                words[terminal[state]] = word_info
+
+        # 按层序重新编号，使同层状态在数组中相邻
+        order = [0]
+        queue = deque([0])
+        while queue:
+            state = queue.popleft()
+            for char in sorted(children[state]):
+                child = children[state][char]
+                order.append(child)
+                queue.append(child)
+        new_id = [0] * len(order)
+        for index, state in enumerate(order):
+            new_id[state] = index
+
+        edge_offsets = array("I", [0])
+        edge_chars = array("I")
+        edge_targets = array("I")
+        word_ids = array("i")
+        for state in order:
+            for char in sorted(children[state]):
+                edge_chars.append(ord(char))
+                edge_targets.append(new_id[children[state][char]])
+            edge_offsets.append(len(edge_chars))
+            word_ids.append(terminal[state])
+
+        record_offsets = array("I", [0])
+        records = bytearray()
+        id_offsets = array("I", [0])
+        ids = bytearray()
+        for word_info in words:
+            records += _encode_record(word_info)
+            record_offsets.append(len(records))
+            ids += str(word_info["id"]).encode("utf-8")
+            id_offsets.append(len(ids))
+        id_order = array("I", sorted(range(len(words)), key=lambda index: str(words[index]["id"])))
+
+        trie = cls(
+            edge_offsets, edge_chars, edge_targets,
+            array("i", [-1]) * len(order), array("i", [-1]) * len(order),
+            word_ids, word_lengths, record_offsets, bytes(records), id_offsets, bytes(ids), id_order
+        )
+        trie._build_links()
+        return trie
+
+    @staticmethod
+    def estimate_nbytes(state_count: int, word_infos: Iterator[Dict[str, Any]]) -> int:
+        """
+        按状态数和敏感词信息估算 build 生成的紧凑自动机占用的字节数（与 nbytes 的口径一致），不实际构建
+
+        除根状态外每个状态恰好有一条入边，转移数为状态数减一
+        """
+        word_count = 0
+        packed_bytes = 0
+        for word_info in word_infos:
+            word_count += 1
+            packed_bytes += len(_encode_record(word_info)) + len(str(word_info["id"]).encode("utf-8"))
+        edge_count = max(state_count - 1, 0)
+        # 各数组元素均为4字节：转移表、失配指针、输出链接、状态对应的敏感词编号，以及按敏感词编号索引的列
+        items = (state_count + 1) + 2 * edge_count + 3 * state_count + word_count + 2 * (word_count + 1) + word_count
+        return items * array("I").itemsize + packed_bytes
+
+    def _build_links(self):
+        """按层序计算失配指针和输出链接"""
+        fail = self.fail
+        output = self.output
+        word_ids = self.word_ids
+        offsets = self.edge_offsets
+        chars = self.edge_chars
+        targets = self.edge_targets
+
+        queue = deque()
+        for i in range(offsets[0], offsets[1]):
+            child = targets[i]
+            fail[child] = 0
+            queue.append(child)
+
+        while queue:
+            state = queue.popleft()
+            for i in range(offsets[state], offsets[state + 1]):
+                code = chars[i]
+                child = targets[i]
+                # 沿父状态的失配链寻找能接受该字符的最长后缀
+                f = fail[state]
+                target = self._goto(f, code)
+                while target < 0 and f > 0:
+                    f = fail[f]
+                    target = self._goto(f, code)
+                fail[child] = target if target >= 0 else 0
+
+                # 输出链接指向失配链上最近的敏感词结尾状态
+                f = fail[child]
+                output[child] = f if word_ids[f] >= 0 else output[f]
+                queue.append(child)
+
+    def _goto(self, state: int, code: int) -> int:
+        """查找状态state经字符码点code的转移，不存在时返回-1"""
+        lo = self.edge_offsets[state]
+        hi = self.edge_offsets[state + 1]
+        i = bisect_left(self.edge_chars, code, lo, hi)
+        if i < hi and self.edge_chars[i] == code:
+            return self.edge_targets[i]
+        return -1
+
+    @property
+    def state_count(self) -> int:
+        return len(self.word_ids)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.word_lengths)
+
+    def _decode_word_info(self, index: int) -> Dict[str, Any]:
+        offsets = self.record_offsets
+        return json.loads(bytes(self.records[offsets[index]:offsets[index + 1]]))
+
+    def word_info(self, index: int) -> Dict[str, Any]:
+        """
+        第index个敏感词的信息
+
+        返回的字典可能被缓存并在多次命中之间共用，调用方不能修改
+        """
+        cache = self._info_cache
+        word_info = cache.get(index)
+        if word_info is None:
+            if len(cache) >= WORD_INFO_CACHE_SIZE:
+                cache.clear()
+            word_info = cache[index] = self._decode_word_info(index)
+        return word_info
+
+    def word_id(self, index: int) -> str:
+        """第index个敏感词的ID，不解码敏感词信息"""
+        offsets = self.id_offsets
+        return bytes(self.ids[offsets[index]:offsets[index + 1]]).decode("utf-8")
+
+    def find_id(self, word_id: str) -> int:
+        """按敏感词ID二分查找敏感词编号，不存在时返回-1"""
+        order = self.id_order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.word_id(order[mid]) < word_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order) and self.word_id(order[lo]) == word_id:
+            return order[lo]
+        return -1
+
+    def find_word(self, word: str) -> int:
+        """沿转移表查找归一化后的敏感词的编号，复杂度为O(词长)，不存在时返回-1"""
+        state = 0
+        for char in word:
+            state = self._goto(state, ord(char))
+            if state < 0:
+                return -1
+        return self.word_ids[state]
+
+    def iter_items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        遍历全部 归一化后的敏感词 -> 敏感词信息（不写入缓存），用于重建和导出
+
+        敏感词由转移表上从根到结尾状态的路径还原，与构建时的键一致
+        """
+        offsets = self.edge_offsets
+        chars = self.edge_chars
+        targets = self.edge_targets
+        word_ids = self.word_ids
+        stack = [(0, "")]
+        while stack:
+            state, word = stack.pop()
+            if word_ids[state] >= 0:
+                yield word, self._decode_word_info(word_ids[state])
+            for i in range(offsets[state], offsets[state + 1]):
+                stack.append((targets[i], word + chr(chars[i])))
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """
+        单遍扫描文本，返回每个起点处最短的敏感词
+
+        与 SensitiveWordFilter 的对象Trie实现语义一致
+        """
+        return shortest_per_start(self.iter_all_matches(text))
+
+    def iter_all_matches(self, text: str) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """单遍扫描文本，按终点顺序返回所有（可重叠的）敏感词命中"""
+        hits = []
+        self.feed(0, text, hits)
+        return iter(hits)
+
+    def feed(self, state: int, text: str, hits: List[Tuple[int, int, Dict[str, Any]]]) -> int:
+        """
+        从状态state开始扫描一段文本，命中按终点顺序追加到hits
+
+        命中区间相对于本段文本的起点，跨越段边界的命中起点为负数；
+        返回扫描结束时的状态，用于继续扫描下一段（流式匹配）
+        """
+        offsets = self.edge_offsets
+        chars = self.edge_chars
+        targets = self.edge_targets
+        fail = self.fail
+        output = self.output
+        word_ids = self.word_ids
+        word_lengths = self.word_lengths
+        cache = self._info_cache
+        word_info = self.word_info
+
+        for j, char in enumerate(text):
+            code = ord(char)
+            while True:
+                lo = offsets[state]
+                hi = offsets[state + 1]
+                i = bisect_left(chars, code, lo, hi)
+                if i < hi and chars[i] == code:
+                    state = targets[i]
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+
+            hit = state if word_ids[state] >= 0 else output[state]
+            while hit >= 0:
+                word_id = word_ids[hit]
+                hits.append((j + 1 - word_lengths[word_id], j + 1, cache.get(word_id) or word_info(word_id)))
+                hit = output[hit]
+        return state
+
+    @property
+    def max_word_length(self) -> int:
+        """最长敏感词（归一化后）的长度"""
+        return max(self.word_lengths) if len(self.word_lengths) else 0
+
+    def tally_matches(self, text: str, tally: MatchTally):
+        """单遍扫描文本，将命中直接计入统计，敏感词编号为侧表下标"""
+        offsets = self.edge_offsets
+        chars = self.edge_chars
+        targets = self.edge_targets
+        fail = self.fail
+        output = self.output
+        word_ids = self.word_ids
+        word_lengths = self.word_lengths
+        add = tally.add
+
+        state = 0
+
+        for j, char in enumerate(text):
+            code = ord(char)
+            while True:
+                lo = offsets[state]
+                hi = offsets[state + 1]
+                i = bisect_left(chars, code, lo, hi)
+                if i < hi and chars[i] == code:
+                    state = targets[i]
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+
+            hit = state if word_ids[state] >= 0 else output[state]
+            while hit >= 0:
+                word_id = word_ids[hit]
+                add(j + 1 - word_lengths[word_id], j + 1, word_id)
+                hit = output[hit]
+
+    def nbytes(self) -> int:
+        """转移表和打包的敏感词信息列占用的字节数（不含已解码并缓存的敏感词信息）"""
+        return sum(
+            len(table) * table.itemsize
+            for table in (
+                self.edge_offsets, self.edge_chars, self.edge_targets,
+                self.fail, self.output, self.word_ids, self.word_lengths,
+                self.record_offsets, self.id_offsets, self.id_order
+            )
+        ) + len(self.records) + len(self.ids)
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from datetime import datetime
+from typing import Dict, Any, Tuple
+from app.utils.compact_trie import CompactTrie
+
+# 快照文件格式：魔数 + 头部长度 + JSON头部 + 按8字节对齐的各个数组和字节列
+SNAPSHOT_MAGIC = b"LFSNAP01"
+SNAPSHOT_FORMAT = 3
+SNAPSHOT_TABLES = (
+    "edge_offsets", "edge_chars", "edge_targets", "fail", "output", "word_ids", "word_lengths",
+    "record_offsets", "id_offsets", "id_order"
+)
+# 按原始字节存放的列：打包的敏感词信息和敏感词ID
+SNAPSHOT_BLOBS = ("records", "ids")
+_HEADER_LENGTH = struct.Struct("<I")
+_ALIGNMENT = 8
+
+class SnapshotError(Exception):
+    """快照文件不存在、损坏或与当前平台不兼容"""
+
+def word_info_hash(word_info: Dict[str, Any]) -> int:
+    """计算单个敏感词信息的128位哈希"""
+    digest = hashlib.sha256(json.dumps(
+        [
+            word_info["id"], word_info["word"], word_info.get("category"),
+            word_info.get("subcategory"), word_info.get("severity")
+        ],
+        ensure_ascii=False
+    ).encode("utf-8")).digest()
+    return int.from_bytes(digest[:16], "big")
+
+def lexicon_hash(sensitive_words: Dict[str, Dict[str, Any]]) -> int:
+    """
+    计算词库内容的哈希：各敏感词哈希的异或
+
+    与敏感词的插入顺序无关，增删单个敏感词时可以O(1)增量维护
+    """
+    value = 0
+    for word_info in sensitive_words.values():
+        value ^= word_info_hash(word_info)
+    return value
+
+def format_lexicon_hash(value: int) -> str:
+    return f"{value:032x}"
+
+def _typecode(table) -> str:
+    """array 与内存映射上的 memoryview 分别用 typecode 和 format 表示元素类型"""
+    return getattr(table, "typecode", None) or table.format
+
+def _aligned(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+def write_snapshot(path: str, trie: CompactTrie, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    将紧凑自动机写入快照文件
+
+    先写入临时文件再原子替换，正在读取旧快照的进程不受影响
+
+    Args:
+        path: 快照文件路径
+        trie: 紧凑自动机
+        metadata: 写入头部的附加信息（词库哈希、归一化配置、变更日志版本等）
+
+    Returns:
+        Dict[str, Any]: 快照头部
+    """
+    header = {
+        **metadata,
+        "format": SNAPSHOT_FORMAT,
+        "byteorder": sys.byteorder,
+        "created_at": datetime.now().isoformat(),
+        "state_count": trie.state_count,
+        "word_count": trie.word_count,
+        "tables": {name: [0, 0, _typecode(getattr(trie, name))] for name in SNAPSHOT_TABLES},
+        "blobs": {name: [0, len(getattr(trie, name))] for name in SNAPSHOT_BLOBS}
+    }
+    # 头部长度决定各段偏移，而偏移又写在头部中：预留空间直到头部能够容纳实际偏移
+    header_size = 256
+    while True:
+        offset = _aligned(len(SNAPSHOT_MAGIC) + _HEADER_LENGTH.size + header_size)
+        for name in SNAPSHOT_TABLES:
+            table = getattr(trie, name)
+            nbytes = len(table) * table.itemsize
+            header["tables"][name] = [offset, nbytes, _typecode(table)]
+            offset = _aligned(offset + nbytes)
+        for name in SNAPSHOT_BLOBS:
+            nbytes = len(getattr(trie, name))
+            header["blobs"][name] = [offset, nbytes]
+            offset = _aligned(offset + nbytes)
+
+        header_bytes = json.dumps(header).encode("utf-8")
+        if len(header_bytes) <= header_size:
+            break
+        header_size *= 2
+    header_bytes += b" " * (header_size - len(header_bytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(_HEADER_LENGTH.pack(header_size))
+        f.write(header_bytes)
+        for name in SNAPSHOT_TABLES:
+            table_offset = header["tables"][name][0]
+            f.write(b"\0" * (table_offset - f.tell()))
+            f.write(getattr(trie, name).tobytes())
+        for name in SNAPSHOT_BLOBS:
+            f.write(b"\0" * (header["blobs"][name][0] - f.tell()))
+            f.write(getattr(trie, name))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return header
+
+def read_snapshot_header(path: str) -> Dict[str, Any]:
+    """只读取快照头部，用于判断快照是否过期"""
+    try:
+        with open(path, "rb") as f:
+            return _parse_header(f.read(len(SNAPSHOT_MAGIC) + _HEADER_LENGTH.size), f)
+    except OSError as e:
+        raise SnapshotError(f"无法读取快照文件 {path}: {str(e)}")
+
+def _parse_header(prefix: bytes, f) -> Dict[str, Any]:
+    if prefix[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise SnapshotError("快照文件格式无效")
+    # 文件被截断或损坏时，解包、JSON解析和字段类型错误都视为快照不可用
+    try:
+        (header_size,) = _HEADER_LENGTH.unpack(prefix[len(SNAPSHOT_MAGIC):])
+        header = json.loads(f.read(header_size))
+    except (struct.error, ValueError) as e:
+        raise SnapshotError(f"快照文件头部损坏: {str(e)}")
+    if not isinstance(header, dict):
+        raise SnapshotError("快照文件头部损坏")
+    if header.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"不支持的快照格式版本: {header.get('format')}")
+    if header.get("byteorder") != sys.byteorder:
+        raise SnapshotError("快照文件的字节序与当前平台不一致")
+    return header
+
+def load_snapshot(path: str) -> Tuple[CompactTrie, Dict[str, Any]]:
+    """
+    以只读内存映射方式加载快照
+
+    转移表和打包的敏感词信息都直接引用映射内存，不做拷贝也不解码；多个进程映射同一文件时共享操作系统页缓存
+
+    Returns:
+        Tuple[CompactTrie, Dict[str, Any]]: 紧凑自动机和快照头部
+    """
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"无法映射快照文件 {path}: {str(e)}")
+
+    view = memoryview(buffer)
+    prefix_size = len(SNAPSHOT_MAGIC) + _HEADER_LENGTH.size
+    tables = {}
+    try:
+        header = _parse_header(bytes(view[:prefix_size]), _BufferReader(view, prefix_size))
+        for name in SNAPSHOT_TABLES:
+            offset, nbytes, typecode = header["tables"][name]
+            tables[name] = view[_section(view, offset, nbytes)].cast(typecode)
+        for name in SNAPSHOT_BLOBS:
+            offset, nbytes = header["blobs"][name]
+            tables[name] = view[_section(view, offset, nbytes)]
+    except (KeyError, TypeError, ValueError) as e:
+        _release(tables, view, buffer)
+        raise SnapshotError(f"快照文件损坏: {str(e)}")
+    except SnapshotError:
+        _release(tables, view, buffer)
+        raise
+
+    trie = CompactTrie(**tables)
+    trie.buffer = buffer  # 保持映射存活
+    return trie, header
+
+def _section(view: memoryview, offset: int, size: int) -> slice:
+    """校验头部记录的段位于文件范围内（文件被截断时段会越界）"""
+    if offset < 0 or size < 0 or offset + size > len(view):
+        raise SnapshotError(f"快照文件不完整: 偏移 {offset} 长度 {size} 超出文件大小 {len(view)}")
+    return slice(offset, offset + size)
+
+def _release(tables: Dict[str, memoryview], view: memoryview, buffer: mmap.mmap):
+    """加载失败时释放已创建的视图并关闭映射"""
+    for table in tables.values():
+        table.release()
+    view.release()
+    buffer.close()
+
+class _BufferReader:
+    """为内存映射提供与文件对象相同的read接口，供头部解析复用"""
+    def __init__(self, view: memoryview, position: int):
+        self.view = view
+        self.position = position
+
+    def read(self, size: int) -> bytes:
+        data = bytes(self.view[self.position:self.position + size])
+        self.position += size
+        return data
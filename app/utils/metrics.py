@@ -0,0 +1,91 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, Any, Tuple
+
+# 耗时分布的桶上界（秒），最后一个桶收纳所有更大的值
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+class Summary:
+    """耗时（或其他数值）的汇总：次数、总和、最大值以及分桶计数"""
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+
+    def quantile(self, q: float) -> float:
+        """按分桶估算分位数，返回所在桶的上界"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.bucket_counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total": round(self.total, 6),
+            "avg": round(self.total / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99)
+        }
+
+class MetricsRegistry:
+    """
+    进程内的简单指标注册表：计数器、瞬时值和汇总
+
+    各指标在首次使用时创建；更新可能来自线程池，使用锁保护
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.summaries: Dict[str, Summary] = {}
+
+    def increment(self, name: str, value: float = 1):
+        """计数器累加"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        """设置瞬时值"""
+        with self._lock:
+            self.gauges[name] = value
+
+    def add_gauge(self, name: str, delta: float):
+        """瞬时值增减，如队列深度"""
+        with self._lock:
+            self.gauges[name] = self.gauges.get(name, 0) + delta
+
+    def observe(self, name: str, value: float):
+        """记录一次观测值，如耗时（秒）"""
+        with self._lock:
+            summary = self.summaries.get(name)
+            if summary is None:
+                summary = self.summaries[name] = Summary()
+            summary.observe(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回所有指标的当前值"""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "summaries": {name: summary.to_dict() for name, summary in self.summaries.items()}
+            }
+
+# 创建全局指标注册表
+metrics = MetricsRegistry()
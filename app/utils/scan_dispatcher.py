@@ -0,0 +1,81 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any, Optional
+from app.core.config import settings
+from app.utils.metrics import metrics
+
+class ScanDispatcher:
+    """
+    按文本长度分派敏感词扫描
+
+    短文本直接在事件循环中扫描，避免线程切换的开销；
+    超过 SENSITIVE_SCAN_OFFLOAD_THRESHOLD 个字符的文本交给有界线程池扫描。
+    扫描在线程中执行时，解释器每隔一个切换间隔就会让出执行权，
+    其他请求的延迟不再取决于正在扫描的最大消息。
+    同时排队的扫描数受 SENSITIVE_SCAN_MAX_PENDING 限制，超出时调用方异步等待。
+    """
+    def __init__(self):
+        self.threshold = settings.SENSITIVE_SCAN_OFFLOAD_THRESHOLD
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=settings.SENSITIVE_SCAN_WORKERS,
+                thread_name_prefix="text-scan"
+            )
+            self._slots = asyncio.Semaphore(settings.SENSITIVE_SCAN_WORKERS + settings.SENSITIVE_SCAN_MAX_PENDING)
+        return self.executor
+
+    async def run(self, scan: Callable[..., Any], text: str, *args) -> Any:
+        """
+        执行扫描函数 scan(text, *args)
+
+        Args:
+            scan: 扫描函数，如 sensitive_word_filter.count_text
+            text: 要扫描的文本，按其长度选择执行方式
+        """
+        if len(text) < self.threshold:
+            started = time.perf_counter()
+            result = scan(text, *args)
+            metrics.increment("text_scan.inline")
+            metrics.observe("text_scan.inline_seconds", time.perf_counter() - started)
+            return result
+
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        queued = time.perf_counter()
+        metrics.add_gauge("text_scan.waiting", 1)
+        try:
+            await self._slots.acquire()
+        finally:
+            metrics.add_gauge("text_scan.waiting", -1)
+
+        metrics.add_gauge("text_scan.queue_depth", 1)
+        try:
+            def timed_scan():
+                started = time.perf_counter()
+                metrics.observe("text_scan.queue_seconds", started - queued)
+                try:
+                    return scan(text, *args)
+                finally:
+                    metrics.observe("text_scan.offloaded_seconds", time.perf_counter() - started)
+
+            result = await loop.run_in_executor(executor, timed_scan)
+            metrics.increment("text_scan.offloaded")
+            return result
+        finally:
+            metrics.add_gauge("text_scan.queue_depth", -1)
+            self._slots.release()
+
+    def shutdown(self):
+        """关闭扫描线程池"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+            self._slots = None
+
+# 创建全局扫描分派器实例
+scan_dispatcher = ScanDispatcher()
@@ -1,5 +1,102 @@
-from typing import List, Set, Dict, Tuple, Any
+from typing import List, Set, Dict, Tuple, Any, Iterator, Optional, Callable
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import weakref
+from app.core.config import settings
 from app.db.mongodb import db
+from app.utils.char_map import TRADITIONAL_TO_SIMPLIFIED
+from app.utils.compact_trie import MATCH_MODES, CompactTrie, MatchTally, select_matches
+from app.utils.lexicon_snapshot import (
+    SnapshotError, format_lexicon_hash, lexicon_hash, load_snapshot, read_snapshot_header, word_info_hash,
+    write_snapshot
+)
+from app.utils.shared_lexicon import SharedLexiconStore, prune_snapshots
+
+# 支持的匹配引擎
+FILTER_ENGINES = ("automaton", "compact")
+
+# 批量检查快照文件名前缀，以及除当前快照外保留的旧快照数量
+BATCH_SNAPSHOT_PREFIX = "batch-"
+KEEP_PREVIOUS_BATCH_SNAPSHOTS = 1
+
+class TextNormalizer:
+    """
+    匹配前的文本归一化：全角转半角、字符映射（如繁体转简体）、跳过干扰字符
+
+    单遍扫描文本，同时生成归一化文本中每个字符在原文中的位置，
+    命中的区间可以据此换算回原文。敏感词使用同样的规则归一化后再插入词库。
+    """
+    def __init__(self, fold_width: bool = True, char_map: Optional[Dict[str, str]] = None, noise_chars: str = ""):
+        self.fold_width = fold_width
+        self.char_map = dict(char_map or {})
+        self.noise_chars = frozenset(noise_chars)
+        self._cache = {}  # 原字符 -> 归一化结果（空字符串表示跳过）
+        # 归一化配置的指纹，用于判断快照和共享段是否按相同规则构建
+        self.signature = hashlib.sha256(json.dumps(
+            [fold_width, sorted(self.char_map.items()), sorted(self.noise_chars)],
+            ensure_ascii=False
+        ).encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def from_settings(cls) -> "TextNormalizer":
+        """根据配置创建归一化器"""
+        char_map = {}
+        if settings.SENSITIVE_NORMALIZE_TRADITIONAL:
+            char_map.update(TRADITIONAL_TO_SIMPLIFIED)
+        if settings.SENSITIVE_CHAR_MAP_PATH:
+            with open(settings.SENSITIVE_CHAR_MAP_PATH, "r", encoding="utf-8") as f:
+                char_map.update(json.load(f))
+        return cls(settings.SENSITIVE_NORMALIZE_WIDTH, char_map, settings.SENSITIVE_NOISE_CHARS)
+
+    def _fold_char(self, char: str) -> str:
+        """计算单个字符的归一化结果"""
+        if self.fold_width:
+            code = ord(char)
+            if 0xFF01 <= code <= 0xFF5E:
+                char = chr(code - 0xFEE0)
+            elif code == 0x3000:
+                char = " "
+        char = "".join(self.char_map.get(c, c) for c in char.lower())
+        if char in self.noise_chars:
+            return ""
+        return char
+
+    def normalize(self, text: str) -> Tuple[str, List[int]]:
+        """
+        归一化文本
+
+        Returns:
+            Tuple[str, List[int]]: 归一化后的文本，以及其中每个字符在原文中的下标
+        """
+        cache = self._cache
+        parts = []
+        offsets = []
+        for i, char in enumerate(text):
+            folded = cache.get(char)
+            if folded is None:
+                folded = cache[char] = self._fold_char(char)
+            if not folded:
+                continue
+            parts.append(folded)
+            if len(folded) == 1:
+                offsets.append(i)
+            else:
+                offsets.extend([i] * len(folded))
+        return "".join(parts), offsets
+
+    def normalize_word(self, word: str) -> str:
+        """归一化敏感词，作为词库中的键"""
+        return self.normalize(word)[0]
 
 class TrieNode:
     """Trie树节点，用于敏感词匹配"""
@@ -7,33 +104,232 @@ class TrieNode:
         self.children = {}
         self.is_end_of_word = False
         self.word_info = None  # 存储敏感词的完整信息
+        self.word_length = 0  # 归一化后的敏感词长度
+        self.fail = None  # AC自动机失配指针
+        self.output = None  # 沿失配链最近的敏感词结尾节点
+
+def _node_bytes() -> int:
+    node = TrieNode()
+    return sys.getsizeof(node) + sys.getsizeof(node.__dict__)
+
+def _trie_bytes(root: TrieNode) -> Tuple[int, int]:
+    """遍历对象Trie，返回节点数和节点、子节点字典及边上字符占用的字节数"""
+    # 各节点的属性相同，实例字典的大小按一个新节点计算（逐个访问 __dict__ 会为每个节点实际创建实例字典）
+    node_bytes = _node_bytes()
+    node_count = 0
+    trie_bytes = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        node_count += 1
+        trie_bytes += node_bytes + sys.getsizeof(node.children)
+        for char, child in node.children.items():
+            trie_bytes += sys.getsizeof(char)
+            stack.append(child)
+    return node_count, trie_bytes
+
+def _estimated_trie_bytes(trie: CompactTrie) -> int:
+    """按紧凑自动机的状态和转移估算同一词库的对象Trie占用的字节数（与 _trie_bytes 的口径一致），不实际构建"""
+    node_bytes = _node_bytes()
+    children_bytes = {}  # 子节点数 -> 逐个插入子节点得到的字典大小
+    offsets = trie.edge_offsets
+    chars = trie.edge_chars
+    trie_bytes = 0
+    for state in range(trie.state_count):
+        count = offsets[state + 1] - offsets[state]
+        size = children_bytes.get(count)
+        if size is None:
+            children = {}
+            for code in range(count):
+                children[chr(code)] = None
+            size = children_bytes[count] = sys.getsizeof(children)
+        trie_bytes += node_bytes + size
+    for code in chars:
+        trie_bytes += sys.getsizeof(chr(code))
+    return trie_bytes
+
+class Lexicon:
+    """
+    敏感词匹配结构的快照
+
+    完整加载或重建时先在旁路构建新的快照，再通过一次引用替换发布，
+    检查过程中始终只读取同一个快照，不会看到构建到一半的词库。
+    词库以归一化后的敏感词为键，同一敏感词的不同写法只占一个条目。
+
+    快照由只读的基础词库和增量修改层组成：
+    - 基础词库是构建时的敏感词及其编译结构，构建完成后不再修改，各副本直接共享。
+      对象Trie上的AC自动机同时保留敏感词字典；紧凑自动机中的敏感词信息打包存放，按敏感词或ID查询时才解码；
+    - 修改层只记录自上次构建以来新增、更新或删除的敏感词，新增或更新的敏感词另存于 pending Trie。
+      重建前匹配时忽略基础词库中已被覆盖的敏感词，并由 pending Trie 补充；后台重建将修改层合并为新的基础词库。
+
+    已发布的快照不再修改：增量修改在 copy() 得到的副本上进行，再整体替换发布（写时复制），
+    线程中进行的扫描不会与修改并发。副本只复制修改层，复杂度与自上次构建以来的修改数量相关，与词库大小无关。
+    """
+    def __init__(
+        self,
+        engine: str,
+        sensitive_words: Dict[str, Dict[str, Any]],
+        generation: int,
+        normalizer: TextNormalizer
+    ):
+        self.engine = engine
+        self.generation = generation  # 词库版本号，每次加载、重建或增量修改后递增
+        self.normalizer = normalizer
+        self.base_words = sensitive_words  # 基础词库：归一化后的敏感词 -> 敏感词信息，构建后不再修改；使用紧凑自动机时为空
+        self.base_ids = {info["id"]: word for word, info in sensitive_words.items()}  # 基础词库的 敏感词ID -> 归一化后的敏感词
+        self.root = TrieNode()  # automaton 引擎下编译后的AC自动机
+        self.compact = None  # compact 引擎下的紧凑自动机
+        self.overlay = {}  # 修改层：归一化后的敏感词 -> 敏感词信息（None表示已删除）
+        self.overlay_ids = {}  # 修改层：敏感词ID -> 归一化后的敏感词（None表示该ID已不再生效）
+        self.shadowed = set()  # 基础词库中已被更新或删除的敏感词ID，编译结构中的这些命中被忽略
+        self.pending = TrieNode()  # 修改层中新增或更新的敏感词；修改时复制路径上的节点，副本之间直接共享
+        self.word_count = len(sensitive_words)
+        self.stale = False  # 增量修改后编译结构尚未重建
+        self._content_hash = None
+        self._compiled_max_length = 0  # 编译结构中最长敏感词的长度
+        self._pending_max_length = 0
+
+    @property
+    def content_hash(self) -> int:
+        """词库内容哈希，首次使用时计算，之后随增量修改O(1)维护"""
+        if self._content_hash is None:
+            self._content_hash = lexicon_hash(dict(self.items()))
+        return self._content_hash
+
+    def _base_get(self, word: str) -> Optional[Dict[str, Any]]:
+        if self.compact is not None:
+            index = self.compact.find_word(word)
+            return self.compact.word_info(index) if index >= 0 else None
+        return self.base_words.get(word)
+
+    def _base_items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        if self.compact is None:
+            yield from self.base_words.items()
+            return
+        yield from self.compact.iter_items()
+
+    def get(self, word: str) -> Optional[Dict[str, Any]]:
+        """查找归一化后的敏感词的信息"""
+        if word in self.overlay:
+            return self.overlay[word]
+        return self._base_get(word)
+
+    def word_info(self, word_id: str) -> Optional[Dict[str, Any]]:
+        """根据敏感词ID查找当前生效的敏感词信息"""
+        if word_id in self.overlay_ids:
+            word = self.overlay_ids[word_id]
+            return self.overlay[word] if word is not None else None
+        if word_id in self.shadowed:
+            return None
+        if self.compact is not None:
+            index = self.compact.find_id(word_id)
+            return self.compact.word_info(index) if index >= 0 else None
+        word = self.base_ids.get(word_id)
+        return self.base_words[word] if word is not None else None
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """遍历当前生效的全部敏感词，复杂度为O(敏感词数)，用于重建和导出"""
+        overlay = self.overlay
+        for word, word_info in self._base_items():
+            if word not in overlay:
+                yield word, word_info
+        for word, word_info in overlay.items():
+            if word_info is not None:
+                yield word, word_info
+
+    def compile(self):
+        """根据引擎，由基础词库构建匹配结构"""
+        if self.engine == "compact":
+            # 紧凑引擎不保留对象Trie和敏感词字典，敏感词信息打包存放在自动机中
+            self.use_compact(CompactTrie.build(self.base_words))
+            return
+
+        for word, word_info in self.base_words.items():
+            self._add_to_trie(word, word_info)
+        # 所有敏感词插入完成后一次性构建失配指针
+        self._build_automaton()
+        self._compiled_max_length = max(map(len, self.base_words), default=0)
+
+    def use_compact(self, trie: CompactTrie):
+        """
+        使用已编译的紧凑自动机作为匹配结构
+
+        基础词库改由自动机中打包的敏感词信息提供，不再保留敏感词字典：
+        从快照或共享段映射时，进程内不解码、不复制任何敏感词信息，命中或查询时才按编号解码。
+        调用方需保证该自动机与基础词库的内容一致（共享段按词库哈希挂载）
+        """
+        self.compact = trie
+        self._compiled_max_length = trie.max_word_length
+        self.base_words = {}
+        self.base_ids = {}
+        self.word_count = trie.word_count
+
+    def add_word(self, word_info: Dict[str, Any]):
+        """添加（或更新）一个敏感词，复杂度为O(词长)；基础词库不变，敏感词记入修改层并加入 pending Trie"""
+        word = self.normalizer.normalize_word(word_info["word"])
+        if not word:
+            return
+        previous = self.get(word)
+        if previous is not None:
+            self.overlay_ids[previous["id"]] = None
+            if self._content_hash is not None:
+                self._content_hash ^= word_info_hash(previous)
+        else:
+            self.word_count += 1
+        if self._content_hash is not None:
+            self._content_hash ^= word_info_hash(word_info)
+        if word not in self.overlay:
+            base = self._base_get(word)
+            if base is not None:
+                self.shadowed.add(base["id"])
+        self.overlay[word] = word_info
+        self.overlay_ids[word_info["id"]] = word
+        self._add_pending(word, word_info)
+        self._pending_max_length = max(self._pending_max_length, len(word))
+        self.stale = True
+
+    def remove_word(self, word: str) -> bool:
+        """删除一个敏感词，复杂度为O(词长)；编译结构不变，重建前其中的命中被忽略"""
+        word = self.normalizer.normalize_word(word)
+        word_info = self.get(word)
+        if word_info is None:
+            return False
+        self.overlay_ids[word_info["id"]] = None
+        if self._content_hash is not None:
+            self._content_hash ^= word_info_hash(word_info)
+        base = self._base_get(word)
+        if base is not None:
+            self.shadowed.add(base["id"])
+            self.overlay[word] = None
+        else:
+            del self.overlay[word]
+        self._remove_pending(word)
+        self.word_count -= 1
+        self.stale = True
+        return True
+
+    def copy(self) -> "Lexicon":
+        """
+        复制快照用于增量修改：共享只读的基础词库、编译结构和 pending Trie，只复制修改层的字典
+
+        复杂度与自上次构建以来的修改数量成正比（字典的浅复制），批量修改时只复制一次
+        """
+        lexicon = Lexicon(self.engine, {}, self.generation, self.normalizer)
+        lexicon.base_words = self.base_words
+        lexicon.base_ids = self.base_ids
+        lexicon.root = self.root
+        lexicon.compact = self.compact
+        lexicon.overlay = dict(self.overlay)
+        lexicon.overlay_ids = dict(self.overlay_ids)
+        lexicon.shadowed = set(self.shadowed)
+        lexicon.word_count = self.word_count
+        lexicon.stale = self.stale
+        lexicon._content_hash = self._content_hash
+        lexicon._compiled_max_length = self._compiled_max_length
+        lexicon.pending = self.pending
+        lexicon._pending_max_length = self._pending_max_length
+        return lexicon
 
-class SensitiveWordFilter:
-    def __init__(self):
-        self.root = TrieNode()
-        self.sensitive_words = {}  # 改为字典，存储敏感词及其信息
-        
-    async def load_sensitive_words(self):
-        """从数据库加载敏感词"""
-        self.sensitive_words = {}
-        self.root = TrieNode()
-        
-        # 从数据库获取敏感词
-        cursor = db.db.sensitive_words.find({})
-        async for document in cursor:
-            word = document.get("word", "")
-            if word:
-                # 提取敏感词的完整信息
-                word_info = {
-                    "id": str(document.get("_id")),
-                    "word": word,
-                    "category": document.get("category"),
-                    "subcategory": document.get("subcategory"),
-                    "severity": document.get("severity", 1)
-                }
-                self.sensitive_words[word] = word_info
-                self._add_to_trie(word, word_info)
-    
     def _add_to_trie(self, word: str, word_info: Dict[str, Any]):
         """将敏感词添加到Trie树中，并存储其完整信息"""
         node = self.root
@@ -43,62 +339,954 @@ class SensitiveWordFilter:
             node = node.children[char]
         node.is_end_of_word = True
         node.word_info = word_info
-    
-    def check_text(self, text: str) -> Dict[str, Any]:
+        node.word_length = len(word)
+
+    @staticmethod
+    def _clone_node(node: Optional[TrieNode]) -> TrieNode:
+        clone = TrieNode()
+        if node is not None:
+            clone.children = dict(node.children)
+            clone.is_end_of_word = node.is_end_of_word
+            clone.word_info = node.word_info
+            clone.word_length = node.word_length
+        return clone
+
+    def _copy_pending_path(self, word: str) -> List[TrieNode]:
+        """复制 pending Trie 中从根节点到 word 末尾的路径（不存在的节点新建），返回路径上的新节点"""
+        node = self.pending = self._clone_node(self.pending)
+        path = [node]
+        for char in word:
+            child = self._clone_node(node.children.get(char))
+            node.children[char] = child
+            node = child
+            path.append(node)
+        return path
+
+    def _add_pending(self, word: str, word_info: Dict[str, Any]):
         """
-        检查文本是否包含敏感词
-        
-        Args:
-            text: 要检查的文本
-            
-        Returns:
-            Dict[str, Any]: {
-                "contains_sensitive_words": bool,
-                "sensitive_words_found": List[Dict],
-                "highest_severity": int
-            }
+        将敏感词加入 pending Trie
+
+        已有的节点不会被修改，只复制根节点到该词末尾的路径，复杂度为O(词长)，副本可以共享修改前的 pending Trie
         """
-        if not text:
-            return {
-                "contains_sensitive_words": False,
-                "sensitive_words_found": [],
-                "highest_severity": 0
-            }
-        
-        found_words = []
-        highest_severity = 0
-        text_lower = text.lower()  # 转为小写进行匹配
-        
-        # 遍历文本的每个字符作为起点
-        for i in range(len(text_lower)):
+        node = self._copy_pending_path(word)[-1]
+        node.is_end_of_word = True
+        node.word_info = word_info
+        node.word_length = len(word)
+
+    def _remove_pending(self, word: str) -> bool:
+        """从 pending Trie 中删除敏感词（同样复制路径），并自底向上剪除不再通向任何敏感词的分支"""
+        node = self.pending
+        for char in word:
+            node = node.children.get(char)
+            if node is None:
+                return False
+        if not node.is_end_of_word:
+            return False
+
+        path = self._copy_pending_path(word)
+        node = path[-1]
+        node.is_end_of_word = False
+        node.word_info = None
+        for depth in range(len(word), 0, -1):
+            child = path[depth]
+            if child.children or child.is_end_of_word:
+                break
+            del path[depth - 1].children[word[depth - 1]]
+        return True
+
+    def _build_automaton(self):
+        """按层序遍历Trie树，构建AC自动机的失配指针和输出链接"""
+        root = self.root
+        root.fail = None
+        root.output = None
+        queue = deque()
+
+        for child in root.children.values():
+            child.fail = root
+            child.output = None
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in node.children.items():
+                # 沿父节点的失配链寻找能接受该字符的最长后缀
+                fail = node.fail
+                while fail is not None and char not in fail.children:
+                    fail = fail.fail
+                child.fail = fail.children[char] if fail is not None else root
+
+                # 输出链接指向失配链上最近的敏感词结尾节点
+                if child.fail.is_end_of_word and child.fail.word_info:
+                    child.output = child.fail
+                else:
+                    child.output = child.fail.output
+                queue.append(child)
+
+    def iter_matches_trie(self, text: str) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """
+        朴素Trie遍历：以每个字符为起点重新匹配，返回该起点处最短的敏感词
+
+        复杂度为O(n·L)，保留作为AC自动机的参考实现
+        """
+        for i in range(len(text)):
             node = self.root
-            for j in range(i, len(text_lower)):
-                char = text_lower[j]
-                
+            for j in range(i, len(text)):
+                char = text[j]
+
                 # 如果字符不在当前节点的子节点中，结束当前匹配
                 if char not in node.children:
                     break
-                
+
                 node = node.children[char]
-                
+
                 # 如果到达某个敏感词的结尾
                 if node.is_end_of_word and node.word_info:
-                    # 使用原始敏感词信息
-                    word_info = node.word_info.copy()
-                    found_words.append(word_info)
-                    
-                    # 更新最高严重程度
-                    severity = word_info.get("severity", 1)
-                    if severity > highest_severity:
-                        highest_severity = severity
-                    
+                    yield i, j + 1, node.word_info
                     break
-        
+
+    def _iter_all_matches_trie(self, text: str, root: Optional[TrieNode] = None) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """
+        朴素Trie遍历，返回所有（可重叠的）敏感词命中
+
+        用于匹配增量修改后尚未编译的 pending Trie
+        """
+        root = root or self.root
+        if not root.children:
+            return
+        for i in range(len(text)):
+            node = root
+            for j in range(i, len(text)):
+                node = node.children.get(text[j])
+                if node is None:
+                    break
+                if node.is_end_of_word and node.word_info:
+                    yield i, j + 1, node.word_info
+
+    def _iter_all_matches_automaton(self, text: str) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """AC自动机单遍扫描，按终点顺序返回所有（可重叠的）敏感词命中，复杂度为O(n + 命中数)"""
+        hits = []
+        self._feed_automaton(self.root, text, hits)
+        return iter(hits)
+
+    def _feed_automaton(self, node: TrieNode, text: str, hits: List[Tuple[int, int, Dict[str, Any]]]) -> TrieNode:
+        """从节点node开始扫描一段文本，命中（相对于本段起点）追加到hits，返回结束时的节点"""
+        root = self.root
+        for j, char in enumerate(text):
+            while node is not root and char not in node.children:
+                node = node.fail or root
+            node = node.children.get(char, root)
+
+            hit = node if node.is_end_of_word and node.word_info else node.output
+            while hit is not None:
+                hits.append((j + 1 - hit.word_length, j + 1, hit.word_info))
+                hit = hit.output
+        return node
+
+    @staticmethod
+    def _feed_trie(partial: List[Tuple[TrieNode, int]], text: str, hits: List[Tuple[int, int, Dict[str, Any]]], root: TrieNode) -> List[Tuple[TrieNode, int]]:
+        """
+        在普通Trie上增量匹配一段文本，命中（相对于本段起点）追加到hits
+
+        partial 为上一段结束时尚未完成的匹配（节点, 已匹配长度），返回本段结束时的值
+        """
+        for j, char in enumerate(text):
+            advanced = []
+            for node, depth in partial + [(root, 0)]:
+                child = node.children.get(char)
+                if child is None:
+                    continue
+                if child.is_end_of_word and child.word_info:
+                    hits.append((j - depth, j + 1, child.word_info))
+                if child.children:
+                    advanced.append((child, depth + 1))
+            partial = advanced
+        return partial
+
+    def stream_start(self):
+        """流式匹配的初始状态：编译结构的状态，以及 pending Trie 中尚未完成的匹配"""
+        return (0 if self.compact is not None else self.root), []
+
+    def feed(self, state, text: str, hits: List[Tuple[int, int, Dict[str, Any]]]):
+        """从给定状态继续扫描一段文本，返回新的状态，见 CompactTrie.feed"""
+        compiled_state, partial = state
+        compiled_hits = [] if self.stale else hits
+        if self.compact is not None:
+            compiled_state = self.compact.feed(compiled_state, text, compiled_hits)
+        else:
+            compiled_state = self._feed_automaton(compiled_state, text, compiled_hits)
+        if self.stale:
+            shadowed = self.shadowed
+            hits.extend(hit for hit in compiled_hits if hit[2]["id"] not in shadowed)
+            partial = self._feed_trie(partial, text, hits, self.pending)
+        return compiled_state, partial
+
+    @property
+    def max_word_length(self) -> int:
+        """最长敏感词（归一化后）的长度；增量删除后可能偏大，不影响流式匹配的正确性"""
+        return max(self._compiled_max_length, self._pending_max_length)
+
+    def _iter_compiled_matches(self, text: str) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        if self.compact is not None:
+            return self.compact.iter_all_matches(text)
+        return self._iter_all_matches_automaton(text)
+
+    def _iter_all_matches_pending(self, text: str) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """
+        重建前的匹配：编译结构中已删除或已更新的敏感词被忽略，
+        新增或更新的敏感词由 pending Trie 补充
+        """
+        shadowed = self.shadowed
+        for start, end, word_info in self._iter_compiled_matches(text):
+            if word_info["id"] not in shadowed:
+                yield start, end, word_info
+        yield from self._iter_all_matches_trie(text, self.pending)
+
+    def iter_all_matches(self, text: str) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """根据引擎和重建状态选择扫描方式，返回所有（可重叠的）敏感词命中，顺序不定"""
+        if self.stale:
+            return self._iter_all_matches_pending(text)
+        return self._iter_compiled_matches(text)
+
+    def iter_matches(self, text: str, mode: str = "first") -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """按匹配模式返回命中，结果按起点排序"""
+        return select_matches(self.iter_all_matches(text), mode)
+
+    def tally_matches(
+        self, text: str, mode: str = "first", position_limit: int = 0
+    ) -> Tuple[Dict[str, int], Dict[str, List[Tuple[int, int]]]]:
+        """
+        按匹配模式统计各敏感词的命中次数，不生成逐条命中结果
+
+        Returns:
+            Tuple: 敏感词ID -> 命中次数，以及 敏感词ID -> 归一化文本中的命中区间（每个敏感词最多 position_limit 个）
+        """
+        tally = MatchTally(len(text), mode, position_limit)
+        if self.stale:
+            # 重建前的准确匹配路径，只在增量修改后的短时间内使用
+            for start, end, word_info in self.iter_all_matches(text):
+                tally.add(start, end, word_info["id"])
+            return tally.finish()
+
+        if self.compact is not None:
+            self.compact.tally_matches(text, tally)
+            counts, positions = tally.finish()
+            # 只读取命中的敏感词的ID，不解码敏感词信息
+            word_id = self.compact.word_id
+            return (
+                {word_id(index): count for index, count in counts.items()},
+                {word_id(index): spans for index, spans in positions.items()}
+            )
+
+        add = tally.add
+        root = self.root
+        node = root
+        for j, char in enumerate(text):
+            while node is not root and char not in node.children:
+                node = node.fail or root
+            node = node.children.get(char, root)
+
+            hit = node if node.is_end_of_word and node.word_info else node.output
+            while hit is not None:
+                add(j + 1 - hit.word_length, j + 1, hit.word_info["id"])
+                hit = hit.output
+        return tally.finish()
+
+def mask_spans(text: str, spans: Iterator[Tuple[int, int, Any]], mask_char: str, start: int = 0) -> str:
+    """
+    将文本中被命中区间覆盖的字符替换为屏蔽字符
+
+    Args:
+        text: 从原文下标 start 处开始的一段文本
+        spans: 原文中的命中区间，顺序不限，可以重叠或超出本段
+    """
+    chars = None
+    end = start + len(text)
+    for span_start, span_end, _ in spans:
+        if span_end <= start or span_start >= end:
+            continue
+        if chars is None:
+            chars = list(text)
+        for index in range(max(span_start, start), min(span_end, end)):
+            chars[index - start] = mask_char
+    return text if chars is None else "".join(chars)
+
+class StreamMatcher:
+    """
+    流式文本的增量匹配
+
+    文本逐段输入，自动机状态跨段保留，已输入的内容不会重新扫描；
+    命中区间为整段流式文本（原文）中的下标。整个流只使用创建时的词库快照
+    """
+    def __init__(self, lexicon: Lexicon):
+        self.lexicon = lexicon
+        self.state = lexicon.stream_start()
+        # 末尾不足一个最长敏感词长度的内容可能与后续输入组成命中，暂不输出
+        self.hold = max(lexicon.max_word_length - 1, 0)
+        self.text = ""  # 已输入的原文
+        self.offsets = []  # 归一化文本中每个字符在原文中的下标
+        self.hits = []  # 所有命中，按终点顺序
+        self.emitted = 0  # 已由 take_safe 输出的原文长度
+        self.finished = False
+
+    def feed(self, chunk: str) -> List[Tuple[int, int, Dict[str, Any]]]:
+        """
+        输入一段文本
+
+        Returns:
+            List[Tuple[int, int, Dict[str, Any]]]: 本段新产生的命中（可能起始于之前的段）
+        """
+        base = len(self.offsets)
+        length = len(self.text)
+        normalized, offsets = self.lexicon.normalizer.normalize(chunk)
+        self.offsets.extend(offset + length for offset in offsets)
+        self.text += chunk
+
+        local_hits = []
+        self.state = self.lexicon.feed(self.state, normalized, local_hits)
+        all_offsets = self.offsets
+        hits = [
+            (all_offsets[base + start], all_offsets[base + end - 1] + 1, word_info)
+            for start, end, word_info in local_hits
+        ]
+        self.hits.extend(hits)
+        return hits
+
+    def finish(self):
+        """标记输入结束，之后 take_safe 会输出全部剩余文本"""
+        self.finished = True
+
+    def take_safe(self, mask_char: Optional[str] = None) -> str:
+        """
+        返回尚未输出、且不会再被后续命中覆盖的文本，其中的命中已被屏蔽
+
+        之后产生的命中都起始于该位置之后，因此已输出的内容无需撤回
+        """
+        boundary = max(len(self.offsets) - self.hold, 0)
+        if self.finished or boundary >= len(self.offsets):
+            safe = len(self.text)
+        else:
+            safe = self.offsets[boundary]
+        if safe <= self.emitted:
+            return ""
+        piece = mask_spans(
+            self.text[self.emitted:safe], self.hits,
+            mask_char or settings.SENSITIVE_MASK_CHAR, self.emitted
+        )
+        self.emitted = safe
+        return piece
+
+    def masked_text(self, mask_char: Optional[str] = None) -> str:
+        """返回屏蔽全部命中后的完整文本"""
+        return mask_spans(self.text, self.hits, mask_char or settings.SENSITIVE_MASK_CHAR)
+
+    def result(self) -> Dict[str, Any]:
+        """汇总命中，返回格式同 count_text（first 模式）"""
+        word_counts = {}
+        highest_severity = 0
+        for _, _, word_info in select_matches(iter(self.hits), "first"):
+            word_counts[word_info["id"]] = word_counts.get(word_info["id"], 0) + 1
+            severity = word_info.get("severity", 1)
+            if severity > highest_severity:
+                highest_severity = severity
+        return {
+            "contains_sensitive_words": len(word_counts) > 0,
+            "word_counts": word_counts,
+            "highest_severity": highest_severity,
+            "generation": self.lexicon.generation
+        }
+
+class SensitiveWordFilter:
+    def __init__(self, engine: Optional[str] = None, normalizer: Optional[TextNormalizer] = None):
+        engine = engine or settings.SENSITIVE_FILTER_ENGINE
+        if engine not in FILTER_ENGINES:
+            raise ValueError(f"无效的匹配引擎: {engine}。有效引擎: {', '.join(FILTER_ENGINES)}")
+        self.engine = engine
+        self.normalizer = normalizer or TextNormalizer.from_settings()
+        self.generation = 0
+        self.lexicon = Lexicon(engine, {}, self.generation, self.normalizer)  # 当前发布的词库快照
+        self._rebuild_handle = None
+        self._rebuild_source = None  # 正在线程中进行的构建（重建时为源快照，完整加载时为敏感词字典）
+        self._rebuild_replay = []  # 重建期间的增量修改，重建完成后重新应用到新快照
+        self._draft = None  # batch_edit 中尚未发布的词库副本
+        self._draft_ops = []  # 副本上已应用的增量修改
+        self._batch_snapshot = None  # (词库快照, 版本号, 批量检查快照路径)
+        self._memory_report = None  # (词库快照的弱引用, 内存占用报告)，不延长已替换快照的生命周期
+        # 共享内存模式：紧凑自动机存放在所有worker共同映射的只读段中
+        self.shared = None
+        if engine == "compact" and settings.SENSITIVE_FILTER_SHARED_DIR:
+            self.shared = SharedLexiconStore(settings.SENSITIVE_FILTER_SHARED_DIR, self.normalizer.signature)
+
+    @property
+    def sensitive_words(self) -> Dict[str, Dict[str, Any]]:
+        """当前词库中的敏感词（归一化后）及其信息；每次生成新的字典，复杂度为O(敏感词数)"""
+        return dict(self.lexicon.items())
+
+    @property
+    def _editing(self) -> Lexicon:
+        """增量修改时读取的词库：batch_edit 中为尚未发布的副本，否则为当前快照"""
+        return self._draft if self._draft is not None else self.lexicon
+
+    def get_word_info(self, word: str) -> Optional[Dict[str, Any]]:
+        """查找与给定敏感词归一化结果相同的生效敏感词信息（batch_edit 中包含块内的修改）"""
+        return self._editing.get(self.normalizer.normalize_word(word))
+
+    def word_for_id(self, word_id: str) -> Optional[str]:
+        """根据敏感词ID查找当前生效的敏感词（原始写法，batch_edit 中包含块内的修改）"""
+        word_info = self._editing.word_info(word_id)
+        return word_info["word"] if word_info is not None else None
+
+    @staticmethod
+    def word_info_from_document(document: Dict[str, Any]) -> Dict[str, Any]:
+        """从数据库文档中提取敏感词的完整信息"""
+        return {
+            "id": str(document.get("_id")),
+            "word": document.get("word", ""),
+            "category": document.get("category"),
+            "subcategory": document.get("subcategory"),
+            "severity": document.get("severity", 1)
+        }
+
+    async def fetch_sensitive_words(self) -> Dict[str, Dict[str, Any]]:
+        """从数据库读取全部敏感词，返回 归一化后的敏感词 -> 敏感词信息 的字典"""
+        sensitive_words = {}
+
+        # 从数据库获取敏感词
+        cursor = db.db.sensitive_words.find({})
+        async for document in cursor:
+            word = self.normalizer.normalize_word(document.get("word", ""))
+            if word:
+                sensitive_words[word] = self.word_info_from_document(document)
+        return sensitive_words
+
+    async def load_sensitive_words(self):
+        """从数据库加载敏感词，在线程中旁路构建，完成后一次性替换当前词库"""
+        await self.publish_in_background(await self.fetch_sensitive_words())
+
+    def publish(self, sensitive_words: Dict[str, Dict[str, Any]], content_hash: Optional[int] = None) -> Lexicon:
+        """由敏感词字典构建新的词库快照，并通过一次引用替换发布"""
+        self._cancel_rebuild()
+        self.generation += 1
+        lexicon = self._build_lexicon(sensitive_words, self.generation, content_hash)
+        self._install(lexicon)
+        return lexicon
+
+    async def publish_in_background(
+        self, sensitive_words: Dict[str, Dict[str, Any]], content_hash: Optional[int] = None
+    ) -> Optional[Lexicon]:
+        """
+        在线程中由敏感词字典构建新的词库快照，完成后回到事件循环通过一次引用替换发布
+
+        构建期间当前快照继续提供服务，期间的增量修改在发布前重新应用到新快照；
+        构建期间又开始了新的完整加载时丢弃本次结果，返回None
+        """
+        self._cancel_rebuild()
+        self.generation += 1
+        return await self._build_in_background(
+            sensitive_words, self._build_lexicon, sensitive_words, self.generation, content_hash
+        )
+
+    def _build_lexicon(
+        self, sensitive_words: Dict[str, Dict[str, Any]], generation: int, content_hash: Optional[int]
+    ) -> Lexicon:
+        """构建词库快照但不发布；不访问事件循环中的状态，可以在线程中执行"""
+        lexicon = Lexicon(self.engine, sensitive_words, generation, self.normalizer)
+        lexicon._content_hash = content_hash
+        if self.shared is not None:
+            self._attach_shared(lexicon)
+        else:
+            lexicon.compile()
+        return lexicon
+
+    def _install(self, lexicon: Lexicon):
+        """通过一次引用替换发布词库快照"""
+        self.lexicon = lexicon
+        if self.shared is not None and lexicon.compact.buffer is None:
+            # 其他worker正在发布共享段，稍后重试挂载
+            self._schedule_rebuild()
+
+    def _attach_shared(self, lexicon: Lexicon):
+        """
+        挂载与词库内容一致的共享段，不存在时由本worker构建并发布
+
+        其他worker正在发布时暂时使用私有的紧凑自动机，并稍后重试挂载。
+        转移表和打包的敏感词信息都在worker之间共享，挂载时不解码敏感词信息
+        """
+        content_hash = lexicon.content_hash
+        trie = self.shared.attach(content_hash) or self.shared.try_publish(lexicon.base_words, content_hash)
+        if trie is None:
+            lexicon.compile()
+        else:
+            lexicon.use_compact(trie)
+
+    def publish_compact(self, trie: CompactTrie) -> Lexicon:
+        """
+        由已编译的紧凑自动机（如磁盘快照）发布词库快照
+
+        无论配置的是哪种引擎，都直接使用该自动机匹配，不在事件循环中构建对象Trie；
+        automaton 引擎在之后的增量修改触发后台重建时才换回对象Trie。
+        调用方需保证该自动机按当前的归一化配置构建
+        """
+        self._cancel_rebuild()
+        self.generation += 1
+        lexicon = Lexicon(self.engine, {}, self.generation, self.normalizer)
+        lexicon.use_compact(trie)
+        self.lexicon = lexicon
+        return lexicon
+
+    @contextmanager
+    def batch_edit(self):
+        """
+        批量增量修改（写时复制）
+
+        块内的 add_word / remove_word 应用到当前快照的副本（只复制修改层）上，块结束时通过一次引用替换发布，
+        已发布的快照不会被修改，线程中的扫描不受影响。块内抛出异常时丢弃全部修改。
+        块内不能 await：副本尚未发布，其他协程的增量修改会相互覆盖
+        """
+        if self._draft is not None:
+            # 嵌套调用并入外层的批量修改
+            yield
+            return
+        draft = self._draft = self.lexicon.copy()
+        self._draft_ops = []
+        try:
+            yield
+        finally:
+            ops, self._draft, self._draft_ops = self._draft_ops, None, []
+        if not ops:
+            return
+        self.generation += 1
+        draft.generation = self.generation
+        if self._rebuild_source is not None:
+            self._rebuild_replay.extend(ops)
+        self.lexicon = draft
+        self._schedule_rebuild()
+
+    def add_word(self, word_info: Dict[str, Any]):
+        """
+        增量添加（或更新）一个敏感词
+
+        不在 batch_edit 中时单独复制并发布一次快照，复杂度与自上次重建以来的修改数量成正比；
+        匹配结构的重建会延迟合并、在线程中执行，重建前的检查结果依然准确
+        """
+        if not word_info.get("word"):
+            return
+        with self.batch_edit():
+            self._draft.add_word(word_info)
+            self._draft_ops.append(("add", word_info))
+
+    def remove_word(self, word: str) -> bool:
+        """增量删除一个敏感词，不在 batch_edit 中时单独复制并发布一次快照"""
+        if self.get_word_info(word) is None:
+            return False
+        with self.batch_edit():
+            self._draft.remove_word(word)
+            self._draft_ops.append(("remove", word))
+        return True
+
+    def _needs_rebuild(self, lexicon: Lexicon) -> bool:
+        # 共享内存模式下，尚未挂载到共享段的私有自动机也需要重建
+        detached = self.shared is not None and lexicon.compact is not None and lexicon.compact.buffer is None
+        return lexicon.stale or detached
+
+    def _schedule_rebuild(self):
+        """延迟合并执行重建；正在重建时由其完成后再安排"""
+        if self._rebuild_handle is not None or self._rebuild_source is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中（如脚本调用），直接重建；共享段的挂载重试只在事件循环中进行
+            if self.lexicon.stale:
+                self.rebuild()
+            return
+        self._rebuild_handle = loop.call_later(
+            settings.SENSITIVE_FILTER_REBUILD_DELAY, self._start_rebuild
+        )
+
+    def _start_rebuild(self):
+        self._rebuild_handle = None
+        if self._needs_rebuild(self.lexicon):
+            asyncio.ensure_future(self._rebuild_in_background())
+
+    async def _rebuild_in_background(self):
+        """
+        在线程中构建新的匹配结构，完成后回到事件循环发布
+
+        构建耗时与词库大小成正比（20万词约数秒），不能阻塞事件循环
+        """
+        source = self.lexicon
+        try:
+            await self._build_in_background(source, self._rebuild_lexicon, source)
+        except Exception as e:
+            print(f"重建敏感词词库出错: {str(e)}")
+
+    async def _build_in_background(self, source: Any, build: Callable[..., Lexicon], *args) -> Optional[Lexicon]:
+        """
+        在线程中执行 build(*args) 构建词库快照，完成后回到事件循环发布
+
+        source 标识本次构建：构建期间的增量修改记录下来，发布前重新应用到新快照；
+        构建期间词库被完整重新加载（正在进行的构建不再是 source）时丢弃结果，返回None
+        """
+        self._rebuild_source = source
+        self._rebuild_replay = []
+        replay = None
+        try:
+            lexicon = await asyncio.get_running_loop().run_in_executor(None, build, *args)
+        finally:
+            if self._rebuild_source is source:
+                self._rebuild_source = None
+                replay, self._rebuild_replay = self._rebuild_replay, []
+        if replay is None:
+            return None
+        for op, value in replay:
+            if op == "add":
+                lexicon.add_word(value)
+            else:
+                lexicon.remove_word(value)
+        lexicon.generation = self.generation
+        self._install(lexicon)
+        if lexicon.stale:
+            self._schedule_rebuild()
+        return lexicon
+
+    def _rebuild_lexicon(self, source: Lexicon) -> Lexicon:
+        """将快照的修改层合并到基础词库，构建新的快照；已发布的快照不会被修改，可以在线程中执行"""
+        return self._build_lexicon(dict(source.items()), source.generation, source._content_hash)
+
+    def _cancel_rebuild(self):
+        if self._rebuild_handle is not None:
+            self._rebuild_handle.cancel()
+            self._rebuild_handle = None
+        # 正在线程中进行的重建完成后被丢弃
+        self._rebuild_source = None
+        self._rebuild_replay = []
+
+    def rebuild(self):
+        """由内存中的敏感词同步重建词库快照并发布，不访问数据库；在事件循环中重建会自动转到线程中执行"""
+        self._cancel_rebuild()
+        lexicon = self.lexicon
+        if self._needs_rebuild(lexicon):
+            self.publish(dict(lexicon.items()), lexicon._content_hash)
+
+    @staticmethod
+    def _original_spans(
+        matches: Iterator[Tuple[int, int, Dict[str, Any]]], offsets: List[int]
+    ) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """将归一化文本中的命中区间换算为原文中的区间"""
+        for start, end, word_info in matches:
+            yield offsets[start], offsets[end - 1] + 1, word_info
+
+    def _scan(self, lexicon: Lexicon, text: str, mode: str) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """归一化（含转为小写）后按匹配模式扫描，返回原文中的命中区间"""
+        if mode not in MATCH_MODES:
+            raise ValueError(f"无效的匹配模式: {mode}。有效模式: {', '.join(MATCH_MODES)}")
+        if not text:
+            return iter(())
+        normalized, offsets = lexicon.normalizer.normalize(text)
+        return self._original_spans(lexicon.iter_matches(normalized, mode), offsets)
+
+    def _build_result(self, matches: Iterator[Tuple[int, int, Dict[str, Any]]], generation: int) -> Dict[str, Any]:
+        """将匹配结果汇总为check_text的返回格式"""
+        found_words = []
+        highest_severity = 0
+
+        for start, end, info in matches:
+            # 使用原始敏感词信息，并附加命中在原文中的区间
+            word_info = info.copy()
+            word_info["start"] = start
+            word_info["end"] = end
+            found_words.append(word_info)
+
+            # 更新最高严重程度
+            severity = word_info.get("severity", 1)
+            if severity > highest_severity:
+                highest_severity = severity
+
         return {
             "contains_sensitive_words": len(found_words) > 0,
             "sensitive_words_found": found_words,
-            "highest_severity": highest_severity
+            "highest_severity": highest_severity,
+            "generation": generation
         }
 
+    def check_text(self, text: str, mode: str = "first") -> Dict[str, Any]:
+        """
+        检查文本是否包含敏感词（AC自动机，单遍线性扫描）
+
+        Args:
+            text: 要检查的文本
+            mode: 匹配模式，first（每个起点处最短的敏感词）、longest（每个起点处最长的敏感词）
+                  或 all（所有可重叠的命中）
+
+        Returns:
+            Dict[str, Any]: {
+                "contains_sensitive_words": bool,
+                "sensitive_words_found": List[Dict],  # 按起点排序，start/end 为命中在原文中的区间
+                "highest_severity": int,
+                "generation": int  # 本次检查使用的词库版本号
+            }
+        """
+        # 整个检查过程只使用同一个词库快照
+        lexicon = self.lexicon
+        return self._build_result(self._scan(lexicon, text, mode), lexicon.generation)
+
+    def mask_text(self, text: str, mask_char: Optional[str] = None, mode: str = "longest") -> Dict[str, Any]:
+        """
+        检查文本并将命中的区间替换为屏蔽字符，只扫描一次
+
+        重叠的命中会合并后屏蔽，区间内的干扰字符一并屏蔽，屏蔽后文本长度不变
+
+        Returns:
+            Dict[str, Any]: check_text 的返回内容，另含 "masked_text" 和 "word_counts"（同 count_text）
+        """
+        mask_char = mask_char or settings.SENSITIVE_MASK_CHAR
+        lexicon = self.lexicon
+        matches = list(self._scan(lexicon, text, mode))
+        result = self._build_result(iter(matches), lexicon.generation)
+        word_counts = {}
+        for _, _, word_info in matches:
+            word_counts[word_info["id"]] = word_counts.get(word_info["id"], 0) + 1
+        result["word_counts"] = word_counts
+
+        result["masked_text"] = mask_spans(text, matches, mask_char)
+        return result
+
+    def count_text(self, text: str, mode: str = "first", positions: bool = False) -> Dict[str, Any]:
+        """
+        统计文本中各敏感词的命中次数，返回敏感词ID而不复制敏感词信息
+
+        同一敏感词重复出现时只占一个条目，结果大小与文本中不同敏感词的数量相关，
+        敏感词信息可按需通过 resolve_words / summarize_words 查询
+
+        Args:
+            text: 要检查的文本
+            mode: 匹配模式，同 check_text
+            positions: 是否返回命中位置（每个敏感词最多 SENSITIVE_MAX_POSITIONS 个）
+
+        Returns:
+            Dict[str, Any]: {
+                "contains_sensitive_words": bool,
+                "word_counts": Dict[str, int],  # 敏感词ID -> 命中次数
+                "positions": Dict[str, List[Tuple[int, int]]],  # 仅 positions=True 时返回，原文中的区间
+                "highest_severity": int,
+                "generation": int
+            }
+        """
+        if mode not in MATCH_MODES:
+            raise ValueError(f"无效的匹配模式: {mode}。有效模式: {', '.join(MATCH_MODES)}")
+        lexicon = self.lexicon
+        word_counts = {}
+        spans = {}
+        if text:
+            normalized, offsets = lexicon.normalizer.normalize(text)
+            position_limit = settings.SENSITIVE_MAX_POSITIONS if positions else 0
+            word_counts, spans = lexicon.tally_matches(normalized, mode, position_limit)
+
+        highest_severity = 0
+        for word_id in word_counts:
+            word_info = lexicon.word_info(word_id)
+            severity = word_info.get("severity", 1) if word_info is not None else 1
+            if severity > highest_severity:
+                highest_severity = severity
+
+        result = {
+            "contains_sensitive_words": len(word_counts) > 0,
+            "word_counts": word_counts,
+            "highest_severity": highest_severity,
+            "generation": lexicon.generation
+        }
+        if positions:
+            result["positions"] = {
+                word_id: [(offsets[start], offsets[end - 1] + 1) for start, end in word_spans]
+                for word_id, word_spans in spans.items()
+            }
+        return result
+
+    def resolve_words(self, word_ids: List[str]) -> List[Dict[str, Any]]:
+        """从当前词库查询敏感词信息，已被删除的敏感词会被跳过"""
+        lexicon = self.lexicon
+        found_words = []
+        for word_id in word_ids:
+            word_info = lexicon.word_info(word_id)
+            if word_info is not None:
+                found_words.append(word_info.copy())
+        return found_words
+
+    def summarize_words(self, word_counts: Dict[str, int], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        将命中次数汇总为去重后的敏感词列表，用于写入消息和敏感词记录
+
+        按严重程度、命中次数降序排列，最多保留 limit（默认 SENSITIVE_MAX_STORED_WORDS）个敏感词
+        """
+        limit = limit or settings.SENSITIVE_MAX_STORED_WORDS
+        found_words = self.resolve_words(list(word_counts))
+        for word_info in found_words:
+            word_info["count"] = word_counts[word_info["id"]]
+        found_words.sort(key=lambda info: (info.get("severity", 1), info["count"]), reverse=True)
+        return found_words[:limit]
+
+    def stream_matcher(self) -> StreamMatcher:
+        """
+        创建流式匹配器，用于逐段检查模型输出
+
+        尚未重建的增量修改由 pending Trie 增量匹配，不在请求中触发重建
+        """
+        return StreamMatcher(self.lexicon)
+
+    def check_many(self, texts: List[str], mode: str = "first") -> List[Dict[str, Any]]:
+        """
+        批量检查文本，返回与 texts 一一对应的 count_text 结果
+
+        数量未超过 SENSITIVE_BATCH_PARALLEL_THRESHOLD 时在当前进程中逐条检查；
+        超过时按 SENSITIVE_BATCH_CHUNK_SIZE 分片，由进程池并行检查。
+        子进程以只读方式映射同一个词库快照，不重复构建匹配结构。
+        该方法会阻塞直到全部完成，在事件循环中应放到线程中调用
+        """
+        if mode not in MATCH_MODES:
+            raise ValueError(f"无效的匹配模式: {mode}。有效模式: {', '.join(MATCH_MODES)}")
+        if settings.SENSITIVE_BATCH_WORKERS <= 1 or len(texts) <= settings.SENSITIVE_BATCH_PARALLEL_THRESHOLD:
+            return [self.count_text(text, mode) for text in texts]
+
+        path, generation = self._export_batch_snapshot()
+        chunk_size = settings.SENSITIVE_BATCH_CHUNK_SIZE
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        results = []
+        for chunk_results in get_batch_pool().map(_check_batch_chunk, repeat(path), repeat(mode), chunks):
+            for result in chunk_results:
+                result["generation"] = generation
+            results.extend(chunk_results)
+        return results
+
+    def _export_batch_snapshot(self) -> Tuple[str, int]:
+        """
+        将当前词库写入供批量检查子进程映射的快照
+
+        快照以词库哈希和归一化配置命名，内容相同且格式版本一致时复用已有文件
+
+        Returns:
+            Tuple[str, int]: 快照路径和对应的词库版本号
+        """
+        lexicon = self.lexicon
+        generation = lexicon.generation
+        cached = self._batch_snapshot
+        if cached is not None and cached[0] is lexicon and cached[1] == generation and os.path.exists(cached[2]):
+            return cached[2], generation
+
+        # 已发布的快照不会被修改（写时复制），可以在线程中直接读取
+        sensitive_words = dict(lexicon.items())
+        content_hash = format_lexicon_hash(lexicon_hash(sensitive_words))
+        directory = settings.SENSITIVE_BATCH_DIR or os.path.join(tempfile.gettempdir(), "llm-filter-batch")
+        name = f"{BATCH_SNAPSHOT_PREFIX}{content_hash}-{self.normalizer.signature}.snap"
+        path = os.path.join(directory, name)
+        # 文件不存在或是升级前的旧格式时重新写入
+        try:
+            read_snapshot_header(path)
+        except SnapshotError:
+            write_snapshot(path, CompactTrie.build(sensitive_words), {
+                "lexicon_hash": content_hash,
+                "normalizer": self.normalizer.signature
+            })
+            prune_snapshots(directory, BATCH_SNAPSHOT_PREFIX, name, KEEP_PREVIOUS_BATCH_SNAPSHOTS)
+        self._batch_snapshot = (lexicon, generation, path)
+        return path, generation
+
+    def check_text_trie(self, text: str) -> Dict[str, Any]:
+        """
+        使用朴素Trie遍历检查文本，返回格式与 first 模式的 check_text 相同
+
+        仅作为AC自动机的参考实现，用于测试和结果比对；
+        compact 引擎，以及从快照发布后尚未重建的 automaton 引擎都没有对象Trie，此时需使用由词库字典发布的 automaton 引擎过滤器
+        """
+        lexicon = self.lexicon
+        if not text:
+            return self._build_result(iter(()), lexicon.generation)
+
+        normalized, offsets = lexicon.normalizer.normalize(text)
+        matches = self._original_spans(lexicon.iter_matches_trie(normalized), offsets)
+        return self._build_result(matches, lexicon.generation)
+
+    def memory_report(self) -> Dict[str, Any]:
+        """
+        对比对象Trie与紧凑自动机的内存占用
+
+        只测量当前词库快照实际使用的匹配结构，另一种结构按状态数、转移和敏感词信息估算，不重新构建；
+        测量需要遍历整个匹配结构，应在线程中调用。结果按词库快照缓存
+        """
+        lexicon = self.lexicon
+        cached = self._memory_report
+        if cached is not None and cached[0]() is lexicon:
+            return cached[1]
+
+        compact = lexicon.compact
+        if compact is not None:
+            state_count = compact.state_count
+            compact_bytes = compact.nbytes()
+            # 对象Trie的 automaton 引擎同时保留敏感词字典
+            words = {}
+            for index in range(compact.word_count):
+                words[str(index)] = None
+            trie_bytes = _estimated_trie_bytes(compact) + sys.getsizeof(words)
+            measured = "compact"
+        else:
+            state_count, trie_bytes = _trie_bytes(lexicon.root)
+            trie_bytes += sys.getsizeof(lexicon.base_words)
+            compact_bytes = CompactTrie.estimate_nbytes(state_count, lexicon.base_words.values())
+            measured = "automaton"
+
+        report = {
+            "engine": self.engine,
+            "generation": lexicon.generation,
+            "word_count": lexicon.word_count,
+            "measured": measured,
+            "trie_node_count": state_count,
+            "trie_bytes": trie_bytes,
+            "compact_state_count": state_count,
+            "compact_shared": compact is not None and compact.buffer is not None,
+            "compact_bytes": compact_bytes,
+            "compression_ratio": round(trie_bytes / compact_bytes, 2) if compact_bytes else 0
+        }
+        self._memory_report = (weakref.ref(lexicon), report)
+        return report
+
+# 批量检查使用的进程池，首次需要并行检查时创建
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+# 批量检查子进程中缓存的过滤器：(快照路径, 过滤器)
+_batch_worker_filter = None
+
+def get_batch_pool() -> ProcessPoolExecutor:
+    """获取批量检查进程池"""
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            # 使用spawn启动子进程，避免fork继承事件循环和数据库连接的状态
+            _batch_pool = ProcessPoolExecutor(
+                max_workers=settings.SENSITIVE_BATCH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _batch_pool
+
+def shutdown_batch_pool():
+    """关闭批量检查进程池"""
+    global _batch_pool
+    with _batch_pool_lock:
+        pool = _batch_pool
+        _batch_pool = None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def _check_batch_chunk(path: str, mode: str, texts: List[str]) -> List[Dict[str, Any]]:
+    """在批量检查子进程中执行：映射词库快照（同一快照只映射一次）并检查一组文本"""
+    global _batch_worker_filter
+    if _batch_worker_filter is None or _batch_worker_filter[0] != path:
+        trie, header = load_snapshot(path)
+        worker_filter = SensitiveWordFilter("compact")
+        if header.get("normalizer") != worker_filter.normalizer.signature:
+            raise SnapshotError("批量检查快照的归一化配置与子进程的配置不一致")
+        worker_filter.publish_compact(trie)
+        _batch_worker_filter = (path, worker_filter)
+    worker_filter = _batch_worker_filter[1]
+    return [worker_filter.count_text(text, mode) for text in texts]
+
 # 创建全局敏感词过滤器实例
 sensitive_word_filter = SensitiveWordFilter()
\ No newline at end of file
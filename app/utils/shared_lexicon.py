@@ -0,0 +1,130 @@
+import os
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支持共享内存模式
+    fcntl = None
+from app.utils.compact_trie import CompactTrie
+from app.utils.lexicon_snapshot import (
+    SnapshotError, format_lexicon_hash, load_snapshot, read_snapshot_header, write_snapshot
+)
+
+# 指向当前发布段的指针文件名
+POINTER_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+SEGMENT_PREFIX = "lexicon-"
+# 除当前段外额外保留的旧段数量，仍在使用旧段的worker可以继续读取
+KEEP_PREVIOUS_SEGMENTS = 1
+
+class SharedLexiconStore:
+    """
+    多个worker进程共享的只读词库段
+
+    每个段是一个以词库哈希命名的快照文件，各worker以只读方式内存映射同一个段，
+    物理内存由操作系统页缓存共享，不随worker数量线性增长。
+    敏感词信息以打包的列存放在段中，同样随映射共享，只在命中或查询时按编号解码。
+    发布新段时先完整写入段文件，再原子替换指针文件。
+    目录建议放在 /dev/shm 等内存文件系统上。
+    """
+
+    def __init__(self, directory: str, normalizer: str):
+        if fcntl is None:
+            raise RuntimeError("当前平台不支持共享内存词库模式")
+        self.directory = directory
+        self.normalizer = normalizer  # 归一化配置指纹，只挂载按相同规则构建的段
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def read_current(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """读取指针文件，返回当前段的路径和头部；尚未发布或段已损坏时返回None"""
+        try:
+            with open(self._path(POINTER_FILE), "r", encoding="utf-8") as f:
+                name = f.read().strip()
+            path = self._path(name)
+            return path, read_snapshot_header(path)
+        except (OSError, SnapshotError):
+            return None
+
+    def attach(self, content_hash: int) -> Optional[CompactTrie]:
+        """当前段与给定词库哈希及归一化配置一致时，映射并返回该段"""
+        current = self.read_current()
+        if current is None:
+            return None
+        path, header = current
+        if header.get("lexicon_hash") != format_lexicon_hash(content_hash):
+            return None
+        if header.get("normalizer") != self.normalizer:
+            return None
+        try:
+            trie, _ = load_snapshot(path)
+        except SnapshotError:
+            return None
+        return trie
+
+    def try_publish(self, sensitive_words: Dict[str, Dict[str, Any]], content_hash: int) -> Optional[CompactTrie]:
+        """
+        构建并发布新段
+
+        使用非阻塞文件锁保证同一时刻只有一个worker在构建；
+        锁被占用时返回None，由调用方稍后重试挂载其他worker发布的段
+
+        Returns:
+            Optional[CompactTrie]: 映射自共享段的紧凑自动机
+        """
+        with open(self._path(LOCK_FILE), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                # 获取锁期间其他worker可能已经发布了相同内容的段
+                trie = self.attach(content_hash)
+                if trie is not None:
+                    return trie
+
+                lexicon_hash = format_lexicon_hash(content_hash)
+                name = f"{SEGMENT_PREFIX}{lexicon_hash}-{self.normalizer}.snap"
+                path = self._path(name)
+                write_snapshot(path, CompactTrie.build(sensitive_words), {
+                    "lexicon_hash": lexicon_hash,
+                    "normalizer": self.normalizer
+                })
+
+                # 原子替换指针文件，完成发布
+                pointer_tmp = self._path(f"{POINTER_FILE}.tmp.{os.getpid()}")
+                with open(pointer_tmp, "w", encoding="utf-8") as f:
+                    f.write(name)
+                os.replace(pointer_tmp, self._path(POINTER_FILE))
+                self._prune(name)
+
+                trie, _ = load_snapshot(path)
+                return trie
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _prune(self, current: str):
+        """删除较旧的段；已映射这些段的进程在解除映射前仍可正常读取"""
+        prune_snapshots(self.directory, SEGMENT_PREFIX, current, KEEP_PREVIOUS_SEGMENTS)
+
+def prune_snapshots(directory: str, prefix: str, current: str, keep: int):
+    """
+    删除目录中以 prefix 开头的较旧快照文件，除 current 外按修改时间保留最新的 keep 个
+
+    已映射这些快照的进程在解除映射前仍可正常读取
+    """
+    snapshots = sorted(
+        (
+            entry for entry in os.scandir(directory)
+            if entry.name.startswith(prefix) and entry.name.endswith(".snap") and entry.name != current
+        ),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in snapshots[keep:]:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
@@ -0,0 +1,30 @@
+import argparse
+import asyncio
+from app.core.config import settings
+from app.db.mongodb import connect_to_mongo, close_mongo_connection
+from app.services.lexicon_sync import build_lexicon_snapshot
+
+async def main(path: str):
+    # 连接到MongoDB
+    await connect_to_mongo()
+    try:
+        header = await build_lexicon_snapshot(path)
+    finally:
+        await close_mongo_connection()
+    
+    print(f"已生成敏感词快照: {path}")
+    print(f"敏感词数量: {header['word_count']}，自动机状态数: {header['state_count']}")
+    print(f"词库哈希: {header['lexicon_hash']}")
+    print(f"变更日志版本: {header['lexicon_version']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从数据库编译敏感词快照，供worker启动时快速加载")
+    parser.add_argument(
+        "-o", "--output",
+        default=settings.SENSITIVE_FILTER_SNAPSHOT_PATH,
+        help="快照文件路径，默认使用 SENSITIVE_FILTER_SNAPSHOT_PATH"
+    )
+    args = parser.parse_args()
+    if not args.output:
+        parser.error("请通过 --output 或 SENSITIVE_FILTER_SNAPSHOT_PATH 指定快照文件路径")
+    asyncio.run(main(args.output))
@@ -3,6 +3,7 @@ import motor.motor_asyncio
 from datetime import datetime
 from bson import ObjectId
 from passlib.context import CryptContext
+from app.db.indexes import ensure_indexes
 
 # 密码加密工具
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -138,27 +139,39 @@ async def init_db():
     await db.sensitive_words.insert_many(sensitive_words)
     print(f"已创建敏感词集合并添加 {len(sensitive_words)} 条记录")
     
-    # 创建对话集合并添加假数据
+    # 创建对话集合并添加假数据（消息保存在 messages 集合中）
     conversation_id = ObjectId()
+    messages = [
+        {
+            "conversation_id": conversation_id,
+            "seq": 0,
+            "role": "user",
+            "content": "你好，请问你是谁？",
+            "timestamp": datetime.now(),
+            "contains_sensitive_words": False,
+            "sensitive_words_found": []
+        },
+        {
+            "conversation_id": conversation_id,
+            "seq": 1,
+            "role": "assistant",
+            "content": "你好！我是一个AI助手，可以回答你的问题和提供帮助。有什么我可以帮你的吗？",
+            "timestamp": datetime.now(),
+            "contains_sensitive_words": False,
+            "sensitive_words_found": []
+        }
+    ]
     conversations = [
         {
             "_id": conversation_id,
             "user_id": user_id,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": "你好，请问你是谁？",
-                    "timestamp": datetime.now(),
-                    "contains_sensitive_words": False,
-                    "sensitive_words_found": []
-                },
-                {
-                    "role": "assistant",
-                    "content": "你好！我是一个AI助手，可以回答你的问题和提供帮助。有什么我可以帮你的吗？",
-                    "timestamp": datetime.now(),
-                    "contains_sensitive_words": False,
-                    "sensitive_words_found": []
-                }
+            "title": messages[0]["content"],
+            "preview": messages[-1]["content"],
+            "message_count": len(messages),
+            "saved_message_count": len(messages),
+            "recent_messages": [
+                {field: message[field] for field in ("seq", "role", "content", "timestamp")}
+                for message in messages
             ],
             "created_at": datetime.now(),
             "updated_at": datetime.now()
@@ -168,6 +181,9 @@ async def init_db():
     await db.conversations.insert_many(conversations)
     print(f"已创建对话集合并添加 {len(conversations)} 条记录")
     
+    await db.messages.insert_many(messages)
+    print(f"已创建消息集合并添加 {len(messages)} 条记录")
+    
     # 创建敏感词记录集合并添加假数据
     sensitive_records = [
         {
@@ -211,6 +227,10 @@ async def init_db():
     await db.sensitive_records.insert_many(sensitive_records)
     print(f"已创建敏感词记录集合并添加 {len(sensitive_records)} 条记录")
     
+    # 创建索引注册表中的全部索引
+    await ensure_indexes(database=db)
+    print("已创建索引")
+    
     print("\n数据库初始化完成！")
     print("\n测试账号:")
     print("管理员账号: admin / admin123")
@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+from app.db.mongodb import connect_to_mongo, close_mongo_connection
+from app.db.indexes import ensure_indexes, index_report
+
+async def main(report: bool):
+    # 连接到MongoDB
+    await connect_to_mongo()
+    try:
+        if report:
+            result = await index_report()
+        else:
+            ensured = await ensure_indexes()
+    finally:
+        await close_mongo_connection()
+
+    if not report:
+        for name, indexes in ensured.items():
+            print(f"{name}: {', '.join(indexes)}")
+        return
+
+    for name, info in result["collections"].items():
+        print(f"[{name}]")
+        print(f"  缺少的索引: {', '.join(info['missing']) or '无'}")
+        print(f"  未使用的索引: {', '.join(info['unused']) or '无'}")
+        print(f"  不在注册表中的索引: {', '.join(info['undeclared']) or '无'}")
+        for index, ops in info["usage"].items():
+            print(f"  {index}: 使用 {ops} 次")
+    if result["slow_queries"]:
+        print("需要全表扫描或内存排序的查询:")
+        for query in result["slow_queries"]:
+            print(f"  {query['collection']} {query['query']} 排序 {query['sort']}: {', '.join(query['issues'])}")
+    else:
+        print("所有已登记的查询都使用了索引")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="创建索引注册表（app/db/indexes.py）中的索引，或检查缺少和未使用的索引")
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="不创建索引，只报告缺少、未使用的索引（$indexStats）和未使用索引的查询（explain）"
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.report))
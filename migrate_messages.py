@@ -0,0 +1,23 @@
+import asyncio
+from app.db.mongodb import connect_to_mongo, close_mongo_connection
+from app.services.message_store import (
+    migrate_embedded_messages, backfill_conversation_summaries, backfill_saved_message_counts
+)
+
+async def main():
+    # 连接到MongoDB
+    await connect_to_mongo()
+    try:
+        result = await migrate_embedded_messages()
+        backfilled = await backfill_conversation_summaries()
+        counted = await backfill_saved_message_counts()
+    finally:
+        await close_mongo_connection()
+    
+    print(f"已迁移 {result['conversations']} 个对话，共 {result['messages']} 条消息")
+    print(f"已为 {backfilled} 个对话补全标题和预览")
+    print(f"已为 {counted} 个对话统计已保存的消息数")
+
+if __name__ == "__main__":
+    # 将旧版嵌入在对话文档中的消息迁移到 messages 集合，并补全对话列表使用的标题、预览和消息数；请在停止服务后执行，可重复执行
+    asyncio.run(main())